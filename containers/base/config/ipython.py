@@ -16,17 +16,23 @@
 
 c = get_config()
 
-# Implicitly imported packages.
+# The Datalab kernel extensions and the inline matplotlib backend are
+# loaded on first use by the lazy_extensions shim, rather than at kernel
+# startup; see /datalab/lib/kernel/lazy_extensions.py. cell_profile adds
+# the %cellprofile magic; cells are only measured once it is turned on.
+# memo adds the %%memo magic, which caches the results of cells on the
+# persistent disk; datacache adds %datacache, which caches the DataFrames
+# read from GCS and BigQuery there too. dataframe_display shows large
+# DataFrames a page at a time. output_governor limits the output of
+# cells, as set in the user settings.
 c.InteractiveShellApp.extensions = [
-  'google.datalab.kernel',
-  'datalab.kernel',
-  'matplotlib',
-  'seaborn',
+  'lazy_extensions',
+  'cell_profile',
+  'memo',
+  'datacache',
+  'dataframe_display',
+  'output_governor',
 ]
 
 # Startup code.
 c.InteractiveShellApp.exec_lines = []
-
-# Enable matplotlib renderings to show up inline in the notebook.
-c.InteractiveShellApp.matplotlib = 'inline'
-
@@ -21,3 +21,47 @@ c = get_config()
 c.TemplateExporter.template_path.insert(0, nbconvert_dir)
 c.HTMLExporter.template_file = 'html'
 c.NotebookApp.disable_check_xsrf = True
+
+# Keep pre-started kernels around so that opening a notebook does not have
+# to wait for a kernel to start, and evict idle kernels when the machine
+# runs low on memory. The pool size and memory limits are passed on the
+# command line from the Datalab server settings.
+c.NotebookApp.kernel_manager_class = (
+    'kernel_memory.EvictingMappingKernelManager')
+c.EvictingMappingKernelManager.eviction_available_memory_mb = 384
+c.EvictingMappingKernelManager.eviction_min_idle_seconds = 5 * 60
+
+# Launch each kernel in a cgroup of its own, with an equal CPU weight and
+# a memory limit, under the cgroups that the startup script of GCE
+# instances reserves for the kernels. Without them, kernels are launched
+# as usual.
+c.EvictingMappingKernelManager.kernel_manager_class = (
+    'kernel_cgroups.CgroupKernelManager')
+c.CgroupKernelManager.memory_fraction = 0.8
+
+# Shut down kernels that have been idle for a long time, unless a notebook
+# still has them open.
+c.MappingKernelManager.cull_idle_timeout = 3 * 60 * 60
+c.MappingKernelManager.cull_interval = 5 * 60
+c.MappingKernelManager.cull_connected = False
+c.MappingKernelManager.cull_busy = False
+
+# Store large outputs of notebooks in separate files, so that saving a
+# notebook only writes the outputs that changed.
+c.NotebookApp.contents_manager_class = 'output_store.OutputStoreContentsManager'
+
+# Serve the cell profiles of kernels, the CPU and memory they use and the
+# recent kernel evictions, and serve notebook exports from a cache on the
+# persistent disk, dropping the cached exports of a notebook whenever it is
+# saved. Serve downloads of notebooks with their stored outputs, and clean
+# up unused ones. Serve the hashes and chunked transfers that `datalab
+# sync` uses.
+c.NotebookApp.nbserver_extensions = {
+  'cell_profile': True,
+  'file_sync': True,
+  'kernel_cgroups': True,
+  'kernel_memory': True,
+  'nbconvert_cache': True,
+  'output_store': True,
+}
+c.FileContentsManager.post_save_hook = 'nbconvert_cache.post_save_hook'
@@ -4,6 +4,11 @@
 # kernel.
 source activate py2env
 
+# Record when the environment was activated for benchmark_kernel_start.py.
+if [ -n "${DATALAB_KERNEL_PROFILE}" ]; then
+  export DATALAB_KERNEL_ACTIVATED_AT=$(date +%s.%N)
+fi
+
 # Start the Python2 ipykernel
 exec python -m ipykernel $@
 
@@ -0,0 +1,292 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how long the Datalab kernels take to start.
+
+Each kernelspec is launched several times through jupyter_client, and the
+time from the launch request to the reply to a first, trivial
+`execute_request` is broken down into phases:
+
+  activate:      running kernel-startup.sh up to the conda activation
+  ipykernel:     starting Python, ipykernel and IPython
+  extensions:    loading the extensions listed in ipython_config.py
+  ready:         the rest of the startup, until the kernel_info reply
+  first_execute: running the first cell
+
+The peak RSS of the kernel is recorded as well, and the cost of importing
+the modules that used to be loaded at startup is profiled once the kernel
+is ready. Run it inside the Datalab container from the Python 3
+environment:
+
+    python /datalab/lib/kernel/benchmark_kernel_start.py --runs 5 \\
+        --output results.json --baseline baseline.json
+
+With --baseline, the exit status is 1 if the median startup time or
+peak RSS of a kernel regressed by more than the allowed fraction.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import ast
+import json
+import os
+import sys
+import time
+
+from jupyter_client.manager import start_new_kernel
+
+
+_DEFAULT_KERNELS = ['python2', 'python3']
+_DEFAULT_RUNS = 5
+_DEFAULT_IMPORTS = [
+    'google.datalab.kernel', 'datalab.kernel', 'matplotlib.pyplot', 'seaborn',
+]
+_DEFAULT_MAX_REGRESSION = 0.2
+_TIMEOUT_SECONDS = 120
+
+_PHASES = ['activate', 'ipykernel', 'extensions', 'ready', 'first_execute']
+
+# Runs in the kernel after the first cell, and reports the timestamps
+# recorded during startup along with the peak RSS so far.
+_REPORT_CODE = """
+import os as __os, resource as __resource
+try:
+    from lazy_extensions import startup_timings as __timings
+except ImportError:
+    __timings = {}
+__datalab_benchmark = dict(
+    __timings,
+    activated_at=float(__os.environ.get('DATALAB_KERNEL_ACTIVATED_AT', 0)),
+    peak_rss_kb=__resource.getrusage(__resource.RUSAGE_SELF).ru_maxrss)
+del __os, __resource, __timings
+"""
+
+# Imports the given modules one at a time, timing each.
+_IMPORT_PROFILE_CODE = """
+import importlib as __importlib, time as __time
+__datalab_benchmark = {{}}
+for __name in {0!r}:
+    __start = __time.time()
+    try:
+        __importlib.import_module(__name)
+        __datalab_benchmark[__name] = __time.time() - __start
+    except Exception:
+        __datalab_benchmark[__name] = None
+del __importlib, __time, __name, __start
+"""
+
+_RESULT_EXPRESSION = "__import__('json').dumps(__datalab_benchmark)"
+
+
+def run_and_collect(client, code):
+    """Run code in a kernel and return the value of __datalab_benchmark.
+
+    Args:
+      client: A started, blocking kernel client
+      code: The code to run; it must set __datalab_benchmark
+    Returns:
+      The JSON-decoded value of __datalab_benchmark.
+    Raises:
+      RuntimeError: If the code failed
+    """
+    msg_id = client.execute(
+        code, silent=True, store_history=False,
+        user_expressions={'result': _RESULT_EXPRESSION})
+    while True:
+        reply = client.get_shell_msg(timeout=_TIMEOUT_SECONDS)
+        if reply['parent_header'].get('msg_id') == msg_id:
+            break
+    content = reply['content']
+    result = content.get('user_expressions', {}).get('result', {})
+    if content['status'] != 'ok' or result.get('status') != 'ok':
+        raise RuntimeError('Failed to collect benchmark results: {0}'.format(
+            content.get('evalue') or result.get('evalue')))
+    return json.loads(ast.literal_eval(result['data']['text/plain']))
+
+
+def time_kernel_start(kernel_name, code, imports):
+    """Start a kernel, run some code in it, and shut it down.
+
+    Args:
+      kernel_name: The name of the kernelspec to launch
+      code: The code to run once the kernel has started
+      imports: Modules whose import time to profile after the first cell
+    Returns:
+      A dictionary with the duration of each phase and the total in
+      seconds, the peak RSS in MB, and the import times in seconds.
+    """
+    env = dict(os.environ, DATALAB_KERNEL_PROFILE='1')
+    launched_at = time.time()
+    manager, client = start_new_kernel(
+        kernel_name=kernel_name, startup_timeout=_TIMEOUT_SECONDS, env=env)
+    try:
+        ready_at = time.time()
+        client.execute(code)
+        client.get_shell_msg(timeout=_TIMEOUT_SECONDS)
+        executed_at = time.time()
+
+        report = run_and_collect(client, _REPORT_CODE)
+        # Timestamps that the kernel did not record are attributed to the
+        # following phase.
+        activated_at = report.get('activated_at') or launched_at
+        started_at = report.get('extensions_started_at') or activated_at
+        loaded_at = report.get('extensions_loaded_at') or started_at
+        result = {
+            'phases': {
+                'activate': activated_at - launched_at,
+                'ipykernel': started_at - activated_at,
+                'extensions': loaded_at - started_at,
+                'ready': ready_at - loaded_at,
+                'first_execute': executed_at - ready_at,
+            },
+            'total': executed_at - launched_at,
+            'peak_rss_mb': report['peak_rss_kb'] / 1024.0,
+        }
+        if imports:
+            result['imports'] = run_and_collect(
+                client, _IMPORT_PROFILE_CODE.format(list(imports)))
+        return result
+    finally:
+        client.stop_channels()
+        manager.shutdown_kernel(now=True)
+
+
+def median(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def summarize(runs):
+    """Compute the median of every measurement across runs.
+
+    Args:
+      runs: The results of time_kernel_start for one kernelspec
+    Returns:
+      A dictionary shaped like a single run, holding the medians.
+    """
+    summary = {
+        'phases': dict((phase, median(run['phases'][phase] for run in runs))
+                       for phase in _PHASES),
+        'total': median(run['total'] for run in runs),
+        'peak_rss_mb': median(run['peak_rss_mb'] for run in runs),
+    }
+    if runs and 'imports' in runs[0]:
+        summary['imports'] = dict(
+            (name, median(run['imports'].get(name) for run in runs))
+            for name in runs[0]['imports'])
+    return summary
+
+
+def compare(results, baseline, max_regression):
+    """Compare median startup time and peak RSS against a baseline.
+
+    Args:
+      results: The benchmark results
+      baseline: Previously recorded benchmark results
+      max_regression: The allowed relative increase, e.g. 0.2 for 20%
+    Returns:
+      A list of human-readable descriptions of the regressions.
+    """
+    regressions = []
+    for kernel_name, kernel in sorted(results['kernels'].items()):
+        previous = baseline.get('kernels', {}).get(kernel_name)
+        if not previous:
+            continue
+        for metric, unit in [('total', 's'), ('peak_rss_mb', 'MB')]:
+            old = previous['median'].get(metric)
+            new = kernel['median'].get(metric)
+            if old and new and new > old * (1 + max_regression):
+                regressions.append(
+                    '{0}: {1} went from {2:.2f}{4} to {3:.2f}{4}'.format(
+                        kernel_name, metric, old, new, unit))
+    return regressions
+
+
+def print_summary(kernel_name, summary, runs):
+    print('{0} ({1} runs): {2:.2f}s to the first execute_reply, '
+          'peak RSS {3:.0f}MB'.format(kernel_name, runs, summary['total'],
+                                      summary['peak_rss_mb']))
+    for phase in _PHASES:
+        print('  {0:<14} {1:.3f}s'.format(phase, summary['phases'][phase]))
+    for name, seconds in sorted(summary.get('imports', {}).items()):
+        print('  import {0:<30} {1}'.format(
+            name, 'failed' if seconds is None else '{0:.3f}s'.format(seconds)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--kernel', dest='kernels', action='append',
+        help='kernelspec to benchmark; may be repeated (default: {0})'.format(
+            ', '.join(_DEFAULT_KERNELS)))
+    parser.add_argument(
+        '--runs', type=int, default=_DEFAULT_RUNS,
+        help='number of times to start each kernel')
+    parser.add_argument(
+        '--code', default='pass',
+        help='code to run as the first cell, e.g. "%%matplotlib inline"')
+    parser.add_argument(
+        '--import', dest='imports', action='append',
+        help=('module whose import time to profile once the kernel is '
+              'ready; may be repeated (default: {0})'.format(
+                  ', '.join(_DEFAULT_IMPORTS))))
+    parser.add_argument(
+        '--no-import-profile', dest='import_profile', action='store_false',
+        default=True, help='do not profile module imports')
+    parser.add_argument(
+        '--output', help='file to which to write the results as JSON')
+    parser.add_argument(
+        '--baseline',
+        help='results of a previous run, as written by --output')
+    parser.add_argument(
+        '--max-regression', type=float, default=_DEFAULT_MAX_REGRESSION,
+        help=('allowed relative increase over the baseline of the median '
+              'startup time and peak RSS (default: %(default)s)'))
+    args = parser.parse_args()
+
+    imports = []
+    if args.import_profile:
+        imports = args.imports or _DEFAULT_IMPORTS
+
+    results = {'created': time.time(), 'code': args.code, 'kernels': {}}
+    for kernel_name in args.kernels or _DEFAULT_KERNELS:
+        runs = [time_kernel_start(kernel_name, args.code, imports)
+                for _ in range(args.runs)]
+        summary = summarize(runs)
+        results['kernels'][kernel_name] = {'runs': runs, 'median': summary}
+        print_summary(kernel_name, summary, len(runs))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        for regression in regressions:
+            print('Regression: ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
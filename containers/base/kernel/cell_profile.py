@@ -0,0 +1,274 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Records how long each cell takes to run and how much memory it uses.
+
+As an IPython extension, this records the wall time, CPU time, growth of
+the peak RSS and size of the output of every executed cell in a ring
+buffer, and defines the `%cellprofile` magic to show them. Recording is
+off until `%cellprofile on` is run, or if DATALAB_CELL_PROFILE=1 is set in
+the environment of the kernel. It only takes a few system calls per cell.
+
+The records of each kernel are also written to
+`cellprofile-<kernel id>.json` in the Jupyter runtime directory. As a
+Jupyter server extension, this module serves those files at
+/api/datalab/cellprofile/<kernel id>.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import collections
+import json
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+
+from IPython.core import magic_arguments
+from IPython.core.magic import Magics, line_magic, magics_class
+
+
+_MAX_RECORDS = 500
+_SOURCE_PREVIEW_LENGTH = 60
+_PROFILE_FILE_TEMPLATE = 'cellprofile-{0}.json'
+
+
+def _runtime_dir():
+    from jupyter_core.paths import jupyter_runtime_dir
+    return jupyter_runtime_dir()
+
+
+def _kernel_id():
+    try:
+        from ipykernel.connect import get_connection_file
+        name = os.path.basename(get_connection_file())
+    except Exception:
+        return None
+    match = re.match(r'kernel-(.+)\.json$', name)
+    return match.group(1) if match else None
+
+
+def _text_size(data):
+    """Approximate the size of a mimebundle or string, in characters."""
+    if isinstance(data, dict):
+        return sum(_text_size(value) for value in data.values())
+    try:
+        return len(data)
+    except TypeError:
+        return 0
+
+
+class CellProfiler(object):
+    """Measures every cell and keeps the most recent measurements."""
+
+    def __init__(self, shell, path=None, max_records=_MAX_RECORDS):
+        self._shell = shell
+        self._path = path
+        self.records = collections.deque(maxlen=max_records)
+        self.enabled = False
+        self._start = None
+        self._output_size = 0
+        self._hooked_output = False
+
+    def _count_output(self, target, method_name, argument_name):
+        original = getattr(target, method_name)
+
+        def counting(*args, **kwargs):
+            if self._start is not None:
+                output = args[0] if args else kwargs.get(argument_name)
+                self._output_size += _text_size(output)
+            return original(*args, **kwargs)
+        setattr(target, method_name, counting)
+
+    def _hook_output(self):
+        if self._hooked_output:
+            return
+        self._hooked_output = True
+        self._count_output(self._shell.display_pub, 'publish', 'data')
+        self._count_output(
+            self._shell.displayhook, 'write_format_data', 'format_dict')
+        for stream in (sys.stdout, sys.stderr):
+            self._count_output(stream, 'write', 'string')
+
+    def enable(self):
+        self._hook_output()
+        if not self.enabled:
+            self.enabled = True
+            self._shell.events.register('pre_run_cell', self.pre_run_cell)
+            self._shell.events.register('post_run_cell', self.post_run_cell)
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            self._shell.events.unregister('pre_run_cell', self.pre_run_cell)
+            self._shell.events.unregister('post_run_cell', self.post_run_cell)
+            self._start = None
+
+    def clear(self):
+        self.records.clear()
+        self.save()
+
+    def pre_run_cell(self, info=None):
+        # Newer IPython releases pass the cell; older ones have it in the
+        # input history by the time the cell has run.
+        source = getattr(info, 'raw_cell', None)
+        times = os.times()
+        self._start = (time.time(), times[0] + times[1],
+                       resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       self._shell.execution_count, source)
+        self._output_size = 0
+
+    def post_run_cell(self, *unused_args):
+        if self._start is None:
+            return
+        wall_start, cpu_start, peak_rss_start, count, source = self._start
+        self._start = None
+        times = os.times()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if source is None:
+            source = self._shell.user_ns.get('_i{0}'.format(count), '')
+        lines = source.strip().splitlines()
+        self.records.append({
+            'execution_count': count,
+            'source': lines[0][:_SOURCE_PREVIEW_LENGTH] if lines else '',
+            'start': wall_start,
+            'wall_seconds': round(time.time() - wall_start, 4),
+            'cpu_seconds': round(times[0] + times[1] - cpu_start, 4),
+            # ru_maxrss is in KB on Linux.
+            'peak_rss_mb': round(peak_rss / 1024.0, 1),
+            'peak_rss_delta_mb': round((peak_rss - peak_rss_start) / 1024.0, 1),
+            'output_chars': self._output_size,
+            'error': not getattr(self._shell, 'last_execution_succeeded', True),
+        })
+        self.save()
+
+    def save(self):
+        """Write the records to the profile file of the kernel."""
+        if not self._path:
+            return
+        directory = os.path.dirname(self._path)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(list(self.records), f, separators=(',', ':'))
+            os.rename(temp_path, self._path)
+        except (IOError, OSError):
+            pass
+
+
+@magics_class
+class CellProfileMagics(Magics):
+
+    def __init__(self, shell, profiler):
+        super(CellProfileMagics, self).__init__(shell)
+        self._profiler = profiler
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        'command', nargs='?', default='show',
+        choices=['show', 'on', 'off', 'clear'],
+        help='show the recorded cells, turn recording on or off, or clear it')
+    @magic_arguments.argument(
+        '-n', type=int, default=10, help='the number of cells to show')
+    @magic_arguments.argument(
+        '--sort', default='recent',
+        choices=['recent', 'wall', 'cpu', 'memory', 'output'],
+        help='the order in which to show the cells')
+    @magic_arguments.argument(
+        '--json', action='store_true',
+        help='return the records rather than printing a table')
+    @line_magic
+    def cellprofile(self, line):
+        """Show how long recent cells took and how much memory they used."""
+        args = magic_arguments.parse_argstring(self.cellprofile, line)
+        profiler = self._profiler
+        if args.command == 'on':
+            profiler.enable()
+            print('Cell profiling is on.')
+            return
+        if args.command == 'off':
+            profiler.disable()
+            print('Cell profiling is off.')
+            return
+        if args.command == 'clear':
+            profiler.clear()
+            return
+
+        sort_keys = {
+            'recent': 'start',
+            'wall': 'wall_seconds',
+            'cpu': 'cpu_seconds',
+            'memory': 'peak_rss_delta_mb',
+            'output': 'output_chars',
+        }
+        records = sorted(profiler.records, key=lambda r: r[sort_keys[args.sort]],
+                         reverse=True)[:args.n]
+        if args.json:
+            return records
+        if not profiler.enabled:
+            print('Cell profiling is off; run `%cellprofile on` to turn it on.')
+        if not records:
+            return
+        print('{0:>5} {1:>9} {2:>9} {3:>10} {4:>9}  {5}'.format(
+            'cell', 'wall (s)', 'cpu (s)', 'peak +MB', 'output', 'source'))
+        for record in records:
+            print('{0:>5} {1:>9.3f} {2:>9.3f} {3:>10.1f} {4:>9}  {5}'.format(
+                record['execution_count'], record['wall_seconds'],
+                record['cpu_seconds'], record['peak_rss_delta_mb'],
+                record['output_chars'], record['source']))
+
+
+def load_ipython_extension(shell):
+    """Called by IPython when this module is loaded as an extension."""
+    path = None
+    kernel_id = _kernel_id()
+    if kernel_id:
+        path = os.path.join(_runtime_dir(),
+                            _PROFILE_FILE_TEMPLATE.format(kernel_id))
+    profiler = CellProfiler(shell, path=path)
+    shell.register_magics(CellProfileMagics(shell, profiler))
+    if os.environ.get('DATALAB_CELL_PROFILE', '') not in ('', '0'):
+        profiler.enable()
+
+
+def load_jupyter_server_extension(nb_server_app):
+    """Called by Jupyter when this module is loaded as a server extension."""
+    from notebook.base.handlers import APIHandler
+    from notebook.utils import url_path_join
+    from tornado import web
+
+    class CellProfileHandler(APIHandler):
+        """Serves the cell profile records of a kernel."""
+
+        @web.authenticated
+        def get(self, kernel_id):
+            if kernel_id not in self.kernel_manager:
+                raise web.HTTPError(404, 'Kernel does not exist: %s' % kernel_id)
+            path = os.path.join(nb_server_app.runtime_dir,
+                                _PROFILE_FILE_TEMPLATE.format(kernel_id))
+            try:
+                with open(path) as f:
+                    records = f.read()
+            except (IOError, OSError):
+                records = '[]'
+            self.set_header('Content-Type', 'application/json')
+            self.finish(records)
+
+    web_app = nb_server_app.web_app
+    pattern = url_path_join(web_app.settings['base_url'],
+                            r'/api/datalab/cellprofile/(?P<kernel_id>[\w-]+)')
+    web_app.add_handlers('.*$', [(pattern, CellProfileHandler)])
@@ -0,0 +1,457 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A cache on the persistent disk for DataFrames pulled from GCS and BigQuery.
+
+Notebooks tend to load the same objects and query results every time
+they are run, and a kernel restart loses them. This extension keeps them
+on the persistent disk instead, so they are only transferred once:
+
+    import datacache
+    df = datacache.read_gcs('gs://bucket/events.csv.gz', parse_dates=['ts'])
+    df = datacache.query('SELECT ...', max_age=3600)
+    df = datacache.read_table('project.dataset.table')
+
+or, with the magic,
+
+    %datacache gcs gs://bucket/events.csv.gz -o df
+    %datacache table project.dataset.table -o df
+    %%datacache bq -o df --max-age 3600
+    SELECT ...
+
+GCS objects are keyed by their generation, and tables by their last
+modification time, so a changed object or table is fetched again. Query
+results are keyed by the query alone; pass --max-age or --refresh when the
+tables they read change.
+
+Each DataFrame is stored as .npy files, one per dtype, that are
+memory-mapped when read and used by the DataFrame as they are, so that
+loading a cached DataFrame, or only some of its columns, neither parses
+nor copies anything. Columns that NumPy cannot represent, such as strings,
+are pickled. The cache is limited in size, evicting the least recently
+used entries first. `%datacache` shows the size of the cache,
+`%datacache list` its entries and `%datacache clear` empties it.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import gzip
+import hashlib
+import io
+import os
+import pickle
+import sys
+import time
+
+from IPython.core import magic_arguments
+from IPython.core.error import UsageError
+from IPython.core.magic import Magics, line_cell_magic, magics_class
+
+from disk_cache import DiskCache, max_size_bytes, names
+
+
+_DATALAB_ROOT = os.getenv('DATALAB_ROOT', '/')
+_CACHE_DIR = os.path.join(_DATALAB_ROOT, 'content/datalab/.cache/datacache')
+_DEFAULT_MAX_SIZE_MB = 10 * 1024
+_LABELS_FILE = 'labels.pickle'
+
+# Pickles are not portable between Python 2 and 3, so keep the entries of
+# the two kernels apart.
+_PICKLE_PROTOCOL = 2
+
+
+def _save_frame(directory, frame):
+    """Save a DataFrame to a directory.
+
+    The columns that NumPy can represent are grouped by dtype, and each
+    group is saved as a 2-D array with one row per column, the layout of
+    the blocks in which pandas holds them. The other columns are pickled
+    one by one.
+
+    Returns:
+      The layout of the files, as a dict with the positions of the columns
+      in each block and the positions of the pickled columns.
+    """
+    import numpy
+    with open(os.path.join(directory, _LABELS_FILE), 'wb') as f:
+        pickle.dump((frame.columns, frame.index), f, _PICKLE_PROTOCOL)
+    dtypes = frame.dtypes
+    groups = {}
+    pickled = []
+    for position in range(frame.shape[1]):
+        dtype = dtypes.iloc[position]
+        if isinstance(dtype, numpy.dtype) and dtype.kind in 'biufcmM':
+            groups.setdefault(dtype.str, []).append(position)
+        else:
+            column = frame.iloc[:, position]
+            path = os.path.join(directory, 'c{0}.pickle'.format(position))
+            with open(path, 'wb') as f:
+                pickle.dump(column.reset_index(drop=True), f, _PICKLE_PROTOCOL)
+            pickled.append(position)
+    blocks = []
+    for number, positions in enumerate(sorted(groups.values())):
+        values = numpy.empty((len(positions), frame.shape[0]),
+                             dtypes.iloc[positions[0]])
+        for row, position in enumerate(positions):
+            values[row] = frame.iloc[:, position].values
+        numpy.save(os.path.join(directory, 'b{0}.npy'.format(number)), values,
+                   allow_pickle=False)
+        blocks.append(positions)
+    return {'blocks': blocks, 'pickled': pickled}
+
+
+def _load_frame(directory, layout, columns=None):
+    """Load a DataFrame saved by _save_frame.
+
+    The blocks are memory-mapped copy-on-write and become the blocks of
+    the DataFrame as they are, so only the pages that are read are loaded,
+    and writing to the DataFrame leaves the cache untouched. Only the
+    pickled columns are read in full, and copied once into the DataFrame.
+
+    Args:
+      directory: The directory of the DataFrame
+      layout: The layout of the files, as returned by _save_frame
+      columns: The labels of the columns to load, or None for all of them
+    Returns:
+      The DataFrame.
+    """
+    import numpy
+    import pandas
+    from pandas.core.internals import BlockManager, make_block
+    with open(os.path.join(directory, _LABELS_FILE), 'rb') as f:
+        labels, index = pickle.load(f)
+    positions = [p for p in range(len(labels))
+                 if columns is None or labels[p] in columns]
+    locations = dict((p, location) for location, p in enumerate(positions))
+    pickled = [p for p in layout['pickled'] if p in locations]
+    # The blocks are placed among the columns that are not pickled; the
+    # pickled columns are then inserted at their locations among all.
+    unpickled = [p for p in positions if p not in set(pickled)]
+    block_locations = dict((p, location)
+                           for location, p in enumerate(unpickled))
+    # Empty arrays cannot be memory-mapped.
+    mmap_mode = 'c' if len(index) else None
+    blocks = []
+    for number, block_positions in enumerate(layout['blocks']):
+        rows = [row for row, p in enumerate(block_positions)
+                if p in block_locations]
+        if not rows:
+            continue
+        values = numpy.load(os.path.join(directory, 'b{0}.npy'.format(number)),
+                            mmap_mode=mmap_mode, allow_pickle=False)
+        if len(rows) == len(block_positions):
+            blocks.append(make_block(
+                values,
+                placement=[block_locations[p] for p in block_positions]))
+        else:
+            # Taking some of the rows would copy them, so each column
+            # becomes a block of its own, on a view of its row.
+            for row in rows:
+                blocks.append(make_block(
+                    values[row:row + 1],
+                    placement=[block_locations[block_positions[row]]]))
+    # The columns are numbered by position until the pickled ones are in
+    # place, and the pickled columns have a default index, which the real
+    # one, which may have duplicates, only replaces at the end.
+    frame = pandas.DataFrame(BlockManager(blocks, [
+        pandas.Index(unpickled), pandas.RangeIndex(len(index))]))
+    # Inserting in order of position puts every column before those after
+    # it, whatever they are.
+    for position in pickled:
+        path = os.path.join(directory, 'c{0}.pickle'.format(position))
+        with open(path, 'rb') as f:
+            frame.insert(locations[position], position, pickle.load(f))
+    frame.columns = labels[positions]
+    frame.index = index
+    return frame
+
+
+class DataCache(DiskCache):
+    """Cached DataFrames in a directory, one subdirectory per entry."""
+
+    def __init__(self, cache_dir=_CACHE_DIR, max_size=None):
+        super(DataCache, self).__init__(
+            cache_dir, max_size if max_size is not None else max_size_bytes(
+                'DATALAB_DATACACHE_MAX_SIZE_MB', _DEFAULT_MAX_SIZE_MB))
+
+    def key(self, *parts):
+        """Compute the key of an entry from the parts that identify it.
+
+        Returns:
+          A hex digest.
+        """
+        digest = hashlib.sha256()
+        digest.update('python{0}'.format(sys.version_info[0]).encode('utf-8'))
+        for part in parts:
+            digest.update(('\0' + repr(part)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def load(self, key, columns=None, max_age=None):
+        """Load a cached DataFrame.
+
+        Args:
+          key: The key of the entry
+          columns: The labels of the columns to load, or None for all
+          max_age: The age in seconds beyond which the entry is ignored
+        Returns:
+          The DataFrame, or None if it is not cached.
+        """
+        try:
+            manifest = self.manifest(key)
+            if max_age is not None and \
+                    time.time() - manifest['created'] > max_age:
+                return None
+            frame = _load_frame(self.path(key), manifest['layout'], columns)
+            self.touch(key)
+        except Exception:
+            return None
+        missing = [c for c in columns or [] if c not in frame.columns]
+        if missing:
+            raise KeyError('No such columns: {0}'.format(missing))
+        return frame
+
+    def save(self, key, frame, description):
+        """Cache a DataFrame, evicting old entries if the cache is full.
+
+        Args:
+          key: The key of the entry
+          frame: The DataFrame
+          description: What the entry holds, as shown by `%datacache list`
+        """
+        self.store(key, lambda directory: {
+            'description': description, 'created': time.time(),
+            'layout': _save_frame(directory, frame)})
+
+    def fetch(self, key, fetch, description, columns=None, max_age=None,
+              refresh=False):
+        """Load a cached DataFrame, or fetch and cache it if it is not cached.
+
+        Args:
+          key: The key of the entry
+          fetch: A function that takes no arguments and returns the
+            DataFrame, or None if it must not be cached
+          description: What the entry holds, as shown by `%datacache list`
+          columns: The labels of the columns to return, or None for all
+          max_age: The age in seconds beyond which the entry is fetched again
+          refresh: Whether to fetch the DataFrame even if it is cached
+        Returns:
+          The DataFrame.
+        """
+        if not refresh:
+            frame = self.load(key, columns, max_age)
+            if frame is not None:
+                return frame
+        frame = fetch()
+        try:
+            self.save(key, frame, description)
+        except Exception as e:
+            print('Failed to cache {0}: {1}'.format(description, e),
+                  file=sys.stderr)
+        return frame if columns is None else frame[list(columns)]
+
+    def describe(self, key):
+        """Return what an entry holds, or None if it is gone."""
+        try:
+            return self.manifest(key)['description']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+
+_default_cache = None
+
+
+def default_cache():
+    """Return the cache under /content/datalab/.cache/datacache."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DataCache()
+    return _default_cache
+
+
+def _parse_gcs_url(url):
+    if not url.startswith('gs://') or '/' not in url[len('gs://'):]:
+        raise ValueError('Not a GCS object: {0}'.format(url))
+    return url[len('gs://'):].split('/', 1)
+
+
+def _read_object(data, name, **kwargs):
+    """Read the contents of an object into a DataFrame, by its extension."""
+    import pandas
+    if name.endswith('.gz'):
+        data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        name = name[:-len('.gz')]
+    buf = io.BytesIO(data)
+    if name.endswith('.parquet'):
+        return pandas.read_parquet(buf, **kwargs)
+    if name.endswith('.json') or name.endswith('.jsonl'):
+        kwargs.setdefault('lines', name.endswith('.jsonl'))
+        return pandas.read_json(io.TextIOWrapper(buf, 'utf-8'), **kwargs)
+    if name.endswith('.xls') or name.endswith('.xlsx'):
+        return pandas.read_excel(buf, **kwargs)
+    if name.endswith('.pkl') or name.endswith('.pickle'):
+        return pickle.load(buf)
+    return pandas.read_csv(buf, **kwargs)
+
+
+def read_gcs(url, columns=None, refresh=False, cache=None, **kwargs):
+    """Read a GCS object into a DataFrame, through the cache.
+
+    The object is read with pandas by its extension: CSV by default, and
+    Parquet, JSON (.json, or .jsonl for JSON lines), Excel or a pickle
+    otherwise, gzipped if it ends with .gz.
+
+    Args:
+      url: The gs:// URL of the object
+      columns: The labels of the columns to return, or None for all
+      refresh: Whether to download the object even if it is cached
+      cache: The DataCache to use, if not the default one
+      **kwargs: Arguments for the pandas function that reads the object
+    Returns:
+      The DataFrame.
+    """
+    from google.datalab import Context
+    from google.datalab.storage import _api
+    bucket, name = _parse_gcs_url(url)
+    api = _api.Api(Context.default())
+    generation = api.objects_get(bucket, name)['generation']
+    cache = cache or default_cache()
+
+    def fetch():
+        frame = _read_object(api.object_download(bucket, name), name, **kwargs)
+        # Do not cache the contents of a newer generation as this one.
+        if api.objects_get(bucket, name)['generation'] != generation:
+            raise IOError('{0} changed while it was downloaded'.format(url))
+        return frame
+
+    key = cache.key('gcs', bucket, name, generation, sorted(kwargs.items()))
+    return cache.fetch(key, fetch, '{0}#{1}'.format(url, generation),
+                       columns=columns, refresh=refresh)
+
+
+def query(sql, columns=None, max_age=None, refresh=False, cache=None):
+    """Run a BigQuery query into a DataFrame, through the cache.
+
+    Args:
+      sql: The standard SQL query
+      columns: The labels of the columns to return, or None for all
+      max_age: The age in seconds beyond which cached results are ignored
+      refresh: Whether to run the query even if its results are cached
+      cache: The DataCache to use, if not the default one
+    Returns:
+      The DataFrame.
+    """
+    from google.datalab import Context
+    import google.datalab.bigquery as bq
+    cache = cache or default_cache()
+    project = Context.default().project_id
+    key = cache.key('bq', project, sql.strip())
+    return cache.fetch(
+        key, lambda: bq.Query(sql).execute().result().to_dataframe(),
+        'query ' + ' '.join(sql.split())[:100], columns=columns,
+        max_age=max_age, refresh=refresh)
+
+
+def read_table(name, columns=None, refresh=False, cache=None):
+    """Read a BigQuery table into a DataFrame, through the cache.
+
+    Args:
+      name: The name of the table, as project.dataset.table
+      columns: The labels of the columns to return, or None for all
+      refresh: Whether to read the table even if it is cached
+      cache: The DataCache to use, if not the default one
+    Returns:
+      The DataFrame.
+    """
+    import google.datalab.bigquery as bq
+    cache = cache or default_cache()
+    table = bq.Table(name)
+    metadata = table.metadata
+    key = cache.key('table', name, str(metadata.modified_on), metadata.rows)
+    return cache.fetch(key, table.to_dataframe, 'table ' + name,
+                       columns=columns, refresh=refresh)
+
+
+@magics_class
+class DataCacheMagics(Magics):
+
+    def __init__(self, shell, cache=None):
+        super(DataCacheMagics, self).__init__(shell)
+        self._cache = cache or default_cache()
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        'command', nargs='?', default='info',
+        choices=['info', 'list', 'clear', 'gcs', 'table', 'bq'],
+        help=('show the size of the cache, list or clear its entries, or '
+              'read a GCS object, a BigQuery table or the results of the '
+              'query in the cell'))
+    @magic_arguments.argument(
+        'source', nargs='?',
+        help='the gs:// URL of the object, or the name of the table')
+    @magic_arguments.argument(
+        '-o', '--output',
+        help='the variable to set to the DataFrame')
+    @magic_arguments.argument(
+        '-c', '--columns',
+        help='comma-separated columns to read; all of them by default')
+    @magic_arguments.argument(
+        '--max-age', type=int,
+        help='for queries, the age in seconds beyond which to run it again')
+    @magic_arguments.argument(
+        '--refresh', action='store_true',
+        help='fetch the data even if it is cached')
+    @line_cell_magic
+    def datacache(self, line, cell=None):
+        """Read GCS objects and BigQuery data through a cache on disk."""
+        args = magic_arguments.parse_argstring(self.datacache, line)
+        if args.command == 'clear':
+            self._cache.clear()
+            print('Cleared the data cache.')
+            return
+        if args.command in ('info', 'list'):
+            entries = self._cache.entries()
+            print('{0} cached entries using {1:.1f} MB of {2:.0f} MB in {3}'.format(
+                len(entries), sum(size for _, size, _ in entries) / 1048576.0,
+                self._cache.max_size / 1048576.0, self._cache.cache_dir))
+            if args.command == 'list':
+                for used, size, key in reversed(entries):
+                    print('{0}  {1:9.1f} MB  {2}'.format(
+                        time.strftime('%Y-%m-%d %H:%M', time.localtime(used)),
+                        size / 1048576.0, self._cache.describe(key)))
+            return
+
+        if not args.output:
+            raise UsageError('%datacache {0} needs a variable in --output'.format(
+                args.command))
+        columns = names(args.columns) or None
+        if args.command == 'bq':
+            if not cell or not cell.strip():
+                raise UsageError('%%datacache bq needs a query in the cell')
+            frame = query(cell, columns=columns, max_age=args.max_age,
+                          refresh=args.refresh, cache=self._cache)
+        elif not args.source:
+            raise UsageError('%datacache {0} needs a source'.format(args.command))
+        elif args.command == 'gcs':
+            frame = read_gcs(args.source, columns=columns, refresh=args.refresh,
+                             cache=self._cache)
+        else:
+            frame = read_table(args.source, columns=columns,
+                               refresh=args.refresh, cache=self._cache)
+        self.shell.user_ns[args.output] = frame
+
+
+def load_ipython_extension(shell):
+    """Called by IPython when this module is loaded as an extension."""
+    shell.register_magics(DataCacheMagics(shell))
@@ -0,0 +1,177 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Paginated display of large pandas DataFrames.
+
+Displaying a large DataFrame sends its HTML representation through the
+kernel websocket, the Datalab server and the SSH tunnel, and saves it into
+the notebook. For DataFrames with more rows than a page, this extension
+instead displays the schema and the first page only. The notebook page
+then fetches other pages, sorted and filtered in the kernel, over a comm
+with the target name `datalab.dataframe`; see static/dataframe-viewer.js
+in the Datalab server.
+
+Saved notebooks keep the first page, so they stay small and readable
+without a kernel.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import itertools
+import json
+import uuid
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+
+_COMM_TARGET = 'datalab.dataframe'
+_PAGE_SIZE = 50
+_MAX_PAGE_SIZE = 1000
+
+# The most recently displayed or paged DataFrames, by ID. They are held
+# here, as displayed temporaries such as `df.head(1000)` are referenced
+# nowhere else, but only a few are kept, so that the kernel does not hold
+# on to every DataFrame it ever displayed. IDs are unique across kernels,
+# so saved outputs never page through another kernel's DataFrame.
+_frames = collections.OrderedDict()
+_MAX_FRAMES = 16
+_ids = itertools.count(1)
+_id_prefix = uuid.uuid4().hex[:12]
+
+# The most recently used sorted and filtered views, so that paging through
+# one does not sort it again. They can be as large as the DataFrames, so
+# only a few are kept.
+_views = collections.OrderedDict()
+_MAX_VIEWS = 4
+
+
+def _schema(df):
+    return [{'name': str(name), 'type': str(dtype)}
+            for name, dtype in zip(df.columns, df.dtypes)]
+
+
+def _page_html(df, start, page_size):
+    return df.iloc[start:start + page_size].to_html(
+        classes='dataframe', max_rows=None, max_cols=None)
+
+
+def _view(frame_id, df, sort, filter):
+    """Get a DataFrame sorted and filtered as requested.
+
+    Args:
+      frame_id: The ID of the displayed DataFrame
+      df: The displayed DataFrame
+      sort: None, or a dict with the 'column' to sort by and 'ascending'
+      filter: None, or a dict with a 'column' and the 'text' it must contain
+    Returns:
+      The view of the DataFrame.
+    """
+    cache_key = json.dumps([sort, filter], sort_keys=True)
+    cached = _views.pop(frame_id, None)
+    if cached and cached[0] == cache_key:
+        _views[frame_id] = cached
+        return cached[1]
+    view = df
+    if filter and filter.get('text'):
+        column = view[view.columns[int(filter['column'])]]
+        view = view[column.astype(str).str.contains(
+            filter['text'], case=False, regex=False)]
+    if sort:
+        view = view.sort_values(view.columns[int(sort['column'])],
+                                ascending=bool(sort.get('ascending', True)))
+    _views[frame_id] = (cache_key, view)
+    while len(_views) > _MAX_VIEWS:
+        _views.popitem(last=False)
+    return view
+
+
+def _handle_request(frame_id, request):
+    """Compute a page of a displayed DataFrame.
+
+    Args:
+      frame_id: The ID of the displayed DataFrame
+      request: A dict with the 'page' and 'page_size' to get, and
+          optionally how to 'sort' and 'filter' the DataFrame
+    Returns:
+      A JSON-serializable dict with the HTML of the page and its position.
+    """
+    df = _frames.pop(frame_id, None)
+    if df is None:
+        _views.pop(frame_id, None)
+        return {'error': 'This DataFrame is no longer available in the kernel.'}
+    _frames[frame_id] = df
+    view = _view(frame_id, df, request.get('sort'), request.get('filter'))
+    page_size = max(1, min(int(request.get('page_size', _PAGE_SIZE)),
+                           _MAX_PAGE_SIZE))
+    pages = max(1, (len(view) + page_size - 1) // page_size)
+    page = max(0, min(int(request.get('page', 0)), pages - 1))
+    return {
+        'html': _page_html(view, page * page_size, page_size),
+        'page': page,
+        'pages': pages,
+        'rows': len(view),
+    }
+
+
+def _open_comm(comm, open_msg):
+    frame_id = open_msg['content']['data'].get('id')
+
+    def on_msg(msg):
+        try:
+            reply = _handle_request(frame_id, msg['content']['data'])
+        except Exception as e:
+            reply = {'error': '{0}: {1}'.format(type(e).__name__, e)}
+        comm.send(reply)
+
+    def on_close(unused_msg):
+        _views.pop(frame_id, None)
+
+    comm.on_msg(on_msg)
+    comm.on_close(on_close)
+
+
+def _format_html(df):
+    """Format a DataFrame as the schema and its first page, if it is large."""
+    if len(df) <= _PAGE_SIZE:
+        return df._repr_html_()
+    frame_id = '{0}-{1}'.format(_id_prefix, next(_ids))
+    _frames[frame_id] = df
+    while len(_frames) > _MAX_FRAMES:
+        _views.pop(_frames.popitem(last=False)[0], None)
+    schema = _schema(df)
+    pages = (len(df) + _PAGE_SIZE - 1) // _PAGE_SIZE
+    return (
+        '<div class="datalab-dataframe" data-datalab-dataframe="{0}" '
+        'data-schema="{1}" data-rows="{2}" data-pages="{3}" '
+        'data-page-size="{4}">'
+        '<div class="datalab-dataframe-summary">{2} rows &times; {5} columns; '
+        'showing the first {4}</div>'
+        '<div class="datalab-dataframe-page">{6}</div>'
+        '</div>').format(
+            frame_id, escape(json.dumps(schema), quote=True), len(df),
+            pages, _PAGE_SIZE, len(schema), _page_html(df, 0, _PAGE_SIZE))
+
+
+def load_ipython_extension(shell):
+    """Called by IPython when this module is loaded as an extension."""
+    # Registering by name avoids importing pandas until it is used.
+    shell.display_formatter.formatters['text/html'].for_type_by_name(
+        'pandas.core.frame', 'DataFrame', _format_html)
+    kernel = getattr(shell, 'kernel', None)
+    if kernel is not None:
+        kernel.comm_manager.register_target(_COMM_TARGET, _open_comm)
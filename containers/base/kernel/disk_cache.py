@@ -0,0 +1,136 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The storage shared by the memo and datacache extensions.
+
+Each entry of a cache is a directory under the cache directory, named
+after its key and holding a manifest.json along with the files of the
+entry. Entries are written to a temporary directory that is renamed into
+place, so that a kernel that dies while saving never leaves a partial
+entry behind. The modification time of an entry is its last use, and
+once the cache is over its size the least recently used entries are
+evicted.
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+
+_MANIFEST_FILE = 'manifest.json'
+
+
+def max_size_bytes(variable, default_mb):
+    """Read the size limit of a cache, in MB, from an environment variable."""
+    try:
+        return int(os.environ.get(variable)) * 1024 * 1024
+    except (TypeError, ValueError):
+        return default_mb * 1024 * 1024
+
+
+def names(value):
+    """Split a comma-separated list of names, as given to the magics."""
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def _directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class DiskCache(object):
+    """Entries in a directory, one subdirectory per entry."""
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def manifest(self, key):
+        """Read the manifest of an entry.
+
+        Raises:
+          IOError: If there is no such entry
+          ValueError: If the manifest is corrupt
+        """
+        with open(os.path.join(self.path(key), _MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def touch(self, key):
+        """Mark an entry as recently used."""
+        os.utime(self.path(key), None)
+
+    def store(self, key, write):
+        """Write an entry, evicting old entries if the cache is full.
+
+        Args:
+          key: The key of the entry
+          write: A function that writes the files of the entry to the
+            directory it is passed, and returns the manifest as a
+            JSON-serializable dict
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.')
+        try:
+            manifest = write(temp_dir)
+            with open(os.path.join(temp_dir, _MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f)
+            entry = self.path(key)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.rename(temp_dir, entry)
+        finally:
+            if os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    def entries(self):
+        """List the entries as (last use, size, key), oldest first."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self.path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            entries.append((os.path.getmtime(path), _directory_size(path), key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
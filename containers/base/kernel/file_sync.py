@@ -0,0 +1,245 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Jupyter server extension behind `datalab sync`.
+
+The contents API sends whole files as JSON, and cannot tell which files
+changed. This extension serves, under /api/datalab/sync/:
+
+  * hashes/<dir>: the size, mtime and SHA-256 hash of every file under a
+    directory, so that only the files that differ are transferred. Hashes
+    are cached for as long as the size and mtime of a file do not change.
+  * files/<path>: the contents of a file, honouring Range headers, and
+    uploads of a file in chunks. Chunks are appended to a hidden partial
+    file named by the hash of the whole file, so an interrupted upload
+    resumes where it stopped, and the file only replaces the existing one
+    once its hash has been checked.
+  * partial/<path>: how much of an upload has been received.
+
+Hidden files and directories are not synced. Notebooks whose large
+outputs are kept apart by the output_store contents manager are hashed and
+served with their outputs restored.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+import nbformat
+from notebook.base.handlers import APIHandler, path_regex
+from notebook.utils import url_path_join
+from tornado import gen, web
+
+
+_PARTIAL_TEMPLATE = '.{0}.{1}.sync-partial'
+_REFS_MARKER = b'datalab_output_refs'
+_READ_SIZE = 1024 * 1024
+
+# Hashing reads whole files, so it is kept off the IOLoop.
+_executor = ThreadPoolExecutor(max_workers=4)
+
+# The hashes of files, keyed by path, with the size and mtime they had.
+_hash_cache = {}
+_hash_cache_lock = threading.Lock()
+
+
+def _is_hidden(name):
+    return name.startswith('.')
+
+
+def _partial_path(os_path, digest):
+    directory, name = os.path.split(os_path)
+    return os.path.join(directory, _PARTIAL_TEMPLATE.format(name, digest[:16]))
+
+
+def _has_stored_outputs(os_path):
+    if not os_path.endswith('.ipynb'):
+        return False
+    with open(os_path, 'rb') as f:
+        return _REFS_MARKER in f.read()
+
+
+def _read_file(contents_manager, path, os_path):
+    """Read a file as it is synced.
+
+    Returns:
+      The contents of the notebook with its outputs restored, or None if
+      the file is read as it is on disk.
+    """
+    if not hasattr(contents_manager, '_restore_outputs') or \
+            not _has_stored_outputs(os_path):
+        return None
+    model = contents_manager.get(path, type='notebook')
+    return nbformat.writes(model['content'],
+                           version=nbformat.NO_CONVERT).encode('utf-8')
+
+
+def _hash_file(os_path):
+    digest = hashlib.sha256()
+    with open(os_path, 'rb') as f:
+        for data in iter(lambda: f.read(_READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _list_files(contents_manager, path):
+    """List the files under a directory, with their hashes."""
+    root = contents_manager._get_os_path(path)
+    if not os.path.isdir(root):
+        raise web.HTTPError(404, 'No such directory: %s' % path)
+    files = []
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = [d for d in subdirectories if not _is_hidden(d)]
+        for name in names:
+            os_path = os.path.join(directory, name)
+            if _is_hidden(name) or not os.path.isfile(os_path):
+                continue
+            relative_path = os.path.relpath(os_path, root).replace(os.sep, '/')
+            try:
+                stat = os.stat(os_path)
+                key = (stat.st_size, stat.st_mtime)
+                with _hash_cache_lock:
+                    cached = _hash_cache.get(os_path)
+                if cached and cached[0] == key:
+                    size, digest = cached[1:]
+                else:
+                    content = _read_file(
+                        contents_manager,
+                        '/'.join([path.strip('/'), relative_path]).lstrip('/'),
+                        os_path)
+                    if content is None:
+                        size, digest = stat.st_size, _hash_file(os_path)
+                    else:
+                        size = len(content)
+                        digest = hashlib.sha256(content).hexdigest()
+                    with _hash_cache_lock:
+                        _hash_cache[os_path] = (key, size, digest)
+            except (IOError, OSError):
+                continue
+            files.append({'path': relative_path, 'size': size,
+                          'mtime': stat.st_mtime, 'sha256': digest})
+    return files
+
+
+class SyncHashesHandler(APIHandler):
+    """Serves the hashes of the files under a directory."""
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path=''):
+        files = yield _executor.submit(
+            _list_files, self.contents_manager, path.strip('/'))
+        self.finish(json.dumps({'files': files}))
+
+
+class SyncPartialHandler(APIHandler):
+    """Serves how much of an upload has been received."""
+
+    @web.authenticated
+    def get(self, path):
+        os_path = self.contents_manager._get_os_path(path.strip('/'))
+        partial_path = _partial_path(os_path, self.get_argument('sha256'))
+        offset = os.path.getsize(partial_path) \
+            if os.path.isfile(partial_path) else 0
+        self.finish(json.dumps({'offset': offset}))
+
+
+class SyncFileHandler(APIHandler):
+    """Downloads and uploads files."""
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path):
+        path = path.strip('/')
+        os_path = self.contents_manager._get_os_path(path)
+        if not os.path.isfile(os_path):
+            raise web.HTTPError(404, 'No such file: %s' % path)
+        content = yield _executor.submit(
+            _read_file, self.contents_manager, path, os_path)
+        size = os.path.getsize(os_path) if content is None else len(content)
+        start, end = 0, size
+        byte_range = self.request.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            first, _, last = byte_range[len('bytes='):].partition('-')
+            start = int(first or 0)
+            end = min(size, int(last) + 1) if last else size
+            self.set_status(206)
+            self.set_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end - 1, size))
+        self.set_header('Content-Type', 'application/octet-stream')
+        if content is not None:
+            self.finish(content[start:end])
+            return
+        with open(os_path, 'rb') as f:
+            f.seek(start)
+            while start < end:
+                data = f.read(min(_READ_SIZE, end - start))
+                if not data:
+                    break
+                start += len(data)
+                self.write(data)
+                yield self.flush()
+        self.finish()
+
+    @web.authenticated
+    @gen.coroutine
+    def put(self, path):
+        path = path.strip('/')
+        os_path = self.contents_manager._get_os_path(path)
+        digest = self.get_argument('sha256')
+        offset = int(self.get_argument('offset'))
+        size = int(self.get_argument('size'))
+        partial_path = _partial_path(os_path, digest)
+        received = os.path.getsize(partial_path) \
+            if os.path.isfile(partial_path) else 0
+        if offset != received:
+            self.set_status(409)
+            self.finish(json.dumps({'offset': received}))
+            return
+
+        directory = os.path.dirname(os_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(partial_path, 'ab') as f:
+            f.write(self.request.body)
+        received += len(self.request.body)
+        if received < size:
+            self.finish(json.dumps({'offset': received}))
+            return
+
+        actual_digest = yield _executor.submit(_hash_file, partial_path)
+        if received != size or actual_digest != digest:
+            os.remove(partial_path)
+            raise web.HTTPError(400, 'The upload of %s does not match its hash' % path)
+        mtime = self.get_argument('mtime', None)
+        if mtime:
+            os.utime(partial_path, (float(mtime), float(mtime)))
+        os.rename(partial_path, os_path)
+        self.set_status(201)
+        self.finish(json.dumps({'offset': received}))
+
+
+def load_jupyter_server_extension(nb_server_app):
+    """Called by Jupyter when this module is loaded as a server extension."""
+    web_app = nb_server_app.web_app
+    base_url = url_path_join(web_app.settings['base_url'], '/api/datalab/sync')
+    web_app.add_handlers('.*$', [
+        (base_url + r'/hashes(?P<path>(?:/.*)?)', SyncHashesHandler),
+        (base_url + r'/partial' + path_regex, SyncPartialHandler),
+        (base_url + r'/files' + path_regex, SyncFileHandler),
+    ])
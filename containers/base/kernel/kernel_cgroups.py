@@ -0,0 +1,339 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs each kernel in a cgroup of its own, and serves what kernels use.
+
+On GCE, the startup script of the instance divides the machine between
+the Datalab container and the kernels with cgroups, and the container gets
+the cgroups of the kernels as volumes under /datalab/cgroups: `cpu` and
+`memory` with cgroup v1, or `unified` with cgroup v2. The kernel
+manager here moves each kernel, as it is launched, into a cgroup of its
+own under those, with an equal CPU weight and a memory limit. A kernel
+that keeps every core busy then only slows down the other kernels to its
+fair share, and one that runs out of memory is killed on its own, while
+the web server keeps the CPU and memory it was reserved.
+
+The CPU and memory used by each kernel, and its memory limit, are served
+at /api/datalab/kernelusage for the sessions page. Where there are no
+cgroups, as when Datalab runs locally, kernels are launched as usual and
+their usage is measured with psutil.
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import time
+
+from jupyter_client.ioloop import IOLoopKernelManager
+from notebook.base.handlers import APIHandler
+from notebook.utils import url_path_join
+from tornado import gen, web
+from traitlets import Float, Integer, Unicode
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+_CGROUP_ROOT = '/datalab/cgroups'
+_SAMPLE_INTERVAL_SECONDS = 0.5
+
+
+def _read(path, name):
+    with open(os.path.join(path, name)) as f:
+        return f.read()
+
+
+def _write(path, name, value):
+    with open(os.path.join(path, name), 'w') as f:
+        f.write(str(value))
+
+
+def _read_stats(path, name):
+    return dict(line.split() for line in _read(path, name).splitlines())
+
+
+def _physical_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+class KernelCgroups(object):
+    """The cgroups of the kernels.
+
+    With cgroup v1 these are under the cpu and memory hierarchies, and with
+    cgroup v2 under the unified hierarchy, which has a different interface.
+    """
+
+    def __init__(self, root=_CGROUP_ROOT):
+        self.cpu_dir = os.path.join(root, 'cpu')
+        self.memory_dir = os.path.join(root, 'memory')
+        self.unified_dir = os.path.join(root, 'unified')
+
+    @property
+    def unified(self):
+        return os.path.isfile(
+            os.path.join(self.unified_dir, 'cgroup.controllers'))
+
+    def _dirs(self):
+        if self.unified:
+            return [self.unified_dir]
+        return [self.cpu_dir, self.memory_dir]
+
+    def available(self):
+        if self.unified:
+            # The cgroups of the kernels only get the controllers that are
+            # enabled for the children of the cgroup of all kernels.
+            try:
+                enabled = _read(self.unified_dir,
+                                'cgroup.subtree_control').split()
+            except (IOError, OSError):
+                return False
+            return ('cpu' in enabled and 'memory' in enabled and
+                    os.access(self.unified_dir, os.W_OK))
+        # Docker creates the directories of missing volumes, so only those
+        # with the files of their controllers are cgroups.
+        return (os.path.isfile(os.path.join(self.cpu_dir, 'cpu.shares')) and
+                os.path.isfile(os.path.join(self.memory_dir,
+                                            'memory.limit_in_bytes')) and
+                all(os.access(d, os.W_OK)
+                    for d in (self.cpu_dir, self.memory_dir)))
+
+    def memory_budget(self):
+        """Return the memory that the kernels may use between them."""
+        if self.unified:
+            limit = _read(self.unified_dir, 'memory.max').strip()
+            if limit == 'max':
+                return _physical_memory()
+        else:
+            limit = _read(self.memory_dir, 'memory.limit_in_bytes')
+        return min(int(limit), _physical_memory())
+
+    def add(self, name, pid, cpu_shares, memory_limit):
+        """Move a process into a new cgroup.
+
+        Cgroups left behind by kernels that are gone are removed first.
+
+        Args:
+          name: The name of the cgroup
+          pid: The ID of the process
+          cpu_shares: The CPU weight of the cgroup, as cgroup v1 shares,
+            of which 1024 are the default
+          memory_limit: The memory limit of the cgroup, in bytes
+        """
+        self.remove_unused()
+        if self.unified:
+            # cgroup v2 weights range from 1 to 10000, and default to 100.
+            cpu_weight = max(1, min(10000, cpu_shares * 100 // 1024))
+            controllers = [(self.unified_dir, [('cpu.weight', cpu_weight),
+                                               ('memory.max', memory_limit)])]
+        else:
+            controllers = [
+                (self.cpu_dir, [('cpu.shares', cpu_shares)]),
+                (self.memory_dir, [('memory.limit_in_bytes', memory_limit)])]
+        for directory, settings in controllers:
+            path = os.path.join(directory, name)
+            if not os.path.isdir(path):
+                os.mkdir(path)
+            for setting, value in settings:
+                _write(path, setting, value)
+            _write(path, 'cgroup.procs', pid)
+
+    def remove(self, name):
+        """Remove a cgroup, unless processes are still running in it."""
+        for directory in self._dirs():
+            try:
+                os.rmdir(os.path.join(directory, name))
+            except OSError:
+                pass
+
+    def remove_unused(self):
+        """Remove the cgroups that have no processes left in them."""
+        for directory in self._dirs():
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    try:
+                        # This fails for cgroups that are in use.
+                        os.rmdir(path)
+                    except OSError:
+                        pass
+
+    def usage(self, name):
+        """Measure what the processes in a cgroup use.
+
+        Returns:
+          A dict with the CPU time in seconds, the memory in use and the
+          memory limit in bytes, and the number of processes killed for
+          running out of memory, or None if there is no such cgroup.
+        """
+        try:
+            if self.unified:
+                path = os.path.join(self.unified_dir, name)
+                cpu_seconds = int(
+                    _read_stats(path, 'cpu.stat')['usage_usec']) / 1e6
+                memory = int(_read(path, 'memory.current'))
+                inactive_file = _read_stats(path, 'memory.stat').get(
+                    'inactive_file', 0)
+                limit = _read(path, 'memory.max').strip()
+                oom_kills = _read_stats(path, 'memory.events').get('oom_kill')
+            else:
+                cpu_path = os.path.join(self.cpu_dir, name)
+                path = os.path.join(self.memory_dir, name)
+                cpu_seconds = int(_read(cpu_path, 'cpuacct.usage')) / 1e9
+                memory = int(_read(path, 'memory.usage_in_bytes'))
+                inactive_file = _read_stats(path, 'memory.stat').get(
+                    'total_inactive_file', 0)
+                limit = _read(path, 'memory.limit_in_bytes')
+                oom_kills = _read_stats(path, 'memory.oom_control').get(
+                    'oom_kill')
+            budget = self.memory_budget()
+            memory_limit = budget if limit == 'max' else min(int(limit), budget)
+            # Page cache that can be dropped does not count, as for
+            # `docker stats`.
+            memory = max(0, memory - int(inactive_file))
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        return {
+            'cpu_seconds': cpu_seconds,
+            'memory_bytes': memory,
+            'memory_limit_bytes': memory_limit,
+            'oom_kills': int(oom_kills) if oom_kills is not None else None,
+        }
+
+
+def _process_usage(pid):
+    """Measure what a process and its children use, with psutil."""
+    if psutil is None:
+        return None
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+        cpu_seconds = 0
+        memory = 0
+        for p in processes:
+            times = p.cpu_times()
+            cpu_seconds += times.user + times.system
+            memory += p.memory_info().rss
+    except psutil.Error:
+        return None
+    return {'cpu_seconds': cpu_seconds, 'memory_bytes': memory,
+            'memory_limit_bytes': None, 'oom_kills': None}
+
+
+class CgroupKernelManager(IOLoopKernelManager):
+    """A kernel manager that launches kernels in cgroups of their own."""
+
+    cgroup_root = Unicode(
+        _CGROUP_ROOT, config=True,
+        help=('The directory holding the cpu and memory cgroups, or with '
+              'cgroup v2 the unified one, under which to create those of '
+              'the kernels. Kernels are launched as usual if they are '
+              'missing.'))
+
+    cpu_shares = Integer(
+        1024, config=True,
+        help=('The CPU weight of each kernel. Kernels with equal weights '
+              'get equal shares of the CPU when it is contended.'))
+
+    memory_fraction = Float(
+        0.8, config=True,
+        help=('The memory limit of each kernel, as a fraction of the memory '
+              'that the kernels may use between them.'))
+
+    @property
+    def cgroup_name(self):
+        # The kernel manager does not know the ID of its kernel, but the
+        # mapping kernel manager names the connection file after it.
+        name = os.path.splitext(os.path.basename(self.connection_file))[0]
+        return name[len('kernel-'):] if name.startswith('kernel-') else name
+
+    def _launch_kernel(self, kernel_cmd, **kw):
+        kernel = super(CgroupKernelManager, self)._launch_kernel(
+            kernel_cmd, **kw)
+        cgroups = KernelCgroups(self.cgroup_root)
+        if cgroups.available():
+            try:
+                cgroups.add(self.cgroup_name, kernel.pid, self.cpu_shares,
+                            int(cgroups.memory_budget() * self.memory_fraction))
+            except (IOError, OSError, ValueError):
+                self.log.warning('Failed to put kernel %s in a cgroup',
+                                 self.cgroup_name, exc_info=True)
+        return kernel
+
+    def cleanup(self, connection_file=True):
+        super(CgroupKernelManager, self).cleanup(
+            connection_file=connection_file)
+        # The connection file is only kept when the kernel restarts.
+        if connection_file:
+            KernelCgroups(self.cgroup_root).remove(self.cgroup_name)
+
+
+def _kernel_usage(kernel_manager, kernel_id):
+    """Measure what a kernel uses, or return None if it is gone."""
+    try:
+        km = kernel_manager.get_kernel(kernel_id)
+    except KeyError:
+        return None
+    cgroups = KernelCgroups(getattr(km, 'cgroup_root', _CGROUP_ROOT))
+    usage = None
+    if cgroups.available():
+        usage = cgroups.usage(getattr(km, 'cgroup_name', kernel_id))
+    if usage is None and km.has_kernel:
+        usage = _process_usage(km.kernel.pid)
+    return usage
+
+
+class KernelUsageHandler(APIHandler):
+    """Serves the CPU and memory used by each kernel."""
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self):
+        kernel_manager = self.kernel_manager
+        kernels = kernel_manager.list_kernels()
+        # CPU use is measured over a short interval.
+        start = time.time()
+        before = dict((k['id'], _kernel_usage(kernel_manager, k['id']))
+                      for k in kernels)
+        yield gen.sleep(_SAMPLE_INTERVAL_SECONDS)
+        elapsed = time.time() - start
+        usages = []
+        for kernel in kernels:
+            usage = _kernel_usage(kernel_manager, kernel['id'])
+            if usage is None:
+                continue
+            previous = before.get(kernel['id'])
+            usage['cpu_percent'] = None if previous is None else round(
+                100 * (usage['cpu_seconds'] - previous['cpu_seconds']) /
+                elapsed, 1)
+            usage.update(id=kernel['id'], name=kernel['name'],
+                         execution_state=kernel.get('execution_state'))
+            usages.append(usage)
+        cgroups = KernelCgroups()
+        self.finish(json.dumps({
+            'cgroups': cgroups.available(),
+            'memory_budget_bytes': (cgroups.memory_budget()
+                                    if cgroups.available() else None),
+            'kernels': usages,
+        }))
+
+
+def load_jupyter_server_extension(nb_server_app):
+    """Called by Jupyter when this module is loaded as a server extension."""
+    web_app = nb_server_app.web_app
+    pattern = url_path_join(web_app.settings['base_url'],
+                            '/api/datalab/kernelusage')
+    web_app.add_handlers('.*$', [(pattern, KernelUsageHandler)])
@@ -0,0 +1,186 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A Jupyter kernel manager that evicts idle kernels under memory pressure.
+
+Datalab instances are small, and kernels that users forgot about push the
+machine into swap, which slows down the notebook that is actually in use.
+On top of Jupyter's culling of kernels that have been idle for a long
+time, this kernel manager periodically checks the memory available on the
+machine. When it drops below a threshold, it shuts down the pooled
+kernels and then the largest idle kernels, never touching the most
+recently used one, until enough memory is available again.
+
+Evictions are logged and served at /api/datalab/evictions, where the
+notebook page looks up why its kernel went away.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import json
+
+from notebook._tz import isoformat, utcnow
+from notebook.base.handlers import APIHandler
+from notebook.utils import url_path_join
+from tornado import gen, web
+from tornado.ioloop import PeriodicCallback
+from traitlets import Integer
+
+from kernel_pool import PooledMappingKernelManager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+_MAX_EVICTIONS_KEPT = 100
+
+
+class EvictingMappingKernelManager(PooledMappingKernelManager):
+    """A PooledMappingKernelManager that evicts kernels to free memory."""
+
+    eviction_available_memory_mb = Integer(
+        0, config=True,
+        help=('Evict idle kernels while less than this much memory is '
+              'available on the machine. 0 disables eviction.'))
+
+    eviction_min_idle_seconds = Integer(
+        300, config=True,
+        help='Only evict kernels that have been idle for at least this long.')
+
+    eviction_interval_seconds = Integer(
+        30, config=True,
+        help='How often to check the memory available on the machine.')
+
+    def __init__(self, **kwargs):
+        super(EvictingMappingKernelManager, self).__init__(**kwargs)
+        self.evictions = collections.deque(maxlen=_MAX_EVICTIONS_KEPT)
+        self._eviction_callback = None
+
+    def _start_eviction_checks(self):
+        if (self._eviction_callback is not None or psutil is None or
+                self.eviction_available_memory_mb <= 0):
+            return
+        self._eviction_callback = PeriodicCallback(
+            self.evict_under_memory_pressure,
+            1000 * self.eviction_interval_seconds)
+        self._eviction_callback.start()
+
+    @staticmethod
+    def _available_memory_mb():
+        return psutil.virtual_memory().available // (1024 * 1024)
+
+    def _notebook_path(self, kernel_id):
+        # The session of an evicted kernel is dropped as soon as the kernel
+        # is gone, so look its notebook up beforehand.
+        try:
+            cursor = self.parent.session_manager.cursor
+            cursor.execute('SELECT path FROM session WHERE kernel_id=?',
+                           (kernel_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        except Exception:
+            return None
+
+    def _evict(self, kernel_id, reason, available_mb):
+        km = self._kernels[kernel_id]
+        rss_mb = self._kernel_memory_mb(kernel_id)
+        eviction = {
+            'kernel_id': kernel_id,
+            'kernel_name': km.kernel_name,
+            'path': self._notebook_path(kernel_id),
+            'reason': reason,
+            'rss_mb': rss_mb,
+            'available_mb': available_mb,
+            'time': isoformat(utcnow()),
+        }
+        self.log.warning(
+            'Evicting %s kernel %s (%s) to free %dMB of memory; %dMB were '
+            'available', reason, kernel_id, eviction['path'] or 'no notebook',
+            rss_mb, available_mb)
+        for pool in self._pool.values():
+            if kernel_id in pool:
+                pool.remove(kernel_id)
+        # Idle kernels have nothing to clean up, and a graceful shutdown
+        # can take a long time on a machine that is swapping.
+        self.shutdown_kernel(kernel_id, now=True)
+        self.evictions.append(eviction)
+        return rss_mb
+
+    def _eviction_candidates(self):
+        """Get the kernels that may be evicted, largest first."""
+        pooled = self._pooled_kernel_ids()
+        kernels = [(kernel_id, km) for kernel_id, km in self._kernels.items()
+                   if kernel_id not in pooled]
+        if not kernels:
+            return []
+        # The most recently used kernel is the one being worked on.
+        most_recent = max(kernels, key=lambda k: k[1].last_activity)[0]
+        now = utcnow()
+        candidates = []
+        for kernel_id, km in kernels:
+            if kernel_id == most_recent:
+                continue
+            if getattr(km, 'execution_state', None) != 'idle':
+                continue
+            idle_seconds = (now - km.last_activity).total_seconds()
+            if idle_seconds < self.eviction_min_idle_seconds:
+                continue
+            candidates.append(
+                (self._kernel_memory_mb(kernel_id), kernel_id))
+        return [kernel_id for _, kernel_id in sorted(candidates, reverse=True)]
+
+    def evict_under_memory_pressure(self):
+        """Evict kernels until enough memory is available on the machine."""
+        threshold = self.eviction_available_memory_mb
+        available = self._available_memory_mb()
+        if available >= threshold:
+            return
+        try:
+            candidates = (sorted(self._pooled_kernel_ids()) +
+                          self._eviction_candidates())
+            pooled = self._pooled_kernel_ids()
+            for kernel_id in candidates:
+                if available >= threshold:
+                    break
+                reason = 'pooled' if kernel_id in pooled else 'idle'
+                available += self._evict(kernel_id, reason, available)
+        except Exception:
+            self.log.exception('Failed to evict kernels')
+
+    @gen.coroutine
+    def start_kernel(self, kernel_id=None, path=None, **kwargs):
+        kernel_id = yield super(EvictingMappingKernelManager, self).start_kernel(
+            kernel_id=kernel_id, path=path, **kwargs)
+        self._start_eviction_checks()
+        raise gen.Return(kernel_id)
+
+
+class EvictionsHandler(APIHandler):
+    """Serves the recent kernel evictions, most recent first."""
+
+    @web.authenticated
+    def get(self):
+        evictions = getattr(self.kernel_manager, 'evictions', [])
+        self.finish(json.dumps(list(reversed(evictions))))
+
+
+def load_jupyter_server_extension(nb_server_app):
+    """Called by Jupyter when this module is loaded as a server extension."""
+    web_app = nb_server_app.web_app
+    pattern = url_path_join(web_app.settings['base_url'],
+                            '/api/datalab/evictions')
+    web_app.add_handlers('.*$', [(pattern, EvictionsHandler)])
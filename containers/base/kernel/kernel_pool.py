@@ -0,0 +1,235 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A Jupyter kernel manager that keeps a pool of pre-started kernels.
+
+Starting a kernel activates its conda environment and starts IPython,
+which takes several seconds. This kernel manager keeps a few idle kernels
+of each kernelspec running, hands one of them out when a notebook needs a
+new kernel, and then starts a replacement in the background.
+
+Pooled kernels are started in the notebook root directory; when one is
+handed out, it is moved to the directory of the notebook that uses it,
+and if that fails a new kernel is started there instead.
+Pooled kernels are hidden from the kernels API and from idle kernel
+culling until then.
+"""
+
+from __future__ import absolute_import
+
+import json
+import time
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from notebook._tz import utcnow
+from notebook.services.kernels.kernelmanager import MappingKernelManager
+from tornado import gen
+from tornado.ioloop import IOLoop
+from traitlets import Integer, List, Unicode
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# How long to wait for a pooled kernel to change its working directory.
+_CHDIR_TIMEOUT_SECONDS = 10
+
+
+class PooledMappingKernelManager(MappingKernelManager):
+    """A MappingKernelManager that hands out pre-started kernels."""
+
+    pool_size = Integer(
+        0, config=True,
+        help='The number of idle kernels to keep running per kernelspec.')
+
+    pool_kernel_names = List(
+        Unicode(), config=True,
+        help=('The kernelspecs for which to keep idle kernels. If empty, '
+              'all installed kernelspecs are pooled.'))
+
+    pool_max_memory_mb = Integer(
+        0, config=True,
+        help=('Do not start more pooled kernels once the idle ones use this '
+              'much memory in total. 0 means no limit.'))
+
+    pool_min_available_memory_mb = Integer(
+        0, config=True,
+        help=('Do not start pooled kernels while less than this much memory '
+              'is available on the machine. 0 means no limit.'))
+
+    def __init__(self, **kwargs):
+        super(PooledMappingKernelManager, self).__init__(**kwargs)
+        # Map from kernelspec name to the IDs of its idle pooled kernels.
+        self._pool = {}
+        self._filling = False
+        if self.pool_size > 0:
+            IOLoop.current().add_callback(self.fill_pool)
+
+    def _pooled_kernel_names(self):
+        if self.pool_kernel_names:
+            return list(self.pool_kernel_names)
+        return sorted(self.kernel_spec_manager.find_kernel_specs())
+
+    def _pooled_kernel_ids(self):
+        return set(kernel_id for kernel_ids in self._pool.values()
+                   for kernel_id in kernel_ids)
+
+    def _kernel_memory_mb(self, kernel_id):
+        km = self._kernels.get(kernel_id)
+        if psutil is None or km is None or not km.has_kernel:
+            return 0
+        try:
+            process = psutil.Process(km.kernel.pid)
+            rss = process.memory_info().rss
+            for child in process.children(recursive=True):
+                rss += child.memory_info().rss
+            return rss // (1024 * 1024)
+        except psutil.Error:
+            return 0
+
+    def _has_memory_for_another_kernel(self):
+        if psutil is None:
+            return True
+        if self.pool_max_memory_mb > 0:
+            used = sum(self._kernel_memory_mb(kernel_id)
+                       for kernel_id in self._pooled_kernel_ids())
+            if used >= self.pool_max_memory_mb:
+                return False
+        if self.pool_min_available_memory_mb > 0:
+            available = psutil.virtual_memory().available // (1024 * 1024)
+            if available < self.pool_min_available_memory_mb:
+                return False
+        return True
+
+    @gen.coroutine
+    def fill_pool(self):
+        """Start pooled kernels until every pool is full.
+
+        Kernels are started one at a time, and filling stops early when the
+        memory limits would be exceeded.
+        """
+        if self._filling or self.pool_size <= 0:
+            return
+        self._filling = True
+        try:
+            for kernel_name in self._pooled_kernel_names():
+                pool = self._pool.setdefault(kernel_name, [])
+                # Forget about pooled kernels that died in the meantime.
+                pool[:] = [kernel_id for kernel_id in pool
+                           if kernel_id in self._kernels]
+                while len(pool) < self.pool_size:
+                    if not self._has_memory_for_another_kernel():
+                        self.log.info(
+                            'Not starting pooled kernels due to memory limits')
+                        return
+                    kernel_id = yield super(
+                        PooledMappingKernelManager, self).start_kernel(
+                            path='', kernel_name=kernel_name)
+                    pool.append(kernel_id)
+                    self.log.info('Started pooled %s kernel %s',
+                                  kernel_name, kernel_id)
+        except Exception:
+            self.log.exception('Failed to fill the kernel pool')
+        finally:
+            self._filling = False
+
+    def _take_from_pool(self, kernel_name):
+        pool = self._pool.get(kernel_name, [])
+        while pool:
+            kernel_id = pool.pop(0)
+            if kernel_id in self._kernels:
+                return kernel_id
+        return None
+
+    def _chdir(self, km, cwd):
+        """Change the working directory of a running kernel.
+
+        Returns:
+          Whether the kernel replied that it changed its directory.
+        """
+        client = km.blocking_client()
+        client.start_channels(shell=True, iopub=False, stdin=False, hb=False)
+        try:
+            msg_id = client.execute(
+                'import os as __os; __os.chdir({0}); del __os'.format(
+                    json.dumps(cwd)),
+                silent=True, store_history=False)
+            deadline = time.time() + _CHDIR_TIMEOUT_SECONDS
+            while True:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return False
+                try:
+                    reply = client.get_shell_msg(timeout=timeout)
+                except Empty:
+                    return False
+                if reply['parent_header'].get('msg_id') == msg_id:
+                    return reply['content']['status'] == 'ok'
+        finally:
+            client.stop_channels()
+
+    def _adopt(self, kernel_id, path):
+        """Prepare a pooled kernel for use by the notebook at the given path.
+
+        Returns:
+          Whether the kernel can be used. If not, it has been shut down.
+        """
+        km = self._kernels[kernel_id]
+        cwd = self.cwd_for_path(path) if path is not None else None
+        if cwd:
+            # Pooled kernels are idle, so the reply comes right away.
+            if not self._chdir(km, cwd):
+                self.log.warning('Failed to move pooled kernel %s to %s',
+                                 kernel_id, cwd)
+                self.shutdown_kernel(kernel_id, now=True)
+                return False
+            # Restarts should also happen in the notebook's directory.
+            launch_args = getattr(km, '_launch_args', None)
+            if launch_args is not None:
+                launch_args['cwd'] = cwd
+        self.last_kernel_activity = km.last_activity = utcnow()
+        self.log.info('Using pooled kernel %s for %s', kernel_id, path)
+        return True
+
+    @gen.coroutine
+    def start_kernel(self, kernel_id=None, path=None, **kwargs):
+        kernel_name = kwargs.get('kernel_name') or self.default_kernel_name
+        if kernel_id is None and self.pool_size > 0:
+            pooled_id = self._take_from_pool(kernel_name)
+            if pooled_id is not None and self._adopt(pooled_id, path):
+                IOLoop.current().add_callback(self.fill_pool)
+                raise gen.Return(pooled_id)
+        kernel_id = yield super(PooledMappingKernelManager, self).start_kernel(
+            kernel_id=kernel_id, path=path, **kwargs)
+        if self.pool_size > 0:
+            IOLoop.current().add_callback(self.fill_pool)
+        raise gen.Return(kernel_id)
+
+    def list_kernels(self):
+        pooled = self._pooled_kernel_ids()
+        return [model for model in
+                super(PooledMappingKernelManager, self).list_kernels()
+                if model['id'] not in pooled]
+
+    def cull_kernel_if_idle(self, kernel_id):
+        if kernel_id in self._pooled_kernel_ids():
+            return
+        return super(PooledMappingKernelManager, self).cull_kernel_if_idle(
+            kernel_id)
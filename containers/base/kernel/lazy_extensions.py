@@ -0,0 +1,294 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""IPython extension that defers loading the Datalab kernel extensions.
+
+Importing the Datalab kernel extensions and the matplotlib inline backend
+takes several seconds and tens of MB in every kernel, even though many
+notebooks never use them. This extension instead registers placeholder
+magics and a display hook, and only does the expensive imports on first
+use:
+
+  * Running any of the Datalab magics (or any magic that is not yet
+    defined) loads the real kernel extensions and then runs the magic.
+  * Displaying a BigQuery query, table or schema loads them too, and then
+    formats it as the extensions do.
+  * Importing matplotlib selects the inline backend, and the first cell
+    that imports `matplotlib.pyplot` enables it, so that its figures are
+    displayed as usual.
+
+Set DATALAB_EAGER_EXTENSIONS=1 in the environment to load everything at
+kernel startup instead.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import os
+import sys
+import time
+
+
+# The extensions that used to be loaded at kernel startup.
+_KERNEL_EXTENSIONS = ['google.datalab.kernel', 'datalab.kernel']
+
+# The magics defined by the kernel extensions. These get placeholders so
+# that they show up in `%lsmagic` and tab completion before the real
+# extensions are loaded; any other magic is resolved on a lookup miss.
+_KERNEL_MAGICS = [
+    'bigquery', 'bq', 'chart', 'csv', 'datalab', 'extension', 'gcs', 'ml',
+    'monitoring', 'pymodule', 'sd', 'sql', 'storage',
+]
+
+# The types for which the kernel extensions register HTML formatters. These
+# get placeholder formatters, registered by name so that nothing is
+# imported, which load the extensions when such an object is displayed.
+_KERNEL_FORMATTED_TYPES = [
+    ('google.datalab.bigquery._query', 'Query'),
+    ('google.datalab.bigquery._query_stats', 'QueryStats'),
+    ('google.datalab.bigquery._schema', 'Schema'),
+    ('google.datalab.bigquery._table', 'Table'),
+    ('datalab.bigquery._query', 'Query'),
+    ('datalab.bigquery._query_results_table', 'QueryResultsTable'),
+    ('datalab.bigquery._query_stats', 'QueryStats'),
+    ('datalab.bigquery._schema', 'Schema'),
+    ('datalab.bigquery._table', 'Table'),
+]
+
+_INLINE_BACKEND = 'module://ipykernel.pylab.backend_inline'
+
+# When the extensions started and finished loading, as reported to
+# benchmark_kernel_start.py.
+startup_timings = {}
+
+
+class _LazyExtensions(object):
+    """Loads the kernel extensions into a shell on first use."""
+
+    def __init__(self, shell):
+        self._shell = shell
+        self._loaded = False
+        self._find_line_magic = shell.find_line_magic
+        self._find_cell_magic = shell.find_cell_magic
+
+    def load(self):
+        """Load the kernel extensions if they have not been loaded yet.
+
+        Returns:
+          True if the extensions were loaded by this call.
+        """
+        if self._loaded:
+            return False
+        self._loaded = True
+        # Restore the original lookups so that the real magics replace
+        # the placeholders and later misses are reported as usual.
+        self._shell.find_line_magic = self._find_line_magic
+        self._shell.find_cell_magic = self._find_cell_magic
+        for extension in _KERNEL_EXTENSIONS:
+            try:
+                self._shell.extension_manager.load_extension(extension)
+            except Exception:
+                self._shell.showtraceback()
+        return True
+
+    def find_line_magic(self, magic_name):
+        magic = self._find_line_magic(magic_name)
+        if magic is None and self.load():
+            magic = self._find_line_magic(magic_name)
+        return magic
+
+    def find_cell_magic(self, magic_name):
+        magic = self._find_cell_magic(magic_name)
+        if magic is None and self.load():
+            magic = self._find_cell_magic(magic_name)
+        return magic
+
+    def placeholder(self, magic_name):
+        """Create a placeholder magic that runs the real one once loaded.
+
+        Args:
+          magic_name: The name of the magic
+        Returns:
+          A function that can be registered as a line and cell magic.
+        """
+        def run_magic(line, cell=None):
+            self.load()
+            if cell is None:
+                magic = self._find_line_magic(magic_name)
+            else:
+                magic = self._find_cell_magic(magic_name)
+            if magic is None or magic is run_magic:
+                from IPython.core.error import UsageError
+                raise UsageError(
+                    '{0} magic function `{1}` not found.'.format(
+                        'Line' if cell is None else 'Cell', magic_name))
+            if cell is not None:
+                return magic(line, cell)
+            if getattr(magic, 'needs_local_scope', False):
+                # Placeholders only ever run at the top level of a cell.
+                return magic(line, local_ns=self._shell.user_ns)
+            return magic(line)
+        run_magic.__name__ = magic_name
+        run_magic.__doc__ = (
+            'Placeholder for `{0}`; the Datalab extensions are loaded on '
+            'first use.'.format(magic_name))
+        return run_magic
+
+    def placeholder_formatter(self, type_name):
+        """Create a placeholder HTML formatter that runs the real one.
+
+        Args:
+          type_name: The full name of the type that it formats
+        Returns:
+          A function that can be registered as an HTML formatter.
+        """
+        def format_html(obj):
+            self.load()
+            formatter = self._shell.display_formatter.formatters['text/html']
+            # The real formatter, registered by name, does not replace
+            # this one for types that have already been looked up.
+            formatter.pop(type(obj), None)
+            try:
+                real_format = formatter.lookup_by_type(type_name)
+            except KeyError:
+                real_format = None
+            if real_format is None or real_format is format_html:
+                formatter.pop(type_name, None)
+                repr_html = getattr(obj, '_repr_html_', None)
+                return repr_html() if repr_html is not None else None
+            formatter.for_type(type(obj), real_format)
+            return real_format(obj)
+        return format_html
+
+    def register(self):
+        """Register the placeholders and the magic lookup fallback."""
+        for magic_name in _KERNEL_MAGICS:
+            if (self._find_line_magic(magic_name) is None and
+                    self._find_cell_magic(magic_name) is None):
+                self._shell.register_magic_function(
+                    self.placeholder(magic_name), magic_kind='line_cell',
+                    magic_name=magic_name)
+        formatter = self._shell.display_formatter.formatters['text/html']
+        for module_name, name in _KERNEL_FORMATTED_TYPES:
+            formatter.for_type_by_name(
+                module_name, name, self.placeholder_formatter(
+                    '{0}.{1}'.format(module_name, name)))
+        self._shell.find_line_magic = self.find_line_magic
+        self._shell.find_cell_magic = self.find_cell_magic
+
+
+class _InlineBackendSelector(object):
+    """Selects the inline matplotlib backend once matplotlib is imported.
+
+    This is an import hook rather than the MPLBACKEND variable, which the
+    processes run from the kernel, such as `!python plot.py`, would inherit
+    along with a backend that only works in a kernel.
+    """
+
+    def __init__(self):
+        self._importing = False
+
+    def find_spec(self, fullname, path=None, target=None):
+        """Find matplotlib as usual, selecting the backend once it runs."""
+        if fullname != 'matplotlib' or self._importing:
+            return None
+        import importlib.util
+        self._importing = True
+        try:
+            spec = importlib.util.find_spec(fullname)
+        finally:
+            self._importing = False
+        if spec is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def exec_and_select(module):
+            exec_module(module)
+            self.unregister()
+            self.select(module)
+        spec.loader.exec_module = exec_and_select
+        return spec
+
+    def find_module(self, fullname, path=None):
+        # Python 2 has no find_spec.
+        if fullname == 'matplotlib' and not self._importing:
+            return self
+        return None
+
+    def load_module(self, fullname):
+        self._importing = True
+        try:
+            module = importlib.import_module(fullname)
+        finally:
+            self._importing = False
+        self.unregister()
+        self.select(module)
+        return module
+
+    @staticmethod
+    def select(matplotlib):
+        # A backend that the user chose takes precedence.
+        if 'MPLBACKEND' not in os.environ:
+            matplotlib.rcParams['backend'] = _INLINE_BACKEND
+
+    def register(self):
+        if 'matplotlib' in sys.modules:
+            self.select(sys.modules['matplotlib'])
+        else:
+            sys.meta_path.insert(0, self)
+
+    def unregister(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+
+class _LazyInlineBackend(object):
+    """Enables the inline matplotlib backend once pyplot is imported."""
+
+    def __init__(self, shell):
+        self._shell = shell
+
+    def post_execute(self):
+        if 'matplotlib.pyplot' not in sys.modules:
+            return
+        self._shell.events.unregister('post_execute', self.post_execute)
+        self._shell.enable_matplotlib('inline')
+        # The figures of the current cell were created before the inline
+        # support was set up, so its own post_execute hook has not seen
+        # them; display them here.
+        from ipykernel.pylab import backend_inline
+        backend_inline.show(True)
+
+    def register(self):
+        # Make sure pyplot selects the inline backend even when it is
+        # imported before the hook above gets a chance to run.
+        _InlineBackendSelector().register()
+        self._shell.events.register('post_execute', self.post_execute)
+
+
+def _eager():
+    return os.environ.get('DATALAB_EAGER_EXTENSIONS', '') not in ('', '0')
+
+
+def load_ipython_extension(shell):
+    """Called by IPython when this module is loaded as an extension."""
+    startup_timings['extensions_started_at'] = time.time()
+    if _eager():
+        for extension in _KERNEL_EXTENSIONS:
+            shell.extension_manager.load_extension(extension)
+        shell.enable_matplotlib('inline')
+    else:
+        _LazyExtensions(shell).register()
+        _LazyInlineBackend(shell).register()
+    startup_timings['extensions_loaded_at'] = time.time()
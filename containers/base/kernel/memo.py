@@ -0,0 +1,277 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The %%memo cell magic, which caches the results of expensive cells.
+
+A cell such as
+
+    %%memo --inputs start_date,params --files data/users.csv --outputs df
+    df = run_expensive_query(start_date, params)
+
+is only run if no earlier run of the same cell source, with the same
+values of the input variables and the same contents of the input files,
+was cached. Otherwise the output variables are loaded from the cache on
+the persistent disk, so a notebook re-run after a kernel restart skips
+straight past the stages whose inputs have not changed.
+
+Outputs are stored as Parquet (DataFrames, when pyarrow is installed),
+.npy (NumPy arrays) or pickles. The cache is limited in size, evicting the
+least recently used results first. `%memo` shows the size of the cache
+and `%memo clear` empties it.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import hashlib
+import os
+import pickle
+import sys
+import time
+
+from IPython.core import magic_arguments
+from IPython.core.error import UsageError
+from IPython.core.magic import Magics, line_cell_magic, magics_class
+
+from disk_cache import DiskCache, max_size_bytes, names
+
+
+_DATALAB_ROOT = os.getenv('DATALAB_ROOT', '/')
+_CACHE_DIR = os.path.join(_DATALAB_ROOT, 'content/datalab/.cache/memo')
+_DEFAULT_MAX_SIZE_MB = 10 * 1024
+
+# Pickles are not portable between Python 2 and 3, so keep the results of
+# the two kernels apart.
+_PICKLE_PROTOCOL = 2
+
+
+def _hash_value(digest, value):
+    """Add a variable's value to a hash.
+
+    DataFrames and arrays are hashed from their data, which is much
+    faster than pickling them. Everything else is pickled.
+    """
+    pandas = sys.modules.get('pandas')
+    numpy = sys.modules.get('numpy')
+    if pandas is not None and isinstance(value, (pandas.DataFrame,
+                                                 pandas.Series)):
+        digest.update(type(value).__name__.encode('utf-8'))
+        labels = value.columns if hasattr(value, 'columns') else value.name
+        digest.update(repr(labels).encode('utf-8'))
+        digest.update(repr(value.dtypes).encode('utf-8'))
+        digest.update(pandas.util.hash_pandas_object(value, index=True).values)
+    elif numpy is not None and isinstance(value, numpy.ndarray) and \
+            value.dtype != object:
+        digest.update(repr((value.dtype.str, value.shape)).encode('utf-8'))
+        digest.update(numpy.ascontiguousarray(value).data)
+    else:
+        digest.update(pickle.dumps(value, _PICKLE_PROTOCOL))
+
+
+def _hash_file(digest, path):
+    digest.update(path.encode('utf-8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+
+
+def _save_value(directory, name, value):
+    """Save a variable to a file, in the best format for its type.
+
+    Returns:
+      The format that was used.
+    """
+    pandas = sys.modules.get('pandas')
+    numpy = sys.modules.get('numpy')
+    base = os.path.join(directory, name)
+    if pandas is not None and isinstance(value, pandas.DataFrame):
+        try:
+            value.to_parquet(base + '.parquet', engine='pyarrow')
+            return 'parquet'
+        except Exception:
+            # pyarrow is missing, or cannot represent these columns.
+            if os.path.exists(base + '.parquet'):
+                os.remove(base + '.parquet')
+    if numpy is not None and isinstance(value, numpy.ndarray) and \
+            value.dtype != object:
+        numpy.save(base + '.npy', value, allow_pickle=False)
+        return 'npy'
+    with open(base + '.pickle', 'wb') as f:
+        pickle.dump(value, f, _PICKLE_PROTOCOL)
+    return 'pickle'
+
+
+def _load_value(directory, name, format):
+    base = os.path.join(directory, name)
+    if format == 'parquet':
+        import pandas
+        return pandas.read_parquet(base + '.parquet', engine='pyarrow')
+    if format == 'npy':
+        import numpy
+        return numpy.load(base + '.npy', allow_pickle=False)
+    with open(base + '.pickle', 'rb') as f:
+        return pickle.load(f)
+
+
+class MemoCache(DiskCache):
+    """Cached cell results in a directory, one subdirectory per result."""
+
+    def __init__(self, cache_dir=_CACHE_DIR, max_size=None):
+        super(MemoCache, self).__init__(
+            cache_dir, max_size if max_size is not None else max_size_bytes(
+                'DATALAB_MEMO_MAX_SIZE_MB', _DEFAULT_MAX_SIZE_MB))
+
+    def key(self, source, inputs, files, outputs):
+        """Compute the key of a cell's result.
+
+        Args:
+          source: The source of the cell
+          inputs: A list of (name, value) pairs of the input variables
+          files: A list of paths of the input files
+          outputs: A list of the names of the output variables
+        Returns:
+          A hex digest.
+        """
+        digest = hashlib.sha256()
+        digest.update('python{0}\0'.format(sys.version_info[0]).encode('utf-8'))
+        digest.update(source.encode('utf-8'))
+        digest.update(('\0' + ','.join(sorted(outputs))).encode('utf-8'))
+        for name, value in inputs:
+            digest.update(('\0' + name + '\0').encode('utf-8'))
+            _hash_value(digest, value)
+        for path in files:
+            digest.update(b'\0')
+            _hash_file(digest, path)
+        return digest.hexdigest()
+
+    def load(self, key):
+        """Load a cached result.
+
+        Returns:
+          A tuple of the manifest and a dict of the output variables, or
+          None if the result is not cached.
+        """
+        try:
+            manifest = self.manifest(key)
+            values = dict(
+                (name, _load_value(self.path(key), name, format))
+                for name, format in manifest['outputs'].items())
+            self.touch(key)
+        except Exception:
+            return None
+        return manifest, values
+
+    def save(self, key, values, manifest):
+        """Cache a result, evicting old ones if the cache is full.
+
+        Args:
+          key: The key of the result
+          values: A dict of the output variables
+          manifest: A JSON-serializable dict describing the result
+        """
+        def write(directory):
+            return dict(manifest, outputs=dict(
+                (name, _save_value(directory, name, value))
+                for name, value in values.items()))
+
+        self.store(key, write)
+
+
+@magics_class
+class MemoMagics(Magics):
+
+    def __init__(self, shell, cache=None):
+        super(MemoMagics, self).__init__(shell)
+        self._cache = cache or MemoCache()
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        'command', nargs='?', choices=['info', 'clear'],
+        help='without a cell: show the size of the cache, or clear it')
+    @magic_arguments.argument(
+        '-i', '--inputs',
+        help='comma-separated variables that the cell reads')
+    @magic_arguments.argument(
+        '-f', '--files',
+        help='comma-separated paths of files that the cell reads')
+    @magic_arguments.argument(
+        '-o', '--outputs',
+        help='comma-separated variables that the cell sets')
+    @magic_arguments.argument(
+        '--refresh', action='store_true',
+        help='run the cell even if its result is cached')
+    @line_cell_magic
+    def memo(self, line, cell=None):
+        """Cache the output variables of a cell on the persistent disk."""
+        args = magic_arguments.parse_argstring(self.memo, line)
+        if cell is None:
+            if args.command == 'clear':
+                self._cache.clear()
+                print('Cleared the memo cache.')
+                return
+            entries = self._cache.entries()
+            print('{0} cached results using {1:.1f} MB of {2:.0f} MB in {3}'.format(
+                len(entries), sum(size for _, size, _ in entries) / 1048576.0,
+                self._cache.max_size / 1048576.0, self._cache.cache_dir))
+            return
+
+        outputs = names(args.outputs)
+        if not outputs:
+            raise UsageError('%%memo needs at least one variable in --outputs')
+        user_ns = self.shell.user_ns
+        inputs = []
+        for name in names(args.inputs):
+            if name not in user_ns:
+                raise UsageError('Input variable {0} is not defined'.format(name))
+            inputs.append((name, user_ns[name]))
+        files = [os.path.expanduser(path) for path in names(args.files)]
+        key = self._cache.key(cell, inputs, files, outputs)
+
+        if not args.refresh:
+            cached = self._cache.load(key)
+            # Results cached without one of the outputs do not count.
+            if cached is not None and all(name in cached[1] for name in outputs):
+                manifest, values = cached
+                user_ns.update(values)
+                print('Loaded {0} from the memo cache; running the cell took '
+                      '{1:.1f}s on {2}.'.format(
+                          ', '.join(sorted(values)), manifest['seconds'],
+                          time.strftime('%Y-%m-%d %H:%M',
+                                        time.localtime(manifest['created']))))
+                return
+
+        start = time.time()
+        code = self.shell.input_transformer_manager.transform_cell(cell)
+        # Compile with the shell's __future__ flags rather than this
+        # module's, so the cell runs as it would without the magic.
+        exec(compile(code, '<memo>', 'exec', self.shell.compile.flags, True),
+             self.shell.user_global_ns, user_ns)
+        seconds = time.time() - start
+
+        missing = [name for name in outputs if name not in user_ns]
+        if missing:
+            raise UsageError('The cell did not set the output variables {0}'.format(
+                ', '.join(missing)))
+        try:
+            self._cache.save(
+                key, dict((name, user_ns[name]) for name in outputs),
+                {'created': start, 'seconds': seconds})
+        except Exception as e:
+            print('Failed to cache the results of the cell: {0}'.format(e),
+                  file=sys.stderr)
+
+
+def load_ipython_extension(shell):
+    """Called by IPython when this module is loaded as an extension."""
+    shell.register_magics(MemoMagics(shell))
@@ -0,0 +1,288 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Jupyter server extension that caches nbconvert exports.
+
+Exporting a notebook to HTML re-renders all of it, which takes seconds
+for notebooks with many image outputs. This extension serves the
+`/nbconvert/<format>/<path>` endpoints from a cache on the persistent
+disk instead, keyed by a hash of the notebook file, the export format,
+the templates and the nbconvert version.
+
+The cache is limited in size, evicting the least recently used exports
+first, and the exports of a notebook are dropped when it is saved.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import tempfile
+
+import nbconvert
+from ipython_genutils import text
+from nbconvert.exporters.export import get_exporter
+from notebook.base.handlers import IPythonHandler, path_regex
+from notebook.nbconvert.handlers import _format_regex, respond_zip
+from notebook.utils import url_path_join
+from tornado import web
+from traitlets import Integer, Unicode
+from traitlets.config import LoggingConfigurable
+
+
+_DATALAB_ROOT = os.getenv('DATALAB_ROOT', '/')
+
+# The cache used by the post-save hook, once the extension is loaded.
+_cache = None
+
+
+class NbconvertCache(LoggingConfigurable):
+    """A size-limited directory of rendered notebooks."""
+
+    cache_dir = Unicode(
+        os.path.join(_DATALAB_ROOT, 'content/datalab/.cache/nbconvert'),
+        config=True, help='The directory in which to keep rendered notebooks.')
+
+    max_size_mb = Integer(
+        512, config=True,
+        help='The maximum total size of the rendered notebooks to keep.')
+
+    template_dir = Unicode(
+        os.path.join(_DATALAB_ROOT, 'datalab/nbconvert'), config=True,
+        help='The directory with the Datalab nbconvert templates.')
+
+    def _template_fingerprint(self):
+        # The templates and the files that they include only change when
+        # the image or pydatalab is updated, so their sizes and mtimes are
+        # enough to tell versions apart.
+        entries = []
+        try:
+            for name in sorted(os.listdir(self.template_dir)):
+                stat = os.stat(os.path.join(self.template_dir, name))
+                entries.append((name, stat.st_size, stat.st_mtime))
+        except OSError:
+            pass
+        return entries
+
+    @staticmethod
+    def path_prefix(os_path):
+        """Get the prefix of the cache entries for a notebook file."""
+        return hashlib.sha1(os_path.encode('utf-8')).hexdigest()[:16]
+
+    def key(self, os_path, content, format, modified_date):
+        """Get the cache key of an export of a notebook.
+
+        Args:
+          os_path: The path of the notebook file
+          content: The raw contents of the notebook file
+          format: The export format, e.g. 'html'
+          modified_date: The modification date shown in the export
+        Returns:
+          The name of the cache entry.
+        """
+        digest = hashlib.sha256(content)
+        digest.update(json.dumps([
+            format, modified_date, nbconvert.__version__,
+            self._template_fingerprint()]).encode('utf-8'))
+        return '{0}-{1}'.format(self.path_prefix(os_path), digest.hexdigest())
+
+    def get(self, key):
+        """Get a cached export.
+
+        Args:
+          key: The name of the cache entry
+        Returns:
+          A tuple of the output and its metadata, or None if not cached.
+        """
+        entry_path = os.path.join(self.cache_dir, key)
+        try:
+            with open(entry_path, 'rb') as f:
+                metadata = json.loads(f.readline().decode('utf-8'))
+                output = f.read()
+            # Mark the entry as recently used.
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return output, metadata
+
+    def put(self, key, output, metadata):
+        """Add an export to the cache, evicting old ones if it is full.
+
+        Args:
+          key: The name of the cache entry
+          output: The exported notebook, as bytes
+          metadata: A JSON-serializable dict describing the output
+        """
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(metadata).encode('utf-8') + b'\n')
+                f.write(output)
+            os.rename(temp_path, os.path.join(self.cache_dir, key))
+        except (IOError, OSError) as e:
+            self.log.warning('Failed to cache the export %s: %s', key, e)
+            return
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used exports until the cache fits."""
+        try:
+            entries = sorted(self._entries())
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        max_size = self.max_size_mb * 1024 * 1024
+        for _, size, name in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+    def invalidate(self, os_path):
+        """Remove every cached export of a notebook file."""
+        prefix = self.path_prefix(os_path) + '-'
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+
+class CachedNbconvertFileHandler(IPythonHandler):
+    """Serves /nbconvert/<format>/<path> from the cache when possible.
+
+    This mirrors notebook.nbconvert.handlers.NbconvertFileHandler, which
+    it replaces.
+    """
+
+    SUPPORTED_METHODS = ('GET',)
+
+    @property
+    def cache(self):
+        return self.settings['nbconvert_cache']
+
+    def _respond(self, name, output, metadata):
+        if self.get_argument('download', 'false').lower() == 'true':
+            filename = os.path.splitext(name)[0] + metadata['output_extension']
+            self.set_attachment_header(filename)
+        if metadata.get('mimetype'):
+            self.set_header('Content-Type',
+                            '%s; charset=utf-8' % metadata['mimetype'])
+        self.set_header('Cache-Control',
+                        'no-store, no-cache, must-revalidate, max-age=0')
+        self.finish(output)
+
+    @web.authenticated
+    def get(self, format, path):
+        path = path.strip('/')
+        model = self.contents_manager.get(path=path)
+        name = model['name']
+        if model['type'] != 'notebook':
+            raise web.HTTPError(400, 'Not a notebook: %s' % path)
+        self.set_header('Last-Modified', model['last_modified'])
+        mod_date = model['last_modified'].strftime(text.date_format)
+
+        key = None
+        ext_resources_dir = None
+        if hasattr(self.contents_manager, '_get_os_path'):
+            os_path = self.contents_manager._get_os_path(path)
+            ext_resources_dir = os.path.dirname(os_path)
+            try:
+                with open(os_path, 'rb') as f:
+                    key = self.cache.key(os_path, f.read(), format, mod_date)
+            except (IOError, OSError):
+                key = None
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                self.set_header('X-Datalab-Render-Cache', 'hit')
+                self._respond(name, *cached)
+                return
+
+        exporter = get_exporter(format, config=self.config, log=self.log)
+        resource_dict = {
+            'metadata': {
+                'name': os.path.splitext(name)[0],
+                'modified_date': mod_date,
+            },
+            'config_dir': self.application.settings['config_dir'],
+        }
+        if ext_resources_dir:
+            resource_dict['metadata']['path'] = ext_resources_dir
+        try:
+            output, resources = exporter.from_notebook_node(
+                model['content'], resources=resource_dict)
+        except Exception as e:
+            self.log.exception('nbconvert failed: %s', e)
+            raise web.HTTPError(500, 'nbconvert failed: %s' % e)
+
+        # Exports with extra files are served as zip archives, which are
+        # not worth caching.
+        if respond_zip(self, name, output, resources):
+            return
+
+        metadata = {
+            'mimetype': exporter.output_mimetype,
+            'output_extension': resources['output_extension'],
+        }
+        if key:
+            if not isinstance(output, bytes):
+                output = output.encode('utf-8')
+            self.cache.put(key, output, metadata)
+            self.set_header('X-Datalab-Render-Cache', 'miss')
+        self._respond(name, output, metadata)
+
+
+def post_save_hook(os_path, contents_manager, **kwargs):
+    """Drop the cached exports of a notebook when it is saved.
+
+    This is configured as FileContentsManager.post_save_hook.
+    """
+    if _cache is not None and os_path.endswith('.ipynb'):
+        _cache.invalidate(os_path)
+
+
+def load_jupyter_server_extension(nb_server_app):
+    """Called by Jupyter when this module is loaded as a server extension."""
+    global _cache
+    _cache = NbconvertCache(parent=nb_server_app)
+    web_app = nb_server_app.web_app
+    web_app.settings['nbconvert_cache'] = _cache
+    pattern = url_path_join(web_app.settings['base_url'],
+                            r'/nbconvert/%s%s' % (_format_regex, path_regex))
+    # Added handlers take precedence over the default ones.
+    web_app.add_handlers('.*$', [(pattern, CachedNbconvertFileHandler)])
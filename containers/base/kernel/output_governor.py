@@ -0,0 +1,429 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Limits how much output a cell sends to the notebook.
+
+A runaway print loop or a very high resolution figure can produce
+hundreds of MB of output, which freezes the browser, saturates the SSH
+tunnel and bloats every autosave of the notebook. As an IPython
+extension, this module governs the output of every cell:
+
+  * Stream output faster than `outputStreamRateKBPerSec` is written to a
+    file instead of being sent; the skipped output is replaced by a single
+    marker once the stream slows down again.
+  * Once a cell has sent `outputCellLimitMB` of output, the rest of it is
+    written to files instead.
+  * Images larger than `outputImageLimitKB` are recompressed, and
+    downsampled if that is not enough, keeping their displayed size.
+
+Files are written to `datalab_output/` next to the notebook, and linked
+from the cell's output. The limits are read from the user settings of
+the Datalab server, so changes apply from the next cell on; 0 turns a
+limit off. The Datalab server enforces a larger limit on the output of a
+cell as a backstop, for kernels that do not load this extension.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+
+_DATALAB_ROOT = os.getenv('DATALAB_ROOT', '/')
+_SETTINGS_PATH = os.getenv('DATALAB_USER_SETTINGS') or os.path.join(
+    _DATALAB_ROOT, 'content/datalab/.config/settings.json')
+_OUTPUT_DIR = 'datalab_output'
+
+# The user settings, and their defaults for settings files written before
+# they existed.
+_DEFAULT_LIMITS = {
+    'outputCellLimitMB': 20,
+    'outputStreamRateKBPerSec': 512,
+    'outputImageLimitKB': 1024,
+}
+
+# Stream output may briefly exceed the rate by this many seconds' worth.
+_STREAM_BURST_SECONDS = 4
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_JPEG_SIGNATURE = b'\xff\xd8'
+_IMAGE_EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg'}
+_MAX_RESIZE_ATTEMPTS = 4
+
+
+def _size_mb(size):
+    if size < 1048576:
+        return '{0:.0f} KB'.format(size / 1024)
+    return '{0:.1f} MB'.format(size / 1048576)
+
+
+def _value_size(value):
+    """Approximate the size of a value in a mimebundle, once JSON encoded."""
+    if isinstance(value, bytes) and (value.startswith(_PNG_SIGNATURE) or
+                                     value.startswith(_JPEG_SIGNATURE)):
+        # Raw images are sent base64 encoded.
+        return len(value) * 4 // 3
+    if isinstance(value, (dict, list)):
+        try:
+            return len(json.dumps(value, default=str))
+        except (TypeError, ValueError):
+            return 0
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+
+def _bundle_size(data):
+    return sum(_value_size(value) for value in data.values())
+
+
+def _image_bytes(value):
+    """Get the raw bytes of an image from a mimebundle."""
+    if isinstance(value, bytes) and (value.startswith(_PNG_SIGNATURE) or
+                                     value.startswith(_JPEG_SIGNATURE)):
+        return value
+    import base64
+    return base64.b64decode(value)
+
+
+def _shrink_image(raw, limit):
+    """Recompress, and if needed downsample, an image to fit in a limit.
+
+    Args:
+      raw: The bytes of a PNG or JPEG image
+      limit: The size to fit the image in, once base64 encoded
+    Returns:
+      A tuple of the MIME type, bytes, and pixel width and height of the
+      original, or None if the image could not be made small enough.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    image = Image.open(io.BytesIO(raw))
+    width, height = image.size
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    # Photographs and dense plots compress far better as JPEG, which only
+    # works for images without transparency.
+    opaque = 'A' not in image.mode
+    scale = 1.0
+    for _ in range(_MAX_RESIZE_ATTEMPTS):
+        resized = image
+        if scale < 1.0:
+            resized = image.resize(
+                (max(1, int(width * scale)), max(1, int(height * scale))),
+                Image.LANCZOS)
+        output = io.BytesIO()
+        if opaque:
+            resized.save(output, format='JPEG', quality=85)
+            mime_type = 'image/jpeg'
+        else:
+            resized.save(output, format='PNG', optimize=True)
+            mime_type = 'image/png'
+        shrunk = output.getvalue()
+        size = len(shrunk) * 4 // 3
+        if size <= limit:
+            return mime_type, shrunk, width, height
+        # Encoded sizes grow roughly with the number of pixels.
+        scale *= min(0.9, math.sqrt(limit / size))
+    return None
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _link_bundle(text, path):
+    return {
+        'text/plain': '{0}: {1}'.format(text, path),
+        'text/html': '{0}: <a href="{1}" target="_blank">{1}</a>'.format(
+            escape(text), escape(path, quote=True)),
+    }
+
+
+class OutputGovernor(object):
+    """Applies the output limits to the streams and displays of a shell."""
+
+    def __init__(self, shell, settings_path=_SETTINGS_PATH):
+        self._shell = shell
+        self._settings_path = settings_path
+        self._settings_mtime = None
+        # Set by the first cell; see pre_run_cell.
+        self._output_dir = None
+        self.limits = dict(_DEFAULT_LIMITS)
+        self._lock = threading.Lock()
+        self._in_cell = False
+        self._reset_cell()
+
+    def _reset_cell(self):
+        self._cell_bytes = 0
+        self._over_limit = False
+        self._tokens = None
+        self._throttled = False
+        self._last_refill = time.time()
+        self._stream_file = None
+        self._stream_path = None
+        self._skipped_bytes = 0
+        self._spill_count = 0
+
+    def load_limits(self):
+        """Reload the limits if the user settings have changed."""
+        try:
+            mtime = os.path.getmtime(self._settings_path)
+        except OSError:
+            return
+        if mtime == self._settings_mtime:
+            return
+        self._settings_mtime = mtime
+        try:
+            with open(self._settings_path) as f:
+                settings = json.load(f)
+        except (IOError, ValueError):
+            return
+        for name, default in _DEFAULT_LIMITS.items():
+            try:
+                self.limits[name] = max(0.0, float(settings.get(name, default)))
+            except (TypeError, ValueError):
+                self.limits[name] = default
+
+    def install(self):
+        """Wraps the output methods of the shell, and hooks its cells."""
+        display_pub = self._shell.display_pub
+        display_pub.publish = self._governed_display(display_pub.publish)
+        displayhook = self._shell.displayhook
+        displayhook.write_format_data = self._governed_display(
+            displayhook.write_format_data)
+        for stream in (sys.stdout, sys.stderr):
+            stream.write = self._governed_stream(stream.write)
+        self._publish = display_pub.publish
+        self._shell.events.register('pre_run_cell', self.pre_run_cell)
+        self._shell.events.register('post_run_cell', self.post_run_cell)
+
+    def pre_run_cell(self, *unused_args):
+        if self._output_dir is None:
+            # The links to the files are relative to the notebook, so the
+            # files go next to it even if a cell changes the working
+            # directory later. Kernels from the pool are only moved to the
+            # notebook's directory after loading the extensions, by a silent
+            # request that does not run these hooks.
+            self._output_dir = os.path.join(os.getcwd(), _OUTPUT_DIR)
+        self.load_limits()
+        with self._lock:
+            self._reset_cell()
+            self._in_cell = True
+
+    def post_run_cell(self, *unused_args):
+        with self._lock:
+            self._in_cell = False
+            if self._stream_file:
+                self._stream_file.close()
+            path = self._stream_path
+        if path:
+            self._publish(_link_bundle('Full output written to', path))
+
+    def _spill_path(self, extension):
+        """Choose a new file for output that is not sent.
+
+        Returns:
+          A tuple of the path of the file, and the path relative to the
+          notebook with which to link to it.
+        """
+        if not os.path.isdir(self._output_dir):
+            os.makedirs(self._output_dir)
+        name = '{0}-cell{1}-{2}.{3}'.format(
+            time.strftime('%Y%m%d-%H%M%S'), self._shell.execution_count,
+            self._spill_count + 1, extension)
+        self._spill_count += 1
+        return (os.path.join(self._output_dir, name),
+                os.path.join(_OUTPUT_DIR, name))
+
+    def _admit(self, size, stream):
+        """Count output against the limits of the cell, if it fits them."""
+        cell_limit = self.limits['outputCellLimitMB'] * 1048576
+        if self._over_limit or (cell_limit and
+                                self._cell_bytes + size > cell_limit):
+            self._over_limit = True
+            return False
+        rate = self.limits['outputStreamRateKBPerSec'] * 1024
+        if stream and rate:
+            now = time.time()
+            burst = rate * _STREAM_BURST_SECONDS
+            if self._tokens is None:
+                self._tokens = burst
+            self._tokens = min(
+                burst, self._tokens + (now - self._last_refill) * rate)
+            self._last_refill = now
+            # Once throttled, wait for the stream to slow down rather than
+            # letting a trickle through.
+            if self._throttled and self._tokens < burst / 2:
+                return False
+            self._throttled = self._tokens < size
+            if self._throttled:
+                return False
+            self._tokens -= size
+        self._cell_bytes += size
+        return True
+
+    def _governed_stream(self, write):
+        def governed(text):
+            with self._lock:
+                if not self._in_cell:
+                    notice = None
+                    admitted = True
+                else:
+                    notice, admitted = self._govern_stream(text)
+            if notice:
+                write(notice)
+            if admitted:
+                return write(text)
+        return governed
+
+    def _govern_stream(self, text):
+        """Decide whether stream text is sent, and write it to a file if not.
+
+        Once some of a cell's stream output has been skipped, all of it is
+        also written to a file, so the file has all of it from that point.
+
+        Returns:
+          A tuple of a notice to send before the text, if any, and whether
+          to send the text.
+        """
+        admitted = self._admit(len(text), stream=True)
+        notice = None
+        if not admitted and self._stream_file is None:
+            try:
+                path, link = self._spill_path('txt')
+                self._stream_file = io.open(path, 'w', encoding='utf-8',
+                                            errors='replace')
+                self._stream_path = link
+            except (IOError, OSError):
+                # Skip the output rather than fail the cell.
+                self._stream_file = False
+                link = 'nowhere; the file could not be written'
+            if self._over_limit:
+                notice = '\n[The output of this cell exceeded {0}; the rest is ' \
+                    'written to {1}]\n'.format(
+                        _size_mb(self.limits['outputCellLimitMB'] * 1048576),
+                        link)
+            else:
+                notice = '\n[Output is arriving faster than {0:g} KB/s; what ' \
+                    'cannot be sent is written to {1}]\n'.format(
+                        self.limits['outputStreamRateKBPerSec'], link)
+        if admitted and self._skipped_bytes:
+            # Coalesce everything skipped while the stream was too fast into
+            # a single marker.
+            notice = '\n[... {0} of output skipped; see {1} ...]\n'.format(
+                _size_mb(self._skipped_bytes), self._stream_path)
+            self._skipped_bytes = 0
+        elif not admitted:
+            self._skipped_bytes += len(text)
+        if self._stream_file:
+            self._stream_file.write(_text(text))
+        return notice, admitted
+
+    def _governed_display(self, publish):
+        def governed(data, metadata=None, *args, **kwargs):
+            if self._in_cell:
+                data, metadata = self._govern_display(data, metadata)
+            return publish(data, metadata, *args, **kwargs)
+        return governed
+
+    def _shrink_images(self, data, metadata):
+        """Recompress or downsample the images in a mimebundle over the limit."""
+        limit = self.limits['outputImageLimitKB'] * 1024
+        if not limit:
+            return data, metadata
+        for mime_type in _IMAGE_EXTENSIONS:
+            value = data.get(mime_type)
+            if value is None or _value_size(value) <= limit:
+                continue
+            try:
+                shrunk = _shrink_image(_image_bytes(value), limit)
+            except Exception:
+                shrunk = None
+            if shrunk is None:
+                continue
+            new_type, image, width, height = shrunk
+            image_metadata = dict((metadata or {}).get(mime_type) or {})
+            # Keep the displayed size of the original.
+            image_metadata.setdefault('width', width)
+            image_metadata.setdefault('height', height)
+            data = dict(data)
+            del data[mime_type]
+            data[new_type] = image
+            metadata = dict(metadata or {})
+            metadata.pop(mime_type, None)
+            metadata[new_type] = image_metadata
+        return data, metadata
+
+    def _govern_display(self, data, metadata):
+        data, metadata = self._shrink_images(data, metadata)
+        size = _bundle_size(data)
+        with self._lock:
+            if self._admit(size, stream=False):
+                return data, metadata
+            try:
+                path = self._spill_display(data)
+            except (IOError, OSError) as e:
+                return {'text/plain': 'Output of {0} not displayed, as it '
+                                      'exceeded the output limits: {1}'.format(
+                                          _size_mb(size), e)}, {}
+        return _link_bundle('Output of {0} written to'.format(_size_mb(size)),
+                            path), {}
+
+    def _spill_display(self, data):
+        """Write the richest representation of a mimebundle to a file.
+
+        Returns:
+          The path of the file relative to the notebook.
+        """
+        for mime_type, extension in _IMAGE_EXTENSIONS.items():
+            if mime_type in data:
+                path, link = self._spill_path(extension)
+                with open(path, 'wb') as f:
+                    f.write(_image_bytes(data[mime_type]))
+                return link
+        for mime_type, extension in (('text/html', 'html'),
+                                     ('text/plain', 'txt')):
+            if mime_type in data:
+                path, link = self._spill_path(extension)
+                with io.open(path, 'w', encoding='utf-8') as f:
+                    f.write(_text(data[mime_type]))
+                return link
+        path, link = self._spill_path('json')
+        with open(path, 'w') as f:
+            json.dump(data, f, default=str)
+        return link
+
+
+def load_ipython_extension(shell):
+    """Called by IPython when this module is loaded as an extension."""
+    governor = OutputGovernor(shell)
+    governor.load_limits()
+    governor.install()
@@ -0,0 +1,251 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Contents manager that keeps large outputs out of notebook files.
+
+Without it, every autosave of a notebook rewrites all of its outputs to
+the persistent disk, and every checkpoint copies them again, which stalls
+the UI for notebooks with hundreds of MB of outputs. This contents
+manager stores each output over `min_output_size` as a file named by the
+hash of its contents in `.ipynb_outputs/` under the root directory,
+and leaves a placeholder and a reference in the notebook file. So:
+
+  * an autosave only writes the outputs that are new since the last one,
+    and skips rewriting the notebook file if nothing changed,
+  * checkpoints, which copy the notebook file, share the stored outputs,
+  * notebooks read through the contents API, and hence opened, exported
+    or copied in Datalab, have their outputs restored.
+
+Notebook files stay valid notebooks on their own, showing the
+placeholders instead of the large outputs. As a Jupyter server extension,
+this module also serves downloads of notebooks from `/files/` with their
+outputs restored, and removes stored outputs that no notebook or
+checkpoint refers to any more once a day.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import nbformat
+from nbformat import NotebookNode
+from notebook.services.contents.filemanager import FileContentsManager
+from traitlets import Integer, Unicode
+
+
+# The cell metadata that maps the indices of stored outputs to their hashes.
+_REFS_KEY = 'datalab_output_refs'
+_HASH_PATTERN = re.compile(r'\b[0-9a-f]{64}\b')
+_PLACEHOLDER = ('[This output is stored in {0}/{1}.json. Open the notebook '
+                'in Datalab to see it.]')
+
+# Stored outputs are only removed if they have not been used for this long,
+# so that outputs being saved are never collected.
+_GC_GRACE_SECONDS = 24 * 60 * 60
+
+
+def _hash_output(output):
+    """Serialize an output, and hash it.
+
+    Returns:
+      A tuple of the hash and the serialized output.
+    """
+    blob = json.dumps(output, sort_keys=True, separators=(',', ':'))
+    if not isinstance(blob, bytes):
+        blob = blob.encode('utf-8')
+    return hashlib.sha256(blob).hexdigest(), blob
+
+
+class OutputStoreContentsManager(FileContentsManager):
+    """A FileContentsManager that stores large outputs in separate files."""
+
+    output_store_dir = Unicode(
+        '.ipynb_outputs', config=True,
+        help='The directory, relative to the root directory, of the stored '
+             'outputs.')
+
+    min_output_size = Integer(
+        64 * 1024, config=True,
+        help='The size in bytes above which outputs are stored separately.')
+
+    def _output_path(self, digest):
+        return os.path.join(self.root_dir, self.output_store_dir, digest[:2],
+                            digest + '.json')
+
+    def _store_output(self, digest, blob):
+        """Write an output to the store, unless it is already there."""
+        path = self._output_path(digest)
+        try:
+            # Mark the output as in use, so it is not collected.
+            os.utime(path, None)
+            return
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def _strip_outputs(self, nb):
+        """Store the large outputs of a notebook, and replace them.
+
+        Returns:
+          A shallow copy of the notebook, with placeholders for the
+          stored outputs.
+        """
+        stripped = NotebookNode(nb)
+        stripped.cells = []
+        for cell in nb.cells:
+            outputs = cell.get('outputs')
+            refs = {}
+            if outputs:
+                outputs = list(outputs)
+                for i, output in enumerate(outputs):
+                    digest, blob = _hash_output(output)
+                    if len(blob) < self.min_output_size:
+                        continue
+                    self._store_output(digest, blob)
+                    refs[str(i)] = digest
+                    outputs[i] = nbformat.v4.new_output(
+                        'display_data', data={'text/plain': _PLACEHOLDER.format(
+                            self.output_store_dir, digest)})
+            if refs:
+                cell = NotebookNode(cell)
+                cell.outputs = outputs
+                cell.metadata = NotebookNode(cell.metadata)
+                cell.metadata[_REFS_KEY] = refs
+            stripped.cells.append(cell)
+        return stripped
+
+    def _restore_outputs(self, nb):
+        """Replace the placeholders in a notebook with the stored outputs."""
+        for cell in nb.cells:
+            refs = cell.metadata.pop(_REFS_KEY, None)
+            if not refs:
+                continue
+            for index, digest in refs.items():
+                try:
+                    with open(self._output_path(digest), 'rb') as f:
+                        output = json.loads(f.read().decode('utf-8'))
+                    cell.outputs[int(index)] = nbformat.from_dict(output)
+                except (IOError, OSError, ValueError, IndexError) as e:
+                    self.log.warning('Failed to restore output %s: %s', digest, e)
+        return nb
+
+    def _read_notebook(self, os_path, as_version=4):
+        nb = super(OutputStoreContentsManager, self)._read_notebook(
+            os_path, as_version=as_version)
+        return self._restore_outputs(nb)
+
+    def _save_notebook(self, os_path, nb):
+        content = nbformat.writes(self._strip_outputs(nb),
+                                  version=nbformat.NO_CONVERT)
+        # Autosaves often have nothing new to write.
+        try:
+            with io.open(os_path, encoding='utf-8') as f:
+                if f.read() == content:
+                    return
+        except (IOError, OSError, UnicodeDecodeError):
+            pass
+        with self.atomic_writing(os_path, encoding='utf-8') as f:
+            f.write(content)
+
+    def collect_garbage(self):
+        """Remove the stored outputs that no notebook or checkpoint uses."""
+        store_dir = os.path.join(self.root_dir, self.output_store_dir)
+        if not os.path.isdir(store_dir):
+            return
+        used = set()
+        for directory, subdirectories, files in os.walk(self.root_dir):
+            if os.path.abspath(directory) == os.path.abspath(store_dir):
+                del subdirectories[:]
+                continue
+            for name in files:
+                if not name.endswith('.ipynb'):
+                    continue
+                try:
+                    with io.open(os.path.join(directory, name),
+                                 encoding='utf-8') as f:
+                        content = f.read()
+                except (IOError, OSError, UnicodeDecodeError):
+                    continue
+                if _REFS_KEY in content:
+                    used.update(_HASH_PATTERN.findall(content))
+        cutoff = time.time() - _GC_GRACE_SECONDS
+        removed = 0
+        for directory, _, files in os.walk(store_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if name[:-len('.json')] not in used and \
+                            os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            self.log.info('Removed %d unused stored outputs', removed)
+
+
+def load_jupyter_server_extension(nb_server_app):
+    """Called by Jupyter when this module is loaded as a server extension."""
+    from notebook.base.handlers import IPythonHandler
+    from notebook.utils import url_path_join
+    from tornado import ioloop, web
+
+    contents_manager = nb_server_app.contents_manager
+    if not isinstance(contents_manager, OutputStoreContentsManager):
+        return
+
+    class NotebookDownloadHandler(IPythonHandler):
+        """Serves notebook files with their stored outputs restored."""
+
+        @web.authenticated
+        def get(self, path):
+            model = self.contents_manager.get(path, type='notebook')
+            if self.get_argument('download', False):
+                self.set_attachment_header(model['name'])
+            self.set_header('Content-Type', 'application/x-ipynb+json')
+            self.finish(nbformat.writes(model['content'],
+                                        version=nbformat.NO_CONVERT))
+
+    web_app = nb_server_app.web_app
+    pattern = url_path_join(web_app.settings['base_url'],
+                            r'/files/(.+\.ipynb)')
+    # Added handlers take precedence over the default ones.
+    web_app.add_handlers('.*$', [(pattern, NotebookDownloadHandler)])
+
+    def collect_garbage():
+        # This reads every notebook, so keep it off the IOLoop.
+        thread = threading.Thread(target=contents_manager.collect_garbage)
+        thread.daemon = True
+        thread.start()
+
+    ioloop.PeriodicCallback(collect_garbage, _GC_GRACE_SECONDS * 1000).start()
@@ -0,0 +1,106 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests that DataFrames come out of the data cache as they went in."""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy  # noqa: E402
+import pandas  # noqa: E402
+from pandas.testing import assert_frame_equal  # noqa: E402
+
+import datacache  # noqa: E402
+
+
+def _mixed_frame():
+    return pandas.DataFrame({
+        'name': ['x', 'y', 'z'],
+        'v': [1, 2, 3],
+        'ratio': [0.5, 1.5, numpy.nan],
+        'flag': [True, False, True],
+        'when': pandas.to_datetime(['2018-01-01', '2018-01-02', '2018-01-03']),
+        'label': pandas.Categorical(['a', 'b', 'a']),
+        'w': numpy.array([4, 5, 6], dtype='int32'),
+        'count': [7, 8, 9],
+    })
+
+
+class DataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = datacache.DataCache(self.cache_dir, max_size=1 << 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def round_trip(self, frame, columns=None):
+        key = self.cache.key('test', len(self.cache.entries()))
+        self.cache.save(key, frame, 'test')
+        loaded = self.cache.load(key, columns=columns)
+        self.assertIsNotNone(loaded)
+        return loaded
+
+    def test_column_orders(self):
+        frame = _mixed_frame()
+        orders = [
+            # Pickled columns first, last, and between numeric ones.
+            ['name', 'v'],
+            ['v', 'name'],
+            ['name', 'label', 'v', 'w'],
+            ['v', 'name', 'count', 'label', 'ratio', 'when', 'flag', 'w'],
+            ['label', 'when', 'count', 'name', 'w', 'v', 'flag', 'ratio'],
+        ]
+        for order in orders:
+            assert_frame_equal(self.round_trip(frame[order]), frame[order])
+
+    def test_only_pickled_or_only_numeric(self):
+        frame = _mixed_frame()
+        for order in (['name', 'label'], ['v', 'ratio', 'count', 'w']):
+            assert_frame_equal(self.round_trip(frame[order]), frame[order])
+
+    def test_columns(self):
+        frame = _mixed_frame()[['name', 'v', 'label', 'count', 'w', 'ratio']]
+        for columns in (['v'], ['name'], ['count', 'name'], ['w', 'label', 'v']):
+            expected = frame[[c for c in frame.columns if c in columns]]
+            assert_frame_equal(self.round_trip(frame, columns), expected)
+
+    def test_index(self):
+        frame = _mixed_frame()[['name', 'v', 'ratio']]
+        frame.index = ['b', 'a', 'b']
+        assert_frame_equal(self.round_trip(frame), frame)
+
+    def test_no_rows(self):
+        frame = _mixed_frame()[['name', 'v', 'ratio']].iloc[:0]
+        assert_frame_equal(self.round_trip(frame), frame)
+
+    def test_writes_leave_the_cache_untouched(self):
+        frame = _mixed_frame()[['name', 'v']]
+        key = self.cache.key('test')
+        self.cache.save(key, frame, 'test')
+        loaded = self.cache.load(key)
+        loaded.loc[0, 'v'] = 100
+        assert_frame_equal(self.cache.load(key), frame)
+
+
+if __name__ == '__main__':
+    unittest.main()
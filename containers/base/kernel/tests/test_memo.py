@@ -0,0 +1,88 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests that %%memo runs cells as the shell would, and caches them."""
+
+from __future__ import absolute_import
+
+import __future__
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from IPython.testing.globalipapp import get_ipython  # noqa: E402
+
+import memo  # noqa: E402
+
+
+class MemoTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shell = get_ipython()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.shell.register_magics(memo.MemoMagics(
+            self.shell, memo.MemoCache(self.cache_dir, max_size=1 << 30)))
+        self.shell.user_ns['runs'] = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def memo(self, line, cell):
+        self.shell.run_cell_magic('memo', line, cell)
+
+    def test_cached(self):
+        cell = 'runs += 1\nresult = start * 2\n'
+        self.shell.user_ns['start'] = 3
+        self.memo('--inputs start --outputs result', cell)
+        del self.shell.user_ns['result']
+        self.memo('--inputs start --outputs result', cell)
+        self.assertEqual(self.shell.user_ns['result'], 6)
+        self.assertEqual(self.shell.user_ns['runs'], 1)
+        self.shell.user_ns['start'] = 4
+        self.memo('--inputs start --outputs result', cell)
+        self.assertEqual(self.shell.user_ns['result'], 8)
+        self.assertEqual(self.shell.user_ns['runs'], 2)
+
+    @unittest.skipUnless(sys.version_info[0] == 2, 'Python 2 only')
+    def test_print_statement(self):
+        # memo.py imports print_function, which the cell must not inherit.
+        self.memo('--outputs result', 'print "x"\nresult = 1\n')
+        self.assertEqual(self.shell.user_ns['result'], 1)
+
+    @unittest.skipUnless(hasattr(__future__, 'annotations'),
+                         'Needs from __future__ import annotations')
+    def test_shell_compiler_flags(self):
+        # Without the shell's flags, the annotation would be evaluated, and
+        # fail.
+        self.shell.run_cell('from __future__ import annotations')
+        try:
+            self.memo('--outputs f', 'def f(x: undefined_name):\n    return x\n')
+            self.assertEqual(self.shell.user_ns['f'](1), 1)
+        finally:
+            self.shell.compile.flags &= ~__future__.annotations.compiler_flag
+
+    def test_cell_magics(self):
+        self.memo('--outputs result', '%time result = 1 + 1\n')
+        self.assertEqual(self.shell.user_ns['result'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,7 +22,20 @@
 # deletes older backups with the same tag.
 #
 # On GCS, the .zip is copied to a qualified path that is unique to the VM
-# where this script is running, path, tag, and timestamp.
+# where this script is running, path, tag, and timestamp. The .zip is
+# streamed to GCS as it is made, by gcs_stream_upload.py, so backups need no
+# free space on the local disk.
+#
+# With --incremental, no archive is made. Instead, each file is uploaded as
+# an object named by the SHA-256 hash of its contents, unless an object with
+# that hash was already uploaded from the VM, and each backup is a small
+# gzipped manifest that lists the size, mtime, hash and path of every file.
+# The hashes of files whose size and mtime have not changed are kept on the
+# local disk, so only new and changed files are read. Objects that no
+# manifest of the VM refers to any more are deleted along with old backups.
+#
+# Either way, the backups of the VM are listed in a backups.index object,
+# which `datalab restore` reads instead of listing the bucket.
 
 USAGE='USAGE:
 
@@ -36,10 +49,13 @@ OPTIONS:
   -p, --path          Path to backup. Default is current directory
   -t, --tag           Tag to make grouping similar backups easy. Default is "backup"
   -l, --log-file      Name of log file to use. If none is specified, no output is logged
+  -i, --incremental   Upload only new and changed files, and a manifest of the backup
+  --local-archive     Write the archive to a temporary local file before uploading it, instead
+                      of streaming it to GCS
   -h, --help          Display this message
 '
 
-while [[ $# -gt 1 ]]; do
+while [[ $# -gt 0 ]]; do
   key="$1"
   case $key in
       -n|--num-backups)
@@ -74,9 +90,18 @@ while [[ $# -gt 1 ]]; do
         machine_name="$2"
         shift
         ;;
+      -i|--incremental)
+        incremental=YES
+        ;;
+      --local-archive)
+        local_archive=YES
+        ;;
       --default)
         DEFAULT=YES
-        shift
+        ;;
+      -h|--help)
+        echo "${USAGE}"
+        exit 0
         ;;
       *)
         echo "Bad arguments found: ${key}"
@@ -87,11 +112,6 @@ while [[ $# -gt 1 ]]; do
   shift   # skip option value
 done
 
-if [[ $1 == "-h" || $1 == "--help" ]]; then
-  echo "${USAGE}"
-  exit 0
-fi
-
 timestamp=$(date "+%Y%m%d%H%M%S")
 project_id=${project_id:-$VM_PROJECT}
 zone=${zone:-${VM_ZONE}}
@@ -138,49 +158,218 @@ echo
 
 echo "${timestamp}: Running GCS backup tool.." | tee -a ${log_file}
 
-# create an archive of the backup path
-tempdir="$(mktemp -d)"
-archive_name="${tempdir}/archive.zip"
-trap "rm -rf ${tempdir}" EXIT
-echo "Creating archive: $archive_name"
-zip -rq ${archive_name} "${backup_path}" -x '*/.forever/*' || {
-  echo "Failed creating the backup archive" | tee -a ${log_file}
-  exit 1
+backups_prefix="${gcs_bucket}/datalab-backups/${zone}/${machine_name}"
+
+# Keeps an index of the backups of the VM, so that `datalab restore` can find them without listing
+# the bucket. Adds the backup given as the first argument, if any, and removes the rest.
+function update_index() {
+  local index="gs://${backups_prefix}/backups.index"
+  local added="$1"
+  shift
+  local entries
+  entries=$(gsutil cat "${index}" 2>/dev/null) || entries=$(
+    gsutil ls "gs://${backups_prefix}/**" 2>/dev/null | grep -v '/\.objects/' | \
+      grep -E -e '-[0-9]{14}(\.manifest\.gz)?$'
+  ) || true
+  printf '%s\n' "${entries}" "${added}" | grep -v -x -F -f <(printf '%s\n' "" "$@") | \
+    LC_ALL=C sort -u | gsutil -q cp - "${index}" || \
+    echo "Failed updating the backup index" | tee -a ${log_file}
+}
+
+# Prints the "size<TAB>mtime<TAB>path" of every file to back up, sorted by path.
+function list_files() {
+  (cd "${backup_path}" && find . -type f -not -path '*/.forever/*' -not -path '*/.cache/*' \
+    -printf '%s\t%T@\t%P\n') | LC_ALL=C sort -t $'\t' -k 3
+}
+
+# Prints the "size<TAB>mtime<TAB>sha256<TAB>path" of every file to back up, reusing the hashes
+# in the state file for files with the same size and mtime.
+function hash_files() {
+  local hashes_file="$1"
+  list_files | awk -F '\t' -v hashes_file="${hashes_file}" '
+    BEGIN {
+      while ((getline line < hashes_file) > 0) {
+        split(line, f, "\t")
+        path = substr(line, length(f[1]) + length(f[2]) + length(f[3]) + 4)
+        known[f[1] "\t" f[2] "\t" path] = f[3]
+      }
+    }
+    {
+      if ($0 in known) {
+        path = substr($0, length($1) + length($2) + 3)
+        print $1 "\t" $2 "\t" known[$0] "\t" path
+      } else {
+        path = substr($0, length($1) + length($2) + 3)
+        print $1 "\t" $2 "\t-\t" path
+      }
+    }' | while IFS=$'\t' read -r size mtime hash path; do
+      if [[ "${hash}" == "-" ]]; then
+        hash=$(sha256sum < "${backup_path}/${path}" | cut -d ' ' -f 1) || continue
+      fi
+      printf '%s\t%s\t%s\t%s\n' "${size}" "${mtime}" "${hash}" "${path}"
+    done
+}
+
+function incremental_backup() {
+  local state_dir="${DATALAB_BACKUP_STATE_DIR:-/content/datalab/.cache/gcsbackup}"
+  mkdir -p "${state_dir}"
+  # Backups of the VM share their objects, so never run two at once.
+  exec 9> "${state_dir}/lock"
+  flock 9
+
+  local state_key=$(echo -n "${gcs_bucket}${backup_path}" | sha256sum | cut -c 1-16)
+  local hashes_file="${state_dir}/${state_key}.hashes"
+  local last_manifest="${state_dir}/${state_key}.${tag}.manifest"
+  local uploaded_file="${state_dir}/$(echo -n "${backups_prefix}" | sha256sum | cut -c 1-16).objects"
+  local objects_prefix="${backups_prefix}/.objects"
+  local work_dir="$(mktemp -d -p "${state_dir}")"
+  trap "rm -rf ${work_dir}" EXIT
+  touch "${hashes_file}"
+
+  echo "Hashing new and changed files under ${backup_path}"
+  hash_files "${hashes_file}" > "${work_dir}/manifest"
+  mv "${work_dir}/manifest" "${hashes_file}"
+  cp "${hashes_file}" "${work_dir}/manifest"
+
+  # Skip the backup if no file was added, removed or changed since the last one.
+  if [[ -f "${last_manifest}" ]] && \
+      cmp -s <(cut -f 3- "${last_manifest}") <(cut -f 3- "${work_dir}/manifest"); then
+    echo "No files changed since the last backup. Skipping this backup round." | tee -a $log_file
+    return
+  fi
+
+  if [[ ! -f "${uploaded_file}" ]]; then
+    echo "Listing the objects already backed up from this VM"
+    { gsutil ls "gs://${objects_prefix}/" 2>/dev/null || true; } | sed 's|.*/||' | \
+      LC_ALL=C sort -u > "${uploaded_file}"
+  fi
+
+  # Stage one file per new hash under the name of its hash. Hard links take no space, and keep
+  # the contents that were hashed if the file is replaced before it is uploaded.
+  mkdir "${work_dir}/staging"
+  cut -f 3- "${work_dir}/manifest" | LC_ALL=C sort -u -t $'\t' -k 1,1 | \
+    LC_ALL=C join -t $'\t' -v 1 - "${uploaded_file}" | \
+    while IFS=$'\t' read -r hash path; do
+      ln "${backup_path}/${path}" "${work_dir}/staging/${hash}" 2>/dev/null || \
+        cp "${backup_path}/${path}" "${work_dir}/staging/${hash}"
+    done
+  local new_objects=$(ls "${work_dir}/staging" | wc -l)
+  local new_bytes=$(find "${work_dir}/staging" -type f -printf '%s\n' | awk '{ n += $1 } END { print n + 0 }')
+  echo "Uploading ${new_objects} new objects (${new_bytes} bytes)"
+  if [[ ${new_objects} -gt 0 ]]; then
+    find "${work_dir}/staging" -type f | gsutil -m -q cp -I "gs://${objects_prefix}/" || {
+      echo "Failed uploading the new objects" | tee -a ${log_file}
+      exit 1
+    }
+    { ls "${work_dir}/staging"; cat "${uploaded_file}"; } | LC_ALL=C sort -u > "${work_dir}/uploaded"
+    mv "${work_dir}/uploaded" "${uploaded_file}"
+  fi
+
+  backup_id="${backups_prefix}${backup_path}/${tag}-${timestamp}.manifest.gz"
+  echo "Creating a new backup point with id: ${backup_id}"
+  gzip -c "${work_dir}/manifest" | gsutil -q cp - "gs://${backup_id}" || {
+    echo "Failed uploading the backup manifest" | tee -a ${log_file}
+    exit 1
+  }
+  cp "${work_dir}/manifest" "${last_manifest}"
+  update_index "gs://${backup_id}"
+  if [[ $log_file ]]; then
+    echo "GCS Backup point created successfully: ${backup_id}" >> "${log_file}"
+  fi
+
+  # remove excessive backups
+  all_backups=($(gsutil ls "gs://${backups_prefix}${backup_path}/${tag}-*.manifest.gz"))
+  echo "Found ${#all_backups[@]} backups with the tag ${tag}"
+  let num_extra="${#all_backups[@]}-${num_backups}"
+  if [[ $num_extra -le 0 ]]; then
+    return
+  fi
+  echo "Removing: ${num_extra} old backups"
+  gsutil -m rm "${all_backups[@]:0:$num_extra}"
+  update_index "" "${all_backups[@]:0:$num_extra}"
+
+  # Delete the objects that no remaining backup of the VM refers to. If the manifests cannot all
+  # be read, keep every object.
+  gsutil cat "gs://${backups_prefix}/**.manifest.gz" > "${work_dir}/manifests.gz" && \
+    gunzip -c "${work_dir}/manifests.gz" | cut -f 3 | LC_ALL=C sort -u > "${work_dir}/referenced" \
+    && [[ -s "${work_dir}/referenced" ]] || {
+      echo "Failed reading the backup manifests; keeping all objects" | tee -a ${log_file}
+      return
+    }
+  LC_ALL=C comm -23 "${uploaded_file}" "${work_dir}/referenced" > "${work_dir}/unreferenced"
+  if [[ -s "${work_dir}/unreferenced" ]]; then
+    echo "Removing $(wc -l < "${work_dir}/unreferenced") objects no backup refers to"
+    sed "s|^|gs://${objects_prefix}/|" "${work_dir}/unreferenced" | gsutil -m -q rm -I
+    LC_ALL=C comm -12 "${uploaded_file}" "${work_dir}/referenced" > "${work_dir}/uploaded"
+    mv "${work_dir}/uploaded" "${uploaded_file}"
+  fi
 }
 
+if [[ $incremental ]]; then
+  incremental_backup
+  exit 0
+fi
+
 # backup_path is an absolute path that starts with '/'
 backup_id="${gcs_bucket}/datalab-backups/${zone}/${machine_name}${backup_path}/${tag}-${timestamp}"
 
+# get the md5 hash of the last backup. Streamed backups are composite objects, which have no md5
+# hash of their own, so the helper reads it from their metadata.
+stream_upload="python $(dirname "$0")/gcs_stream_upload.py"
+last_backup_id=$(
+  gsutil ls "gs://${gcs_bucket}/datalab-backups/${zone}/${machine_name}${backup_path}/${tag}-*" \
+  2>/dev/null | grep -v '\.manifest\.gz$' | tail -1
+) || true
+if [[ $last_backup_id ]]; then
+  last_backup_hash=$(${stream_upload} md5 "${last_backup_id}") || true
+fi
+[[ $last_backup_hash ]] || echo "No previous backup hash found. First backup?"
+
 echo "Creating a new backup point with id: ${backup_id}"
 
-# get new archive md5 hash
-hash_regex="Hash \(md5\):\s+(.*)"
-hash_output=$(gsutil hash -m "${archive_name}")
-[[ "${hash_output}" =~ $hash_regex ]] && new_backup_hash="${BASH_REMATCH[1]}"
-
-# get last backup md5 hash
-{
-  last_backup_id=$(
-    gsutil ls "gs://${gcs_bucket}/datalab-backups/${zone}/${machine_name}${backup_path}/${tag}-*" \
-    | tail -1
-  )
-  last_backup_metadata=$(gsutil ls -L "${last_backup_id}" | grep "Hash (md5)")
-  [[ "${last_backup_metadata}" =~ $hash_regex ]] && last_backup_hash="${BASH_REMATCH[1]}"
-} || echo "No previous backup hash found. First backup?"
+if [[ $local_archive ]]; then
+  # create an archive of the backup path
+  tempdir="$(mktemp -d)"
+  archive_name="${tempdir}/archive.zip"
+  trap "rm -rf ${tempdir}" EXIT
+  echo "Creating archive: $archive_name"
+  zip -rq ${archive_name} "${backup_path}" -x '*/.forever/*' '*/.cache/*' || {
+    echo "Failed creating the backup archive" | tee -a ${log_file}
+    exit 1
+  }
+  new_backup_hash=$(md5sum < "${archive_name}" | cut -d ' ' -f 1)
+  if [[ $new_backup_hash != $last_backup_hash ]]; then
+    gsutil cp ${archive_name} "gs://${backup_id}"
+  fi
+else
+  # stream the archive to GCS in chunks that are uploaded in parallel, so that it is never
+  # written to the local disk
+  echo "Streaming archive to: gs://${backup_id}"
+  new_backup_hash=$(
+    set -o pipefail
+    zip -rq - "${backup_path}" -x '*/.forever/*' '*/.cache/*' | \
+      ${stream_upload} upload "gs://${backup_id}"
+  ) || {
+    echo "Failed streaming the backup archive" | tee -a ${log_file}
+    gsutil -q rm "gs://${backup_id}" &>/dev/null || true
+    exit 1
+  }
+fi
 
 # skip backup if nothing changed since last backup
 echo "New archive md5 hash: ${new_backup_hash}"
 echo "Last backup md5 hash: ${last_backup_hash}"
 if [[ $new_backup_hash == $last_backup_hash ]]; then
+  if [[ ! $local_archive ]]; then
+    gsutil -q rm "gs://${backup_id}"
+  fi
   echo "Hash not different from last backup. Skipping this backup round." | tee -a $log_file
   exit 0
 fi
 
-# copying backup to GCS
-gsutil cp ${archive_name} "gs://${backup_id}"
-
 # remove excessive backups
-all_backups=($(gsutil ls "gs://${gcs_bucket}/datalab-backups/${zone}/${machine_name}${backup_path}/${tag}-*"))
+all_backups=($(gsutil ls "gs://${gcs_bucket}/datalab-backups/${zone}/${machine_name}${backup_path}/${tag}-*" \
+  | grep -v '\.manifest\.gz$'))
 
 echo "Found ${#all_backups[@]} backups with the tag ${tag}:"
 printf '%s\n' "${all_backups[@]}"
@@ -192,6 +381,9 @@ if [[ $num_extra -gt 0 ]]; then
   for i in "${all_backups[@]:0:$num_extra}"; do
     gsutil rm ${i}
   done
+  update_index "gs://${backup_id}" "${all_backups[@]:0:$num_extra}"
+else
+  update_index "gs://${backup_id}"
 fi
 
 if [[ $log_file ]]; then
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Restores files from the backups made by GCSbackup.sh.
+
+Run by `datalab restore` in the Datalab container of the instance to
+restore files into, as in
+
+    gcs_restore.py list
+    gcs_restore.py restore --backup /content/hourly-20180102030405 \\
+        --path 'datalab/notebooks/*.ipynb'
+
+Backups are found through the index that GCSbackup.sh keeps of the
+backups of each VM, rather than by listing the bucket. Only the data of
+the files being restored is downloaded: for a zip backup, the central
+directory is read from the end of the archive, and then the byte range of
+each matching member; for an incremental backup, the objects of the
+matching files. Files are downloaded in parallel, each in ranges of a
+bounded size, and existing files are not overwritten unless asked to.
+"""
+
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import gzip
+import io
+import json
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import HTTPError, Request, urlopen
+
+from gcs_stream_upload import GcsClient, parse_url
+
+
+_METADATA_URL = 'http://metadata.google.internal/computeMetadata/v1/'
+_INDEX_NAME = 'backups.index'
+_MANIFEST_SUFFIX = '.manifest.gz'
+_BACKUP_NAME_PATTERN = re.compile(r'-(\d{14})(\.manifest\.gz)?$')
+
+# Files are downloaded in ranges of this many bytes, so that memory use is
+# bounded whatever their size.
+_RANGE_SIZE = 8 * 1024 * 1024
+
+_EOCD_SIGNATURE = 0x06054b50
+_EOCD_FORMAT = '<IHHHHIIH'
+_ZIP64_LOCATOR_SIGNATURE = 0x07064b50
+_ZIP64_LOCATOR_FORMAT = '<IIQI'
+_ZIP64_EOCD_SIGNATURE = 0x06064b50
+_ZIP64_EOCD_FORMAT = '<IQHHIIQQQQ'
+_CENTRAL_HEADER_SIGNATURE = 0x02014b50
+_CENTRAL_HEADER_FORMAT = '<IHHHHHHIIIHHHHHII'
+_LOCAL_HEADER_SIGNATURE = 0x04034b50
+_LOCAL_HEADER_FORMAT = '<IHHHHHIIIHH'
+_ZIP64_EXTRA_ID = 0x0001
+
+_MAX_EOCD_SIZE = struct.calcsize(_EOCD_FORMAT) + 0xffff
+
+
+class RestoreError(Exception):
+    pass
+
+
+class _File(object):
+    """A file to restore, and where to find its contents."""
+
+    def __init__(self, path, size, mtime, object_name, offset=0,
+                 compressed_size=None, method=0, crc=None, mode=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.object_name = object_name
+        self.offset = offset
+        self.compressed_size = size if compressed_size is None else compressed_size
+        self.method = method
+        self.crc = crc
+        self.mode = mode
+
+
+def _default_mode():
+    """The mode of new files, for files with none in the backup."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _metadata(path):
+    request = Request(_METADATA_URL + path, headers={'Metadata-Flavor': 'Google'})
+    return urlopen(request).read().decode('utf-8')
+
+
+def _backups_prefix(zone, machine):
+    return 'datalab-backups/{0}/{1}'.format(zone, machine)
+
+
+def find_bucket(client, project):
+    """Find the default bucket of GCSbackup.sh for a project."""
+    for bucket in ['{0}.appspot.com'.format(project), project]:
+        try:
+            client.request('GET', '/storage/v1/b/' + bucket)
+            return bucket
+        except HTTPError as e:
+            if e.code not in (403, 404):
+                raise
+    raise RestoreError('No backup bucket found for the project ' + project)
+
+
+def list_backups(client, bucket, prefix):
+    """List the backups of a VM, oldest first.
+
+    Returns:
+      A list of the object names of the backups.
+    """
+    try:
+        index = client.download(bucket, prefix + '/' + _INDEX_NAME)
+        names = [parse_url(url)[1] for url in index.decode('utf-8').split()]
+    except HTTPError as e:
+        if e.code != 404:
+            raise
+        # Backups made before the index was added can only be listed.
+        names = [name for name in client.list(bucket, prefix + '/')
+                 if '/.objects/' not in name]
+    names = [name for name in names if _BACKUP_NAME_PATTERN.search(name)]
+    return sorted(names, key=lambda name: _BACKUP_NAME_PATTERN.search(name).group(1))
+
+
+def backup_id(prefix, name):
+    """The ID of a backup, which is its path, tag and timestamp."""
+    backup = name[len(prefix):]
+    if backup.endswith(_MANIFEST_SUFFIX):
+        backup = backup[:-len(_MANIFEST_SUFFIX)]
+    return backup
+
+
+def select_backup(backups, prefix, requested):
+    """Pick the requested backup, or the latest one."""
+    if not backups:
+        raise RestoreError('There are no backups of this VM.')
+    if not requested:
+        return backups[-1]
+    if requested.startswith('gs://'):
+        requested = parse_url(requested)[1]
+    requested = backup_id(prefix, requested) if requested.startswith(prefix) \
+        else requested.rstrip('/')
+    if requested.endswith(_MANIFEST_SUFFIX):
+        requested = requested[:-len(_MANIFEST_SUFFIX)]
+    matches = [name for name in backups
+               if backup_id(prefix, name) == requested or
+               backup_id(prefix, name).endswith('/' + requested)]
+    if len(matches) != 1:
+        raise RestoreError('{0} backups match {1}; run `datalab restore --list` '
+                           'to see them.'.format(len(matches) or 'No', requested))
+    return matches[0]
+
+
+def _matches(path, patterns):
+    if not patterns:
+        return True
+    for pattern in patterns:
+        pattern = pattern.lstrip('/')
+        if fnmatch.fnmatchcase(path, pattern) or \
+                path.startswith(pattern.rstrip('/') + '/'):
+            return True
+    return False
+
+
+def _decode_name(name, flags):
+    # Info-ZIP does not always flag UTF-8 names as such.
+    try:
+        return name.decode('utf-8')
+    except UnicodeDecodeError:
+        return name.decode('utf-8' if flags & 0x800 else 'cp437', 'replace')
+
+
+def _dos_time(date, time_of_day):
+    try:
+        return time.mktime((
+            (date >> 9) + 1980, (date >> 5) & 0xf, date & 0x1f,
+            time_of_day >> 11, (time_of_day >> 5) & 0x3f, (time_of_day & 0x1f) * 2,
+            0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+
+def read_zip_files(client, bucket, name, archive_prefix):
+    """List the members of a zip object, reading only its central directory.
+
+    Args:
+      archive_prefix: The prefix of the names of the members, which is
+        removed from the paths of the files.
+    Returns:
+      A list of the _Files in the zip.
+    """
+    size = int(client.get(bucket, name)['size'])
+    tail_start = max(0, size - _MAX_EOCD_SIZE)
+    tail = client.download(bucket, name, tail_start, size)
+    eocd_offset = tail.rfind(struct.pack('<I', _EOCD_SIGNATURE))
+    if eocd_offset < 0:
+        raise RestoreError('{0} is not a zip archive'.format(name))
+    (_, _, _, _, entries, directory_size, directory_offset,
+     _) = struct.unpack_from(_EOCD_FORMAT, tail, eocd_offset)
+
+    locator_offset = eocd_offset - struct.calcsize(_ZIP64_LOCATOR_FORMAT)
+    if locator_offset >= 0 and struct.unpack_from(
+            '<I', tail, locator_offset)[0] == _ZIP64_LOCATOR_SIGNATURE:
+        zip64_offset = struct.unpack_from(
+            _ZIP64_LOCATOR_FORMAT, tail, locator_offset)[2]
+        zip64_eocd = client.download(
+            bucket, name, zip64_offset,
+            zip64_offset + struct.calcsize(_ZIP64_EOCD_FORMAT))
+        fields = struct.unpack(_ZIP64_EOCD_FORMAT, zip64_eocd)
+        if fields[0] != _ZIP64_EOCD_SIGNATURE:
+            raise RestoreError('{0} has a corrupt zip64 directory'.format(name))
+        entries, directory_size, directory_offset = fields[7:10]
+
+    if directory_offset >= tail_start:
+        directory = tail[directory_offset - tail_start:]
+    else:
+        directory = client.download(bucket, name, directory_offset,
+                                    directory_offset + directory_size)
+    header_size = struct.calcsize(_CENTRAL_HEADER_FORMAT)
+    files = []
+    offset = 0
+    for _ in range(entries):
+        (signature, _, _, flags, method, time_of_day, date, crc, compressed_size,
+         file_size, name_length, extra_length, comment_length, _, _,
+         attributes, local_offset) = struct.unpack_from(
+             _CENTRAL_HEADER_FORMAT, directory, offset)
+        if signature != _CENTRAL_HEADER_SIGNATURE:
+            raise RestoreError('{0} has a corrupt zip directory'.format(name))
+        offset += header_size
+        member = _decode_name(directory[offset:offset + name_length], flags)
+        offset += name_length
+        extra = directory[offset:offset + extra_length]
+        offset += extra_length + comment_length
+
+        # Sizes and offsets that do not fit in 32 bits are in the zip64 extra
+        # field, in this order.
+        extra_offset = 0
+        while extra_offset + 4 <= len(extra):
+            extra_id, length = struct.unpack_from('<HH', extra, extra_offset)
+            if extra_id == _ZIP64_EXTRA_ID:
+                values = list(struct.unpack_from(
+                    '<{0}Q'.format(length // 8), extra, extra_offset + 4))
+                if file_size == 0xffffffff and values:
+                    file_size = values.pop(0)
+                if compressed_size == 0xffffffff and values:
+                    compressed_size = values.pop(0)
+                if local_offset == 0xffffffff and values:
+                    local_offset = values.pop(0)
+            extra_offset += 4 + length
+
+        if member.endswith('/') or not member.startswith(archive_prefix):
+            continue
+        # Only restore regular files.
+        mode = attributes >> 16
+        if mode and (mode & 0o170000) not in (0, 0o100000):
+            continue
+        files.append(_File(member[len(archive_prefix):], file_size,
+                           _dos_time(date, time_of_day), name,
+                           offset=local_offset, compressed_size=compressed_size,
+                           method=method, crc=crc, mode=(mode & 0o7777) or None))
+    return files
+
+
+def read_manifest_files(client, bucket, name, objects_prefix):
+    """List the files of an incremental backup from its manifest."""
+    manifest = gzip.GzipFile(fileobj=io.BytesIO(client.download(bucket, name)))
+    files = []
+    for line in manifest.read().decode('utf-8').splitlines():
+        size, mtime, digest, path = line.split('\t', 3)
+        files.append(_File(path, int(size), float(mtime),
+                           objects_prefix + '/' + digest))
+    return files
+
+
+def _download_file(client, bucket, entry, destination):
+    """Download a file into a temporary file next to its destination.
+
+    Returns:
+      The path of the temporary file.
+    """
+    start = entry.offset
+    if entry.crc is not None:
+        # The data of a zip member follows its local header, whose extra
+        # field can differ from the one in the central directory.
+        header_size = struct.calcsize(_LOCAL_HEADER_FORMAT)
+        header = client.download(bucket, entry.object_name, start,
+                                 start + header_size)
+        fields = struct.unpack(_LOCAL_HEADER_FORMAT, header)
+        if fields[0] != _LOCAL_HEADER_SIGNATURE:
+            raise RestoreError('corrupt zip member')
+        start += header_size + fields[9] + fields[10]
+        if entry.method not in (0, 8):
+            raise RestoreError('unsupported compression method {0}'.format(
+                entry.method))
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS) \
+        if entry.method == 8 else None
+    crc = 0
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination),
+                                     prefix='.restore-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            end = start + entry.compressed_size
+            while start < end:
+                data = client.download(bucket, entry.object_name, start,
+                                       min(end, start + _RANGE_SIZE))
+                if not data:
+                    raise RestoreError('unexpected end of data')
+                start += len(data)
+                if decompressor:
+                    data = decompressor.decompress(data)
+                crc = zlib.crc32(data, crc)
+                f.write(data)
+            if decompressor:
+                data = decompressor.flush()
+                crc = zlib.crc32(data, crc)
+                f.write(data)
+        if entry.crc is not None and (crc & 0xffffffff) != entry.crc:
+            raise RestoreError('CRC mismatch')
+        os.chmod(temp_path, entry.mode)
+        if entry.mtime:
+            os.utime(temp_path, (entry.mtime, entry.mtime))
+        return temp_path
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def restore(client, bucket, files, destination, parallel, overwrite):
+    """Download files into a directory, in parallel.
+
+    Returns:
+      The number of files that could not be restored.
+    """
+    tasks = queue.Queue()
+    default_mode = _default_mode()
+    for entry in files:
+        entry.mode = entry.mode or default_mode
+        tasks.put(entry)
+    failures = []
+    lock = threading.Lock()
+
+    def restore_files():
+        while True:
+            try:
+                entry = tasks.get_nowait()
+            except queue.Empty:
+                return
+            path = os.path.normpath(os.path.join(destination, entry.path))
+            if not path.startswith(os.path.join(destination, '')):
+                continue
+            if not overwrite and os.path.lexists(path):
+                with lock:
+                    print('Skipping existing file ' + path)
+                continue
+            try:
+                directory = os.path.dirname(path)
+                if not os.path.isdir(directory):
+                    try:
+                        os.makedirs(directory)
+                    except OSError:
+                        if not os.path.isdir(directory):
+                            raise
+                os.rename(_download_file(client, bucket, entry, path), path)
+                with lock:
+                    print('Restored ' + path)
+            except Exception as e:
+                with lock:
+                    failures.append(entry)
+                    print('Failed to restore {0}: {1}'.format(path, e),
+                          file=sys.stderr)
+
+    workers = [threading.Thread(target=restore_files) for _ in range(parallel)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(1)
+    return len(failures)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['list', 'restore'])
+    parser.add_argument('--bucket', help='the bucket of the backups')
+    parser.add_argument('--project', help='the project of the VM')
+    parser.add_argument('--zone', help='the zone of the VM that was backed up')
+    parser.add_argument('--machine', help='the name of the VM that was backed up')
+    parser.add_argument('--backup', help='the ID of the backup; the latest by default')
+    parser.add_argument('--path', action='append', default=[],
+                        help='a glob of the paths to restore, relative to the '
+                             'backed up directory; everything by default')
+    parser.add_argument('--destination',
+                        help='the directory to restore into; the backed up '
+                             'directory by default')
+    parser.add_argument('--parallel', type=int, default=8,
+                        help='the number of files to download at once')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='overwrite existing files')
+    args = parser.parse_args(argv)
+
+    project = args.project or os.environ.get('VM_PROJECT') or \
+        _metadata('project/project-id')
+    zone = args.zone or os.environ.get('VM_ZONE') or \
+        _metadata('instance/zone').rsplit('/', 1)[-1]
+    machine = args.machine or os.environ.get('VM_NAME') or \
+        _metadata('instance/name')
+    client = GcsClient()
+    bucket = args.bucket or find_bucket(client, project)
+    prefix = _backups_prefix(zone, machine)
+
+    try:
+        backups = list_backups(client, bucket, prefix)
+        if args.command == 'list':
+            print(json.dumps([{
+                'id': backup_id(prefix, name),
+                'incremental': name.endswith(_MANIFEST_SUFFIX),
+                'url': 'gs://{0}/{1}'.format(bucket, name),
+            } for name in backups]))
+            return 0
+
+        name = select_backup(backups, prefix, args.backup)
+        backup_path = os.path.dirname(backup_id(prefix, name))
+        print('Restoring from gs://{0}/{1}'.format(bucket, name))
+        if name.endswith(_MANIFEST_SUFFIX):
+            files = read_manifest_files(client, bucket, name, prefix + '/.objects')
+        else:
+            files = read_zip_files(client, bucket, name,
+                                   backup_path.lstrip('/') + '/')
+    except RestoreError as e:
+        print(e, file=sys.stderr)
+        return 1
+    files = [entry for entry in files if _matches(entry.path, args.path)]
+    if not files:
+        print('No files in the backup match ' + ', '.join(args.path or ['*']))
+        return 1
+    destination = os.path.abspath(args.destination or backup_path)
+    print('Restoring {0} files ({1} bytes) into {2}'.format(
+        len(files), sum(entry.size for entry in files), destination))
+    failures = restore(client, bucket, files, destination,
+                       max(1, args.parallel), args.overwrite)
+    if failures:
+        print('Failed to restore {0} files'.format(failures), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
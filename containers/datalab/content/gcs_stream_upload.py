@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streams stdin to a GCS object, without writing it to the local disk.
+
+Used by GCSbackup.sh, as in
+
+    zip -r - /content | gcs_stream_upload.py upload gs://bucket/backup.zip
+
+The stream is cut into chunks, which are uploaded in parallel as
+temporary objects and then composed into the final object. The temporary
+objects are kept under a `.parts/` prefix next to the object, so that
+listing the objects with names like that of the object never finds them,
+and those left behind by uploads that were killed are deleted a day later. At most
+`--parallel` chunks are buffered in memory besides the one being read, and
+each chunk is retried on its own if its upload fails. The MD5 hash of the
+stream is printed, and kept in the `datalab-md5` metadata of the object,
+since composite objects have no MD5 hash of their own; `md5` prints it.
+
+The GCS JSON API is used directly, so this has no dependencies. If the
+STORAGE_EMULATOR_HOST environment variable is set, as for the Cloud
+client libraries, requests go to that GCS emulator without credentials,
+which is how this can be tested locally.
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import binascii
+import calendar
+import hashlib
+import json
+import os
+import posixpath
+import random
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import quote, urlencode
+    from urllib.request import Request, urlopen
+    import queue
+except ImportError:
+    from urllib import quote, urlencode
+    from urllib2 import HTTPError, Request, URLError, urlopen
+    import Queue as queue
+
+
+_GCS_URL = 'https://storage.googleapis.com'
+_METADATA_TOKEN_URL = ('http://metadata.google.internal/computeMetadata/v1/'
+                       'instance/service-accounts/default/token')
+_MD5_METADATA_KEY = 'datalab-md5'
+
+# GCS composes at most this many objects in one request.
+_MAX_COMPOSE_SOURCES = 32
+
+_PARTS_DIR = '.parts'
+_STALE_PARTS_SECONDS = 24 * 60 * 60
+
+_MAX_ATTEMPTS = 6
+_TOKEN_LIFETIME_SECONDS = 30 * 60
+
+
+class GcsClient(object):
+    """A minimal client for the GCS JSON API."""
+
+    def __init__(self):
+        emulator_host = os.environ.get('STORAGE_EMULATOR_HOST')
+        if emulator_host:
+            if '://' not in emulator_host:
+                emulator_host = 'http://' + emulator_host
+            self._base_url = emulator_host.rstrip('/')
+        else:
+            self._base_url = _GCS_URL
+        self._use_credentials = not emulator_host
+        self._token = None
+        self._token_time = 0
+        self._token_lock = threading.Lock()
+
+    def _access_token(self, refresh=False):
+        with self._token_lock:
+            if refresh or not self._token or \
+                    time.time() - self._token_time > _TOKEN_LIFETIME_SECONDS:
+                self._token = self._fetch_access_token()
+                self._token_time = time.time()
+            return self._token
+
+    @staticmethod
+    def _fetch_access_token():
+        # Prefer the gcloud credentials, which are those of the user if they
+        # signed in to Datalab, over those of the VM.
+        try:
+            token = subprocess.check_output(
+                ['gcloud', 'auth', 'print-access-token'],
+                stderr=open(os.devnull, 'w')).decode('utf-8').strip()
+            if token:
+                return token
+        except (OSError, subprocess.CalledProcessError):
+            pass
+        request = Request(_METADATA_TOKEN_URL,
+                          headers={'Metadata-Flavor': 'Google'})
+        return json.loads(urlopen(request).read().decode('utf-8'))['access_token']
+
+    def request(self, method, path, params=None, body=None,
+                content_type='application/json', headers=None, raw=False):
+        """Send a request, retrying it on transient errors.
+
+        Returns:
+          The response, if raw, or else the parsed JSON response, or None
+          if it is empty.
+        """
+        url = self._base_url + path
+        if params:
+            url += '?' + urlencode(params)
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+        refresh_token = False
+        for attempt in range(_MAX_ATTEMPTS):
+            request = Request(url, data=body)
+            request.get_method = lambda: method
+            if body is not None:
+                request.add_header('Content-Type', content_type)
+            for name, value in (headers or {}).items():
+                request.add_header(name, value)
+            if self._use_credentials:
+                request.add_header(
+                    'Authorization',
+                    'Bearer ' + self._access_token(refresh=refresh_token))
+            try:
+                response = urlopen(request).read()
+                if raw:
+                    return response
+                return json.loads(response.decode('utf-8')) if response else None
+            except HTTPError as e:
+                if e.code == 401 and not refresh_token:
+                    refresh_token = True
+                elif e.code != 429 and e.code < 500:
+                    raise
+                error = e
+            except (URLError, IOError) as e:
+                error = e
+            if attempt + 1 < _MAX_ATTEMPTS:
+                delay = min(60, 2 ** attempt) * (0.5 + random.random())
+                print('{0} {1} failed ({2}); retrying in {3:.0f}s'.format(
+                    method, path, error, delay), file=sys.stderr)
+                time.sleep(delay)
+        raise error
+
+    @staticmethod
+    def _object_path(bucket, name):
+        return '/storage/v1/b/{0}/o/{1}'.format(
+            quote(bucket, safe=''), quote(name, safe=''))
+
+    def upload(self, bucket, name, data, content_type):
+        return self.request(
+            'POST', '/upload/storage/v1/b/{0}/o'.format(quote(bucket, safe='')),
+            params={'uploadType': 'media', 'name': name}, body=data,
+            content_type=content_type)
+
+    def compose(self, bucket, name, sources, content_type, metadata=None):
+        destination = {'contentType': content_type}
+        if metadata:
+            destination['metadata'] = metadata
+        return self.request(
+            'POST', self._object_path(bucket, name) + '/compose',
+            body={'sourceObjects': [{'name': source} for source in sources],
+                  'destination': destination})
+
+    def delete(self, bucket, name):
+        self.request('DELETE', self._object_path(bucket, name))
+
+    def get(self, bucket, name):
+        return self.request('GET', self._object_path(bucket, name))
+
+    def download(self, bucket, name, start=None, end=None):
+        """Download an object, or the bytes of it from start up to end."""
+        headers = {}
+        if start is not None:
+            headers['Range'] = 'bytes={0}-{1}'.format(
+                start, '' if end is None else end - 1)
+        return self.request('GET', self._object_path(bucket, name),
+                            params={'alt': 'media'}, headers=headers, raw=True)
+
+    def list(self, bucket, prefix):
+        """List the names of the objects with a prefix."""
+        for item in self.list_items(bucket, prefix, ['name']):
+            yield item['name']
+
+    def list_items(self, bucket, prefix, fields):
+        """List the given metadata fields of the objects with a prefix."""
+        params = {'prefix': prefix,
+                  'fields': 'items({0}),nextPageToken'.format(','.join(fields))}
+        while True:
+            response = self.request(
+                'GET', '/storage/v1/b/{0}/o'.format(quote(bucket, safe='')),
+                params=params) or {}
+            for item in response.get('items', []):
+                yield item
+            if not response.get('nextPageToken'):
+                return
+            params['pageToken'] = response['nextPageToken']
+
+
+def parse_url(url):
+    """Split a gs:// URL into the names of its bucket and object."""
+    if not url.startswith('gs://') or '/' not in url[len('gs://'):]:
+        raise ValueError('Not a GCS object URL: ' + url)
+    bucket, name = url[len('gs://'):].split('/', 1)
+    return bucket, name
+
+
+def _read_chunk(stream, size):
+    """Read up to size bytes, only returning less at the end of the stream."""
+    parts = []
+    remaining = size
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def _parts_dir(name):
+    """Get the prefix of the temporary objects of uploads next to an object."""
+    return posixpath.join(posixpath.dirname(name), _PARTS_DIR, '')
+
+
+def delete_stale_parts(client, bucket, name):
+    """Delete the temporary objects left behind by uploads that were killed."""
+    cutoff = time.time() - _STALE_PARTS_SECONDS
+    for item in client.list_items(bucket, _parts_dir(name),
+                                  ['name', 'timeCreated']):
+        created = calendar.timegm(
+            time.strptime(item['timeCreated'][:19], '%Y-%m-%dT%H:%M:%S'))
+        if created < cutoff:
+            client.delete(bucket, item['name'])
+
+
+def upload(client, url, stream, chunk_size, parallel, content_type):
+    """Upload a stream to an object as a composite of parallel uploads.
+
+    Returns:
+      The hex MD5 hash of the stream.
+    """
+    bucket, name = parse_url(url)
+    try:
+        delete_stale_parts(client, bucket, name)
+    except Exception as e:
+        print('Failed to delete old temporary objects: {0}'.format(e),
+              file=sys.stderr)
+    parts_prefix = '{0}{1}-{2}/'.format(
+        _parts_dir(name), posixpath.basename(name), os.getpid())
+    chunks = queue.Queue(maxsize=parallel)
+    parts = {}
+    errors = []
+
+    def upload_chunks():
+        while True:
+            item = chunks.get()
+            if item is None:
+                return
+            index, data = item
+            part = '{0}{1:06d}'.format(parts_prefix, index)
+            try:
+                if not errors:
+                    client.upload(bucket, part, data, 'application/octet-stream')
+                    parts[index] = part
+            except Exception as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=upload_chunks) for _ in range(parallel)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    md5 = hashlib.md5()
+    index = 0
+    try:
+        while not errors:
+            data = _read_chunk(stream, chunk_size)
+            if not data and index:
+                break
+            md5.update(data)
+            chunks.put((index, data))
+            index += 1
+            if len(data) < chunk_size:
+                break
+    finally:
+        for _ in workers:
+            chunks.put(None)
+        for worker in workers:
+            worker.join()
+
+    try:
+        if errors:
+            raise errors[0]
+        sources = [parts[i] for i in range(index)]
+        level = 0
+        # Compose the parts a level at a time, as only a few objects can be
+        # composed at once.
+        while len(sources) > _MAX_COMPOSE_SOURCES:
+            composed = []
+            for start in range(0, len(sources), _MAX_COMPOSE_SOURCES):
+                intermediate = '{0}c{1}-{2:06d}'.format(parts_prefix, level, start)
+                client.compose(bucket, intermediate,
+                               sources[start:start + _MAX_COMPOSE_SOURCES],
+                               'application/octet-stream')
+                composed.append(intermediate)
+            parts.update(('c{0}-{1}'.format(level, i), intermediate)
+                         for i, intermediate in enumerate(composed))
+            sources = composed
+            level += 1
+        client.compose(bucket, name, sources, content_type,
+                       metadata={_MD5_METADATA_KEY: md5.hexdigest()})
+    finally:
+        for part in parts.values():
+            try:
+                client.delete(bucket, part)
+            except Exception as e:
+                print('Failed to delete {0}: {1}'.format(part, e), file=sys.stderr)
+    return md5.hexdigest()
+
+
+def get_md5(client, url):
+    """Get the hex MD5 hash of an object, or None if it is not known."""
+    bucket, name = parse_url(url)
+    metadata = client.get(bucket, name)
+    md5 = (metadata.get('metadata') or {}).get(_MD5_METADATA_KEY)
+    if not md5 and metadata.get('md5Hash'):
+        md5 = binascii.hexlify(base64.b64decode(metadata['md5Hash'])).decode('ascii')
+    return md5
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command')
+    upload_parser = subparsers.add_parser(
+        'upload', help='upload stdin to an object, and print its MD5 hash')
+    upload_parser.add_argument('url', help='the gs:// URL of the object')
+    upload_parser.add_argument(
+        '--chunk-size-mb', type=int, default=32,
+        help='the size of the chunks that are uploaded in parallel')
+    upload_parser.add_argument(
+        '--parallel', type=int, default=4,
+        help='the number of chunks to upload at once')
+    upload_parser.add_argument(
+        '--content-type', default='application/zip',
+        help='the content type of the object')
+    md5_parser = subparsers.add_parser(
+        'md5', help='print the MD5 hash of an object')
+    md5_parser.add_argument('url', help='the gs:// URL of the object')
+    args = parser.parse_args(argv)
+
+    client = GcsClient()
+    if args.command == 'upload':
+        stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        print(upload(client, args.url, stream, max(1, args.chunk_size_mb) * 1024 * 1024,
+                     max(1, args.parallel), args.content_type))
+    elif args.command == 'md5':
+        md5 = get_md5(client, args.url)
+        if not md5:
+            return 1
+        print(md5)
+    else:
+        parser.print_usage()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Executes notebooks headlessly, for each combination of parameters.
+
+Started by `datalab run` in the Datalab container, in the background, so
+that runs do not depend on the SSH connection that started them:
+
+    notebook_runner.py run datalab/notebooks/nightly.ipynb \\
+        --param date=2018-01-02 --param region=us --param region=eu
+    notebook_runner.py follow datalab/notebooks/runs/nightly-20180102-030405
+
+Giving a parameter more than once sweeps over its values, and the
+notebook is executed once for each combination of the values of all
+parameters, by up to `--parallel` kernels at once (by default, one per
+core). Values are parsed as JSON if they can be, and otherwise kept as
+strings. They are assigned in a cell inserted after the cell tagged
+`parameters`, or at the top of the notebook if there is none.
+
+Each executed notebook, with the execution time of each cell in its
+metadata, is written to the run directory, along with `status.json`,
+which records the parameters, outcome and timings of every execution, and
+`run.log`, which `follow` prints as it grows.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+import traceback
+
+
+_CONTENT_DIR = os.environ.get('DATALAB_CONTENT', '/content')
+_PARAMETERS_TAG = 'parameters'
+_STATUS_FILE = 'status.json'
+_LOG_FILE = 'run.log'
+_FOLLOW_INTERVAL_SECONDS = 1
+
+
+def parse_params(params):
+    """Parse KEY=VALUE parameters into the values of each key, in order."""
+    values = collections.OrderedDict()
+    for param in params:
+        key, sep, value = param.partition('=')
+        if not sep or not re.match(r'^[A-Za-z_]\w*$', key):
+            raise ValueError('Parameters must be KEY=VALUE, with KEY a valid '
+                             'identifier: ' + param)
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        values.setdefault(key, []).append(value)
+    return values
+
+
+def combinations(values):
+    """List every combination of the values of the parameters."""
+    keys = list(values)
+    return [collections.OrderedDict(zip(keys, combination))
+            for combination in itertools.product(*[values[k] for k in keys])]
+
+
+def _output_name(stem, index, params):
+    suffix = '-'.join(re.sub(r'[^\w.]+', '_', '{0}={1}'.format(k, v))
+                      for k, v in params.items())
+    name = '{0}-{1:03d}{2}'.format(stem, index, '-' + suffix if suffix else '')
+    return name[:200] + '.ipynb'
+
+
+def _inject_params(nb, params):
+    import nbformat
+    if not params:
+        return
+    source = '# Parameters\n' + ''.join(
+        '{0} = {1!r}\n'.format(key, value) for key, value in params.items())
+    cell = nbformat.v4.new_code_cell(source)
+    cell.metadata['tags'] = ['injected-parameters']
+    position = 0
+    for i, existing in enumerate(nb.cells):
+        if _PARAMETERS_TAG in existing.get('metadata', {}).get('tags', []):
+            position = i + 1
+            break
+    nb.cells.insert(position, cell)
+
+
+def _write_json(path, value):
+    """Write a JSON file atomically, as `follow` may be reading it."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(value, f, indent=2)
+    os.rename(temp_path, path)
+
+
+def execute(task):
+    """Execute a notebook with a set of parameters.
+
+    Runs in a worker process.
+
+    Returns:
+      The record of the execution for status.json.
+    """
+    index, notebook_path, output_path, params, timeout, kernel_name = task
+    import nbformat
+    from nbconvert.preprocessors import ExecutePreprocessor
+
+    class TimingExecutePreprocessor(ExecutePreprocessor):
+        """Records the execution time of each cell in its metadata."""
+
+        def preprocess_cell(self, cell, resources, cell_index):
+            start = time.time()
+            try:
+                return super(TimingExecutePreprocessor, self).preprocess_cell(
+                    cell, resources, cell_index)
+            finally:
+                if cell.cell_type == 'code':
+                    cell.metadata['datalab_execution_seconds'] = round(
+                        time.time() - start, 3)
+
+    record = collections.OrderedDict([
+        ('index', index), ('params', params),
+        ('output', os.path.relpath(output_path, _CONTENT_DIR)),
+        ('status', 'running'), ('start', time.time())])
+    nb = nbformat.read(notebook_path, as_version=4)
+    _inject_params(nb, params)
+    kwargs = {'timeout': timeout}
+    if kernel_name:
+        kwargs['kernel_name'] = kernel_name
+    try:
+        TimingExecutePreprocessor(**kwargs).preprocess(
+            nb, {'metadata': {'path': os.path.dirname(notebook_path)}})
+        record['status'] = 'succeeded'
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = str(e).strip().splitlines()[-1] if str(e).strip() \
+            else traceback.format_exc().splitlines()[-1]
+    record['seconds'] = round(time.time() - record['start'], 3)
+    record['cell_seconds'] = [
+        cell.metadata.get('datalab_execution_seconds')
+        for cell in nb.cells if cell.cell_type == 'code']
+    try:
+        nbformat.write(nb, output_path)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = 'Failed to save the executed notebook: {0}'.format(e)
+    return record
+
+
+def run(args):
+    notebook_path = os.path.join(_CONTENT_DIR, args.notebook)
+    stem = os.path.splitext(os.path.basename(notebook_path))[0]
+    run_dir = os.path.join(_CONTENT_DIR, args.run_dir)
+    if not os.path.isdir(run_dir):
+        os.makedirs(run_dir)
+    log = open(os.path.join(run_dir, _LOG_FILE), 'a')
+
+    def log_line(message):
+        log.write('{0} {1}\n'.format(time.strftime('%H:%M:%S'), message))
+        log.flush()
+
+    status = collections.OrderedDict([
+        ('notebook', args.notebook), ('state', 'running'), ('pid', os.getpid()),
+        ('start', time.time()), ('runs', [])])
+    status_path = os.path.join(run_dir, _STATUS_FILE)
+    try:
+        tasks = []
+        for index, params in enumerate(combinations(parse_params(args.param))):
+            output_path = os.path.join(run_dir, _output_name(stem, index, params))
+            tasks.append((index, notebook_path, output_path, params,
+                          args.timeout, args.kernel))
+        parallel = min(len(tasks), args.parallel or multiprocessing.cpu_count())
+        _write_json(status_path, status)
+        log_line('Executing {0} {1} times, {2} at a time'.format(
+            args.notebook, len(tasks), parallel))
+
+        # Each execution gets a fresh worker process, and hence kernel.
+        pool = multiprocessing.Pool(parallel, maxtasksperchild=1)
+        for record in pool.imap_unordered(execute, tasks):
+            status['runs'].append(record)
+            status['runs'].sort(key=lambda r: r['index'])
+            _write_json(status_path, status)
+            log_line('{0} {1} {2} in {3:.1f}s{4}'.format(
+                record['status'].capitalize(), record['output'],
+                json.dumps(record['params']), record['seconds'],
+                ': ' + record['error'] if record.get('error') else ''))
+        pool.close()
+        pool.join()
+        failed = len([r for r in status['runs'] if r['status'] != 'succeeded'])
+        status['state'] = 'failed' if failed else 'succeeded'
+        log_line('Done: {0} of {1} executions succeeded in {2:.1f}s'.format(
+            len(tasks) - failed, len(tasks), time.time() - status['start']))
+    except Exception:
+        status['state'] = 'failed'
+        log_line('The run failed:\n' + traceback.format_exc())
+    status['end'] = time.time()
+    _write_json(status_path, status)
+    return 0 if status['state'] == 'succeeded' else 1
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def follow(args):
+    """Print the log of a run as it grows, until the run is over."""
+    run_dir = os.path.join(_CONTENT_DIR, args.run_dir)
+    log_path = os.path.join(run_dir, _LOG_FILE)
+    status_path = os.path.join(run_dir, _STATUS_FILE)
+    offset = 0
+    while True:
+        try:
+            with open(status_path) as f:
+                status = json.load(f)
+        except (IOError, OSError, ValueError):
+            status = {'state': 'starting'}
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                f.seek(offset)
+                data = f.read()
+                offset = f.tell()
+            if data:
+                sys.stdout.write(data)
+                sys.stdout.flush()
+        if status['state'] in ('succeeded', 'failed'):
+            return 0 if status['state'] == 'succeeded' else 1
+        if status['state'] == 'running' and not _is_running(status['pid']):
+            print('The runner exited before the run was over.')
+            return 1
+        time.sleep(_FOLLOW_INTERVAL_SECONDS)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='execute a notebook')
+    run_parser.add_argument(
+        'notebook', help='the path of the notebook, relative to ' + _CONTENT_DIR)
+    run_parser.add_argument(
+        'run_dir', help='the directory of the run, relative to ' + _CONTENT_DIR)
+    run_parser.add_argument(
+        '--param', action='append', default=[],
+        help='a KEY=VALUE parameter; repeat a KEY to sweep over its values')
+    run_parser.add_argument(
+        '--parallel', type=int, default=0,
+        help='the number of kernels to run at once; one per core by default')
+    run_parser.add_argument(
+        '--timeout', type=int, default=None,
+        help='the time limit of each cell, in seconds')
+    run_parser.add_argument(
+        '--kernel', help='the kernel to use, if not that of the notebook')
+    follow_parser = subparsers.add_parser(
+        'follow', help='print the log of a run until it is over')
+    follow_parser.add_argument(
+        'run_dir', help='the directory of the run, relative to ' + _CONTENT_DIR)
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        return run(args)
+    elif args.command == 'follow':
+        return follow(args)
+    parser.print_usage()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
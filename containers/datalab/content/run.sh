@@ -49,6 +49,30 @@ fi
 PYTHON2_ENV='py2env'
 PYTHON3_ENV='py3env'
 
+# Each startup phase below is timed, and the timings are written to this
+# report, which is served at /_info/startup.
+export DATALAB_STARTUP_REPORT=${DATALAB_STARTUP_REPORT:-/tmp/datalab-startup-report.json}
+STARTUP_BEGIN_MS=$(date +%s%3N)
+STARTUP_PHASES=""
+
+write_startup_report() {
+  cat > "${DATALAB_STARTUP_REPORT}.tmp" <<EOF_REPORT
+{"startTimeMs": ${STARTUP_BEGIN_MS}, "phases": [${STARTUP_PHASES}]}
+EOF_REPORT
+  mv "${DATALAB_STARTUP_REPORT}.tmp" "${DATALAB_STARTUP_REPORT}"
+}
+
+startup_phase_begin() {
+  STARTUP_PHASE_NAME="$1"
+  STARTUP_PHASE_BEGIN_MS=$(date +%s%3N)
+}
+
+startup_phase_end() {
+  local end_ms=$(date +%s%3N)
+  STARTUP_PHASES="${STARTUP_PHASES}${STARTUP_PHASES:+, }{\"name\": \"${STARTUP_PHASE_NAME}\", \"offsetMs\": $((STARTUP_PHASE_BEGIN_MS - STARTUP_BEGIN_MS)), \"durationMs\": $((end_ms - STARTUP_PHASE_BEGIN_MS))}"
+  write_startup_report
+}
+
 check_tmp_directory() {
     echo "Verifying that the /tmp directory is writable"
     test_temp_file=$(mktemp --tmpdir=/tmp)
@@ -60,28 +84,68 @@ check_tmp_directory() {
     echo "The /tmp directory is writable"
 }
 
+# Compute a hash of the contents of the pydatalab source tree, ignoring
+# version control metadata and build outputs.
+function pydatalab_source_hash() {
+  (cd "$1" && find . -type f \
+      -not -path './.git/*' -not -path '*/build/*' -not -path '*/dist/*' \
+      -not -path '*.egg-info/*' -not -path '*/__pycache__/*' -not -name '*.pyc' \
+      -print0 | sort -z | xargs -0 sha1sum | sha1sum | cut -d ' ' -f 1)
+}
+
+# Install pydatalab into the given conda environment, unless the same
+# sources were already installed there.
+function install_pydatalab_into_env() {
+  local env="$1"
+  local source_hash="$2"
+  source activate "${env}"
+  local stamp="${CONDA_PREFIX}/.pydatalab-source-hash"
+  if [ "$(cat "${stamp}" 2>/dev/null)" == "${source_hash}" ]; then
+    echo "pydatalab is already up to date in ${env}"
+    return 0
+  fi
+  rm -f "${stamp}"
+  pip install --upgrade --no-deps --force-reinstall --no-cache-dir \
+    ${PYDATALAB} \
+    ${PYDATALAB}/solutionbox/image_classification/. \
+    ${PYDATALAB}/solutionbox/structured_data/.
+  echo "${source_hash}" > "${stamp}"
+}
+
 # Reinstall the parts of pydatalab from /content/pydatalab, which is where it gets live-mounted.
+# Both environments are updated concurrently, and skipped if the sources have not changed.
 function reinstall_pydatalab() {
   PYDATALAB=/content/pydatalab
   echo "Reinstalling pydatalab from ${PYDATALAB}"
+  local source_hash=$(pydatalab_source_hash ${PYDATALAB})
   source deactivate
-  source activate ${PYTHON2_ENV}
-  pip install --upgrade --no-deps --force-reinstall --no-cache-dir ${PYDATALAB}
-  pip install --upgrade --no-deps --force-reinstall ${PYDATALAB}/solutionbox/image_classification/.
-  pip install --upgrade --no-deps --force-reinstall ${PYDATALAB}/solutionbox/structured_data/.
-  source deactivate
-  source activate ${PYTHON3_ENV}
-  pip install --upgrade --no-deps --force-reinstall --no-cache-dir ${PYDATALAB}
-  pip install --upgrade --no-deps --force-reinstall ${PYDATALAB}/solutionbox/image_classification/.
-  pip install --upgrade --no-deps --force-reinstall ${PYDATALAB}/solutionbox/structured_data/.
-  source deactivate
+  local failed=0
+  local pids=""
+  for env in ${PYTHON2_ENV} ${PYTHON3_ENV}; do
+    (install_pydatalab_into_env "${env}" "${source_hash}" > "/tmp/pydatalab-${env}.log" 2>&1) &
+    pids="${pids} $!"
+  done
+  for pid in ${pids}; do
+    wait ${pid} || failed=1
+  done
+  for env in ${PYTHON2_ENV} ${PYTHON3_ENV}; do
+    tail -n 1 "/tmp/pydatalab-${env}.log"
+  done
+  if [ "${failed}" != "0" ]; then
+    cat /tmp/pydatalab-${PYTHON2_ENV}.log /tmp/pydatalab-${PYTHON3_ENV}.log
+    echo "Failed to reinstall pydatalab"
+    return 1
+  fi
   echo "Done reinstalling pydatalab"
 }
 
+startup_phase_begin "setup_env"
 if [ -d "$HOME" ]; then
   source /datalab/setup-env.sh
 fi
+startup_phase_end
 
+startup_phase_begin "usage_reporting"
 if [ "${ENABLE_USAGE_REPORTING}" = "true" ]
 then
   if [ -n "${PROJECT_ID}" ]
@@ -89,64 +153,137 @@ then
     export PROJECT_NUMBER=${PROJECT_NUMBER:-`gcloud projects describe "${PROJECT_ID}" --format 'value(projectNumber)' 2>/dev/null || true`}
   fi
 fi
+startup_phase_end
 
 # Verify that we can write to the /tmp directory
+startup_phase_begin "check_tmp_directory"
 check_tmp_directory
+startup_phase_end
 
 # Make sure the notebooks directory exists
 mkdir -p /content/datalab/notebooks
 
-# Fetch docs and tutorials. This should not abort startup if it fails
-{
-if [ -d /content/datalab/docs ]; then
-  # The docs directory already exists, so we have to either update or initialize it as a git repository
-  pushd ./
-  cd /content/datalab/docs
-  if [ -d /content/datalab/docs/.git ]; then
-    git fetch origin master; git reset --hard origin/master
+# The docs and tutorials are synced in the background once the web server
+# is listening, so that a slow or unreachable GitHub never delays startup.
+# The progress of the sync is written to this file, and served at /_info/docs.
+export DATALAB_DOCS_STATUS_FILE=${DATALAB_DOCS_STATUS_FILE:-/tmp/datalab-docs-status.json}
+DOCS_REPO_URL="https://github.com/googledatalab/notebooks.git"
+DOCS_DIR=/content/datalab/docs
+DOCS_SYNC_TIMEOUT_SECONDS=${DOCS_SYNC_TIMEOUT_SECONDS:-120}
+SERVER_START_TIMEOUT_SECONDS=300
+
+write_docs_status() {
+  local state="$1"
+  local message="$2"
+  local revision="$3"
+  cat > "${DATALAB_DOCS_STATUS_FILE}.tmp" <<EOF_STATUS
+{"state": "${state}", "message": "${message}", "revision": "${revision}", "updated": "$(date -u +%Y-%m-%dT%H:%M:%SZ)"}
+EOF_STATUS
+  mv "${DATALAB_DOCS_STATUS_FILE}.tmp" "${DATALAB_DOCS_STATUS_FILE}"
+}
+
+wait_for_server() {
+  for i in $(seq 1 ${SERVER_START_TIMEOUT_SECONDS}); do
+    if (exec 3<>/dev/tcp/127.0.0.1/8080) 2>/dev/null; then
+      return 0
+    fi
+    sleep 1
+  done
+  return 1
+}
+
+# Fetch only the latest revision of the docs, and check out the notebooks in it.
+sync_docs() {
+  mkdir -p "${DOCS_DIR}"
+  cd "${DOCS_DIR}"
+  if [ ! -d .git ]; then
+    git init -q
+    git remote add origin "${DOCS_REPO_URL}"
+  fi
+  git config core.sparsecheckout true
+  echo $'intro/\nsamples/\ntutorials/\n*.ipynb\n' > .git/info/sparse-checkout
+  # Abort transfers that stall, in addition to the overall time limit.
+  timeout -k 10 "${DOCS_SYNC_TIMEOUT_SECONDS}" \
+    git -c http.lowSpeedLimit=1000 -c http.lowSpeedTime=30 \
+    fetch -q --depth 1 origin master || return 1
+  if git rev-parse -q --verify HEAD > /dev/null; then
+    git reset -q --hard FETCH_HEAD
   else
-    git init; git remote add origin https://github.com/googledatalab/notebooks.git; git fetch origin;
+    git checkout -q -B master FETCH_HEAD
   fi
-  popd
-else
-  (cd /content/datalab; git clone -n --single-branch https://github.com/googledatalab/notebooks.git docs)
-fi
-(cd /content/datalab/docs; git config core.sparsecheckout true; echo $'intro/\nsamples/\ntutorials/\n*.ipynb\n' > .git/info/sparse-checkout; git checkout master)
-} || echo "Fetching tutorials and samples failed."
+}
+
+sync_docs_in_background() {
+  write_docs_status "pending" "Waiting for the Datalab server to start" ""
+  (
+    if ! wait_for_server; then
+      write_docs_status "skipped" "The Datalab server did not start" ""
+      exit 0
+    fi
+    write_docs_status "syncing" "Fetching ${DOCS_REPO_URL}" ""
+    if (sync_docs) > /dev/null 2>&1; then
+      write_docs_status "succeeded" "Fetched ${DOCS_REPO_URL}" \
+        "$(cd "${DOCS_DIR}" && git rev-parse HEAD)"
+    else
+      echo "Fetching tutorials and samples failed."
+      write_docs_status "failed" "Failed to fetch ${DOCS_REPO_URL} within ${DOCS_SYNC_TIMEOUT_SECONDS} seconds" ""
+    fi
+  ) &
+}
 
 # Run the user's custom extension script if it exists. To avoid platform issues with
 # execution permissions, line endings, etc, we create a local sanitized copy.
+startup_phase_begin "user_startup_script"
 if [ -f /content/datalab/.config/startup.sh ]
 then
   tr -d '\r' < /content/datalab/.config/startup.sh > ~/startup.sh
   chmod +x ~/startup.sh
   . ~/startup.sh
 fi
+startup_phase_end
 
-# Get VM information if running on google cloud
+# Get VM information if running on google cloud. A single recursive request
+# fetches everything we need from the metadata server.
+startup_phase_begin "vm_metadata"
 compute_metadata_url="http://metadata.google.internal/computeMetadata/v1"
-vm_project=$(curl -s "${compute_metadata_url}/project/project-id" -H "Metadata-Flavor: Google" || true)
+vm_metadata=$(curl -s --max-time 5 "${compute_metadata_url}/?recursive=true" -H "Metadata-Flavor: Google" || true)
+read -r vm_project vm_name vm_zone <<< "$(echo "${vm_metadata}" | python -c "
+import sys, json
+m = json.load(sys.stdin)
+print(' '.join([m['project']['projectId'],
+                m['instance']['hostname'].split('.')[0],
+                m['instance']['zone'].split('/')[-1]]))" 2>/dev/null || true)"
 if [ -n "${vm_project}" ] && [ "${vm_project}" != "no-project-id" ]; then
    export VM_PROJECT="${vm_project}"
-   export VM_NAME=$(curl -s "${compute_metadata_url}/instance/hostname" -H "Metadata-Flavor: Google" | cut -d '.' -f 1)
-   export VM_ZONE=$(curl -s "${compute_metadata_url}/instance/zone" -H "Metadata-Flavor: Google" | sed 's/.*zones\///')
+   export VM_NAME="${vm_name}"
+   export VM_ZONE="${vm_zone}"
    export DATALAB_SHUTDOWN_COMMAND="gcloud compute instances stop ${VM_NAME} --project ${VM_PROJECT} --zone ${VM_ZONE}"
 fi
+startup_phase_end
 
 # Create the notebook notary secret if one does not already exist
+startup_phase_begin "notary_secret"
 if [ ! -f /content/datalab/.config/notary_secret ]
 then
   mkdir -p /content/datalab/.config
   openssl rand -base64 128 > /content/datalab/.config/notary_secret
 fi
+startup_phase_end
 
 # Parse the settings overrides to get the (potentially overridden) value
 # of the `datalabBasePath` setting.
+startup_phase_begin "settings_overrides"
 EMPTY_BRACES="{}"
 DATALAB_BASE_PATH=$(echo ${DATALAB_SETTINGS_OVERRIDES:-$EMPTY_BRACES} | python -c "import sys,json; print(json.load(sys.stdin).get('datalabBasePath',''))")
+startup_phase_end
+
+# Sync the docs once the DataLab server below has started.
+sync_docs_in_background
 
 # Start the ungit server
+startup_phase_begin "ungit_launch"
 ungit --port=8083 --no-launchBrowser --forcedLaunchPath=/content/datalab --ungitVersionCheckOverride 1 --rootPath="${DATALAB_BASE_PATH}" > /dev/null &
+startup_phase_end
 
 # Start the DataLab server
 FOREVER_CMD="forever --minUptime 1000 --spinSleepTime 1000"
@@ -164,17 +301,25 @@ if [ -d /devroot ]; then
   # Use our internal node_modules dir
   export NODE_PATH="${NODE_PATH}:/datalab/web/node_modules"
   if [ -d /content/pydatalab ]; then
+    startup_phase_begin "reinstall_pydatalab"
     reinstall_pydatalab
+    startup_phase_end
   fi
   # Prevent (harmless) error message about missing .foreverignore
   IGNOREFILE=/devroot/build/web/nb/.foreverignore
   [ -f ${IGNOREFILE} ] || touch ${IGNOREFILE}
   # Auto-restart when the developer builds from the typescript files.
   source activate ${PYTHON3_ENV}
+  # Record when the server is launched; its own startup is not included.
+  startup_phase_begin "server_launch"
+  startup_phase_end
   echo ${FOREVER_CMD} --watch --watchDirectory /devroot/build/web/nb /devroot/build/web/nb/app.js
   ${FOREVER_CMD} --watch --watchDirectory /devroot/build/web/nb /devroot/build/web/nb/app.js
 else
   source activate ${PYTHON3_ENV}
+  # Record when the server is launched; its own startup is not included.
+  startup_phase_begin "server_launch"
+  startup_phase_end
   echo "Open your browser to http://localhost:${EXTERNAL_PORT}/ to connect to Datalab."
   ${FOREVER_CMD} /datalab/web/app.js
 fi
@@ -46,10 +46,14 @@ function writeBackupLog(log_history: Object) {
  * Run the GCSbackup shell script and call the callback function with its exit code
  */
 function runBackup(tag: string, callback: Function) {
-  var cmd = childProcess.spawn('/bin/bash', ['/datalab/GCSbackup.sh',
-                               '-t', tag,
-                               '-p', '/content',
-                               '-l', '/datalab/.backup_log.txt']);
+  var args = ['/datalab/GCSbackup.sh',
+              '-t', tag,
+              '-p', '/content',
+              '-l', '/datalab/.backup_log.txt'];
+  if (appSettings.incrementalGCSBackups) {
+    args.push('--incremental');
+  }
+  var cmd = childProcess.spawn('/bin/bash', args);
   cmd.on('close', (code: number) => {
     if (code > 0) {
       logging.getLogger().error('WARNING: Backup script with tag ' + tag + ' failed with code: ' + code);
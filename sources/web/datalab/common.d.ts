@@ -143,6 +143,11 @@ declare module common {
      */
     enableAutoGCSBackups: boolean;
 
+    /**
+     * Whether the automatic backups upload only new and changed files, rather than an archive
+     */
+    incrementalGCSBackups: boolean;
+
     /**
      * Whether to index the file system for finding files
      */
@@ -163,6 +168,25 @@ declare module common {
      */
     numWeeklyBackups: number;
 
+    /**
+     * Number of idle, pre-started kernels to keep running per kernelspec,
+     * so that opening a notebook does not wait for a kernel to start.
+     * 0 disables the kernel pool.
+     */
+    kernelPoolSize: number;
+
+    /**
+     * Stop pre-starting kernels once the idle ones use this many MB of
+     * memory in total. 0 means no limit.
+     */
+    kernelPoolMaxMemoryMB: number;
+
+    /**
+     * Do not pre-start kernels while less than this many MB of memory are
+     * available on the machine. 0 means no limit.
+     */
+    kernelPoolMinAvailableMemoryMB: number;
+
     /**
      * The idle timeout interval, such as "2h 30m".
      */
@@ -15,6 +15,7 @@
 /// <reference path="../../../third_party/externs/ts/node/node.d.ts" />
 /// <reference path="common.d.ts" />
 
+import fs = require('fs');
 import http = require('http');
 import jupyter = require('./jupyter');
 import url = require('url');
@@ -48,6 +49,45 @@ export function getVmInfo() {
   };
 }
 
+/**
+ * Gets the status of the background sync of the docs and tutorials.
+ *
+ * The sync is run by the container's startup script after the server has started, and
+ * it records its progress in the file named by the DATALAB_DOCS_STATUS_FILE variable.
+ */
+export function getDocsStatus(): any {
+  var statusFile = process.env['DATALAB_DOCS_STATUS_FILE'];
+  if (!statusFile) {
+    return { state: 'unknown' };
+  }
+  try {
+    return JSON.parse(fs.readFileSync(statusFile, 'utf8'));
+  } catch (e) {
+    // The startup script has not written the file yet.
+    return { state: 'pending' };
+  }
+}
+
+/**
+ * Gets the timings of the container startup phases that ran before this server was launched.
+ *
+ * The container's startup script writes these to the file named by the DATALAB_STARTUP_REPORT
+ * variable. The time at which this server process started is added to the report.
+ */
+export function getStartupReport(): any {
+  var report: any = {};
+  var reportFile = process.env['DATALAB_STARTUP_REPORT'];
+  if (reportFile) {
+    try {
+      report = JSON.parse(fs.readFileSync(reportFile, 'utf8'));
+    } catch (e) {
+      report = {};
+    }
+  }
+  report.serverStartTimeMs = Date.now() - Math.round(process.uptime() * 1000);
+  return report;
+}
+
 /**
  * Implements information request handling.
  * @param request the incoming health request.
@@ -62,6 +102,14 @@ function requestHandler(request: http.ServerRequest, response: http.ServerRespon
     response.writeHead(200, { 'Content-Type': 'application/json' });
     response.write(JSON.stringify(vminfo));
     response.end();
+  } else if (path === '/_info/startup') {
+    response.writeHead(200, { 'Content-Type': 'application/json' });
+    response.write(JSON.stringify(getStartupReport()));
+    response.end();
+  } else if (path === '/_info/docs') {
+    response.writeHead(200, { 'Content-Type': 'application/json' });
+    response.write(JSON.stringify(getDocsStatus()));
+    response.end();
   } else {
     response.writeHead(200, { 'Content-Type': 'text/plain' });
 
@@ -80,6 +128,14 @@ function requestHandler(request: http.ServerRequest, response: http.ServerRespon
     response.write('Jupyter Servers:\n');
     response.write(JSON.stringify(jupyter.getInfo(), null, 2));
     response.write('\n\n');
+
+    response.write('Startup Report:\n');
+    response.write(JSON.stringify(getStartupReport(), null, 2));
+    response.write('\n\n');
+
+    response.write('Docs Sync:\n');
+    response.write(JSON.stringify(getDocsStatus(), null, 2));
+    response.write('\n\n');
     response.end();
   }
 }
@@ -27,6 +27,7 @@ import httpProxy = require('http-proxy');
 import idleTimeout = require('./idleTimeout');
 import logging = require('./logging');
 import net = require('net');
+import outputLimiter = require('./outputLimiter');
 import path = require('path');
 import settings = require('./settings');
 import tcp = require('tcp-port-used');
@@ -142,9 +143,18 @@ function createJupyterServerAtPort(port: number, userId: string, userDir: string
     '--NotebookNotary.algorithm=sha256',
     '--NotebookNotary.secret_file=' + secretPath,
     '--NotebookApp.base_url=' + appSettings.datalabBasePath,
+    '--PooledMappingKernelManager.pool_size=' + (appSettings.kernelPoolSize || 0),
+    '--PooledMappingKernelManager.pool_max_memory_mb=' +
+        (appSettings.kernelPoolMaxMemoryMB || 0),
+    '--PooledMappingKernelManager.pool_min_available_memory_mb=' +
+        (appSettings.kernelPoolMinAvailableMemoryMB || 0),
   ]);
 
-  var notebookEnv: any = process.env;
+  var notebookEnv: any = {
+    ...process.env,
+    // Where the output_governor kernel extension reads the output limits from.
+    DATALAB_USER_SETTINGS: path.join(settings.getUserConfigDir(userId), 'settings.json'),
+  };
   var processOptions = {
     detached: false,
     env: notebookEnv
@@ -167,6 +177,13 @@ function createJupyterServerAtPort(port: number, userId: string, userDir: string
   server.proxy = httpProxy.createProxyServer(proxyOptions);
   server.proxy.on('proxyRes', responseHandler);
   server.proxy.on('error', errorHandler);
+  server.proxy.on('proxyReqWs', function(proxyRequest: http.ClientRequest,
+                                         request: http.ServerRequest, socket: net.Socket) {
+    const limitBytes = outputLimiter.getCellLimitBytes(userId);
+    if (limitBytes && outputLimiter.isKernelChannelsUrl(request.url)) {
+      outputLimiter.filterProxiedWebSocket(proxyRequest, socket, limitBytes);
+    }
+  });
 
   tcp.waitUntilUsedOnHost(server.port, "localhost", 100, 15000).then(
     function() {
@@ -0,0 +1,254 @@
+/*
+ * Copyright 2018 Google Inc. All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+ * in compliance with the License. You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software distributed under the License
+ * is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+ * or implied. See the License for the specific language governing permissions and limitations under
+ * the License.
+ */
+
+/// <reference path="../../../third_party/externs/ts/node/node.d.ts" />
+/// <reference path="common.d.ts" />
+
+import http = require('http');
+import logging = require('./logging');
+import net = require('net');
+import settings = require('./settings');
+import stream = require('stream');
+
+/**
+ * The output limits proper are applied in the kernels by the output_governor extension. This is
+ * a backstop against kernels that flood the browser anyway, so its default limit is larger.
+ */
+const PROXY_CELL_LIMIT_KEY = 'outputProxyCellLimitMB';
+const DEFAULT_PROXY_CELL_LIMIT_MB = 50;
+
+const OUTPUT_MESSAGE_TYPES = ['stream', 'display_data', 'execute_result', 'update_display_data'];
+
+const KERNEL_CHANNELS_PATH = /\/api\/kernels\/[^\/]+\/channels/;
+
+const TEXT_OPCODE = 0x1;
+
+/**
+ * Gets the largest amount of output a cell may send through the proxy, in bytes, from the user
+ * settings. 0 means no limit.
+ */
+export function getCellLimitBytes(userId: string): number {
+  const value = parseFloat(settings.loadUserSettings(userId)[PROXY_CELL_LIMIT_KEY]);
+  const limitMB = isNaN(value) ? DEFAULT_PROXY_CELL_LIMIT_MB : Math.max(0, value);
+  return limitMB * 1024 * 1024;
+}
+
+/**
+ * Checks whether a WebSocket URL is the channels of a kernel, as opposed to a terminal.
+ */
+export function isKernelChannelsUrl(url: string): boolean {
+  return KERNEL_CHANNELS_PATH.test(url);
+}
+
+/**
+ * Counts the output of each cell in the messages sent by a kernel, and drops the output of cells
+ * once it exceeds the limit.
+ */
+export class KernelOutputLimiter {
+  // Output bytes so far, keyed by the ID of the execute request that caused them.
+  private _cellBytes: common.Map<number> = {};
+
+  constructor(private _limitBytes: number) {}
+
+  /**
+   * Filters a JSON message from a kernel.
+   *
+   * @returns the message to send on, which is a notice for the first output message over the
+   *     limit, or null to drop the message.
+   */
+  filter(message: string): string {
+    let msg: any;
+    try {
+      msg = JSON.parse(message);
+    } catch (e) {
+      return message;
+    }
+    const parentId = msg.parent_header && msg.parent_header.msg_id;
+    if (msg.channel !== 'iopub' || !parentId) {
+      return message;
+    }
+    if (msg.msg_type === 'status' && msg.content.execution_state === 'idle') {
+      delete this._cellBytes[parentId];
+      return message;
+    }
+    if (OUTPUT_MESSAGE_TYPES.indexOf(msg.msg_type) < 0) {
+      return message;
+    }
+    const previousBytes = this._cellBytes[parentId] || 0;
+    const bytes = previousBytes + message.length;
+    this._cellBytes[parentId] = bytes;
+    if (!this._limitBytes || bytes <= this._limitBytes) {
+      return message;
+    }
+    if (previousBytes > this._limitBytes) {
+      return null;
+    }
+    logging.getLogger().info('Dropping output of execute request %s over %d bytes',
+                             parentId, this._limitBytes);
+    msg.msg_type = msg.header.msg_type = 'stream';
+    msg.content = {
+      name: 'stderr',
+      text: '\n[The output of this cell exceeded ' + +(this._limitBytes / 1048576).toFixed(1) +
+          ' MB, so the Datalab server dropped the rest of it. The limit is the ' +
+          PROXY_CELL_LIMIT_KEY + ' user setting.]\n',
+    };
+    msg.metadata = {};
+    return JSON.stringify(msg);
+  }
+}
+
+/**
+ * Encodes an unmasked, unfragmented WebSocket text frame, as sent by a server.
+ */
+export function encodeTextFrame(text: string): Buffer {
+  const payload = new Buffer(text, 'utf8');
+  let header: Buffer;
+  if (payload.length < 126) {
+    header = new Buffer(2);
+    header[1] = payload.length;
+  } else if (payload.length < 65536) {
+    header = new Buffer(4);
+    header[1] = 126;
+    header.writeUInt16BE(payload.length, 2);
+  } else {
+    header = new Buffer(10);
+    header[1] = 127;
+    header.writeUInt32BE(Math.floor(payload.length / 0x100000000), 2);
+    header.writeUInt32BE(payload.length % 0x100000000, 6);
+  }
+  header[0] = 0x80 | TEXT_OPCODE;
+  return Buffer.concat([header, payload]);
+}
+
+/**
+ * Applies a KernelOutputLimiter to the WebSocket frames sent by Jupyter to the browser.
+ *
+ * Only complete, uncompressed, unmasked text frames hold the JSON messages that are filtered;
+ * every other frame is passed through as it arrives, without being buffered.
+ */
+export class WebSocketOutputFilter extends stream.Transform {
+  private _chunks: Buffer[] = [];
+  private _length = 0;
+  // The number of bytes of the current frame still to be passed through unfiltered.
+  private _passThroughBytes = 0;
+
+  constructor(private _limiter: KernelOutputLimiter) {
+    super();
+  }
+
+  _transform(chunk: Buffer, encoding: string, callback: Function) {
+    this._chunks.push(chunk);
+    this._length += chunk.length;
+    while (this._processFrame()) {}
+    callback();
+  }
+
+  _flush(callback: Function) {
+    if (this._length) {
+      this.push(Buffer.concat(this._chunks, this._length));
+    }
+    callback();
+  }
+
+  private _take(length: number): Buffer {
+    const buffered = this._chunks.length == 1 ?
+        this._chunks[0] : Buffer.concat(this._chunks, this._length);
+    this._length -= length;
+    this._chunks = this._length ? [buffered.slice(length)] : [];
+    return buffered.slice(0, length);
+  }
+
+  /**
+   * Processes what it can of the next frame.
+   *
+   * @returns whether to continue processing, once more data is buffered.
+   */
+  private _processFrame(): boolean {
+    if (this._passThroughBytes) {
+      const length = Math.min(this._passThroughBytes, this._length);
+      if (!length) {
+        return false;
+      }
+      this.push(this._take(length));
+      this._passThroughBytes -= length;
+      return this._length > 0;
+    }
+    if (this._length < 2) {
+      return false;
+    }
+    // Frame headers are at most 14 bytes, so make sure they are in the first chunk.
+    if (this._chunks[0].length < 14 && this._chunks.length > 1) {
+      this._chunks = [Buffer.concat(this._chunks, this._length)];
+    }
+    const head = this._chunks[0];
+    const fin = (head[0] & 0x80) != 0;
+    const rsv = head[0] & 0x70;
+    const opcode = head[0] & 0x0f;
+    const masked = (head[1] & 0x80) != 0;
+    let payloadLength = head[1] & 0x7f;
+    let headerLength = 2;
+    if (payloadLength == 126) {
+      headerLength = 4;
+      if (this._length < headerLength) {
+        return false;
+      }
+      payloadLength = head.readUInt16BE(2);
+    } else if (payloadLength == 127) {
+      headerLength = 10;
+      if (this._length < headerLength) {
+        return false;
+      }
+      payloadLength = head.readUInt32BE(2) * 0x100000000 + head.readUInt32BE(6);
+    }
+    if (masked) {
+      headerLength += 4;
+    }
+    const frameLength = headerLength + payloadLength;
+
+    if (!fin || rsv || masked || opcode != TEXT_OPCODE) {
+      this._passThroughBytes = frameLength;
+      return true;
+    }
+    if (this._length < frameLength) {
+      return false;
+    }
+    const frame = this._take(frameLength);
+    const message = frame.toString('utf8', headerLength);
+    const filtered = this._limiter.filter(message);
+    if (filtered === message) {
+      this.push(frame);
+    } else if (filtered !== null) {
+      this.push(encodeTextFrame(filtered));
+    }
+    return this._length > 0;
+  }
+}
+
+/**
+ * Filters the messages that a proxied kernel WebSocket sends to the browser.
+ *
+ * Called for the 'proxyReqWs' event of http-proxy, before the upgrade response from Jupyter
+ * arrives. Once it has, http-proxy pipes the Jupyter socket straight into the browser socket;
+ * the pipe is then rerouted through a WebSocketOutputFilter.
+ */
+export function filterProxiedWebSocket(proxyRequest: http.ClientRequest, socket: net.Socket,
+                                       limitBytes: number) {
+  proxyRequest.on('upgrade', function(response: http.IncomingMessage, proxySocket: net.Socket) {
+    process.nextTick(function() {
+      proxySocket.unpipe(socket);
+      proxySocket.pipe(new WebSocketOutputFilter(new KernelOutputLimiter(limitBytes)))
+                 .pipe(socket);
+    });
+  });
+}
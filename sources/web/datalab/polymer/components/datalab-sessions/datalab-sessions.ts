@@ -15,8 +15,10 @@
 /// <reference path="../item-list/item-list.ts" />
 
 interface SessionDescription {
+  cpu: string;
   icon: string;
   kernel: string;
+  memory: string;
   name: string;
 }
 
@@ -39,6 +41,11 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
   @Polymer.decorators.property({type: Array})
   private _sessionList: Session[] = [];
 
+  /**
+   * What each kernel uses, by kernel id. Empty if the backend does not report it.
+   */
+  private _kernelUsage: {[kernelId: string]: KernelUsage} = {};
+
   @Polymer.decorators.property({type: Boolean})
   private _fetching = false;
 
@@ -58,6 +65,12 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
     }, {
       name: 'Kernel',
       type: ColumnTypeName.STRING,
+    }, {
+      name: 'CPU',
+      type: ColumnTypeName.STRING,
+    }, {
+      name: 'Memory',
+      type: ColumnTypeName.STRING,
     }];
 
     const sessionsElement = this.shadowRoot.querySelector('#sessions');
@@ -78,7 +91,8 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
         this._sessionToDescriptionPromise(session)));
     (this.$.sessions as ItemListElement).rows = sessionsDescriptions.map((description) => {
         return new ItemListRow({
-            columns: [description.name, description.kernel],
+            columns: [description.name, description.kernel, description.cpu,
+                      description.memory],
             icon: description.icon,
         });
     });
@@ -95,9 +109,12 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
       : Promise<SessionDescription> {
     if (fileManagerType) {
       const config = FileManagerFactory.getFileManagerConfig(fileManagerType);
+      const usage = this._formatKernelUsage(this._kernelUsage[session.kernel.id]);
       const description: SessionDescription = {
+        cpu: usage.cpu,
         icon: config.displayIcon,
         kernel: session.kernel.name,
+        memory: usage.memory,
         name: session.notebook.path,
       };
       return Promise.resolve(description);
@@ -118,9 +135,12 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
         // On error to get the file object, use the notebook path as is
         .catch(() => id.path)
         .then((fileName: string) => {
+          const usage = this._formatKernelUsage(this._kernelUsage[session.kernel.id]);
           const description: SessionDescription = {
+            cpu: usage.cpu,
             icon: config.displayIcon,
             kernel: session.kernel.name,
+            memory: usage.memory,
             name: fileName,
           };
           return description;
@@ -144,8 +164,16 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
       return;
     }
     this._fetching = true;
-    SessionManager.listSessionsAsync()
-      .then((newList) => {
+    // The usage of kernels is only reported on Datalab backends that serve it, so failing to
+    // get it just leaves the CPU and memory columns empty.
+    const usagePromise = SessionManager.listKernelUsageAsync()
+      .catch(() => [] as KernelUsage[]);
+    Promise.all([SessionManager.listSessionsAsync(), usagePromise])
+      .then(([newList, usageList]) => {
+        const newUsage: {[kernelId: string]: KernelUsage} = {};
+        usageList.forEach((usage) => {
+          newUsage[usage.id] = usage;
+        });
         // Only refresh the UI list if there are any changes. This helps keep
         // the item list's selections intact most of the time
         // TODO: [yebrahim] Try to diff the two lists and only inject the
@@ -153,8 +181,12 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
         // one item changes. This is tricky because we don't have unique
         // ids for the items. Using paths might work for files, but is not
         // a clean solution.
-        if (JSON.stringify(this._sessionList) !== JSON.stringify(newList)) {
+        const formatUsage = (sessions: Session[], usage: {[kernelId: string]: KernelUsage}) =>
+            JSON.stringify(sessions.map((s) => this._formatKernelUsage(usage[s.kernel.id])));
+        if (JSON.stringify(this._sessionList) !== JSON.stringify(newList) ||
+            formatUsage(this._sessionList, this._kernelUsage) !== formatUsage(newList, newUsage)) {
           this._sessionList = newList;
+          this._kernelUsage = newUsage;
           this._drawSessionList();
         }
       })
@@ -166,6 +198,28 @@ class SessionsElement extends Polymer.Element implements DatalabPageElement {
       .then(() => this._fetching = false);
   }
 
+  /**
+   * Formats the CPU and memory used by a kernel, with its memory limit if it has one, and whether
+   * it was killed for running out of memory.
+   */
+  _formatKernelUsage(usage: KernelUsage | undefined) {
+    if (!usage) {
+      return {cpu: '', memory: ''};
+    }
+    const toGB = (bytes: number) => (bytes / (1024 * 1024 * 1024)).toFixed(2) + ' GB';
+    let memory = toGB(usage.memory_bytes);
+    if (usage.memory_limit_bytes) {
+      memory += ' of ' + toGB(usage.memory_limit_bytes);
+    }
+    if (usage.oom_kills) {
+      memory += ' (out of memory)';
+    }
+    return {
+      cpu: usage.cpu_percent === null ? '' : Math.round(usage.cpu_percent) + '%',
+      memory,
+    };
+  }
+
   /**
    * Calls the SessionManager to terminate the selected sessions.
    */
@@ -37,6 +37,7 @@ enum ServiceId {
   BASE_PATH,
   CONTENT,
   CREDENTIALS,
+  KERNEL_USAGE,
   SESSIONS,
   TERMINALS,
   TIMEOUT,
@@ -170,6 +171,8 @@ class ApiManager {
         return '/api/contents';
       case ServiceId.CREDENTIALS:
         return '/api/creds';
+      case ServiceId.KERNEL_USAGE:
+        return '/api/datalab/kernelusage';
       case ServiceId.SESSIONS:
         return '/api/sessions';
       case ServiceId.TERMINALS:
@@ -34,6 +34,17 @@ interface Session {
   };
 }
 
+/**
+ * Represents what a kernel uses, as returned from the kernel usage API.
+ */
+interface KernelUsage {
+  id: string;
+  cpu_percent: number | null;
+  memory_bytes: number;
+  memory_limit_bytes: number | null;
+  oom_kills: number | null;
+}
+
 /**
  * Handles different API calls to the backend's session service.
  */
@@ -70,4 +81,16 @@ class SessionManager {
         xhrOptions) as Promise<Session[]>;
   }
 
+  /**
+   * Returns the CPU and memory used by each running kernel.
+   */
+  public static async listKernelUsageAsync(): Promise<KernelUsage[]> {
+    const xhrOptions: XhrOptions = {
+      noCache: true,
+    };
+    const response = await ApiManager.sendRequestAsync(
+        ApiManager.getServiceUrl(ServiceId.KERNEL_USAGE), xhrOptions);
+    return response.kernels as KernelUsage[];
+  }
+
 }
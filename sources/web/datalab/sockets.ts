@@ -20,9 +20,11 @@
 import http = require('http');
 import jupyter = require('./jupyter');
 import logging = require('./logging');
+import outputLimiter = require('./outputLimiter');
 import path_ = require('path');
 import socketio = require('socket.io');
 import url = require('url');
+import userManager = require('./userManager');
 import util = require('util');
 import WebSocket = require('ws');
 
@@ -31,6 +33,7 @@ interface Session {
   url: string;
   socket: SocketIO.Socket;
   webSocket: WebSocket;
+  outputLimiter: outputLimiter.KernelOutputLimiter;
 }
 
 interface SessionMessage {
@@ -67,6 +70,12 @@ function createWebSocket(port: number, session: Session): WebSocket {
     .on('message', function(data: any) {
       // Propagate messages arriving on the WebSocket to the client.
       logging.getLogger().debug('WebSocket [%d] message: %j', session.id, data);
+      if (session.outputLimiter && typeof data == 'string') {
+        data = session.outputLimiter.filter(data);
+        if (data === null) {
+          return;
+        }
+      }
       session.socket.emit('data', { data: data });
     })
     .on('error', function(e: any) {
@@ -114,7 +123,8 @@ function socketHandler(socket: SocketIO.Socket) {
     id: sessionCounter,
     url: '',
     socket: socket,
-    webSocket: null
+    webSocket: null,
+    outputLimiter: null
   };
 
   logging.getLogger().debug('Socket connected for session %d', session.id);
@@ -132,6 +142,10 @@ function socketHandler(socket: SocketIO.Socket) {
     try {
       var port = jupyter.getPort(socket.request)
       session.url = message.url;
+      var limitBytes = outputLimiter.getCellLimitBytes(userManager.getUserId(socket.request));
+      if (limitBytes && outputLimiter.isKernelChannelsUrl(session.url)) {
+        session.outputLimiter = new outputLimiter.KernelOutputLimiter(limitBytes);
+      }
       session.webSocket = createWebSocket(port, session);
     }
     catch (e) {
@@ -262,6 +262,8 @@ function requestHandler(request: http.ServerRequest, response: http.ServerRespon
     'edit-app.js',
     'datalab.css',
     'idle-timeout.js',
+    'kernel-eviction.js',
+    'dataframe-viewer.js',
     'minitoolbar.js',
     'notebook-app.js',
     'notebook-list.js',
@@ -0,0 +1,141 @@
+define(['base/js/events'], function(events) {
+
+  const commTarget = 'datalab.dataframe';
+  const filterDelay = 500;  // Wait for the user to stop typing before filtering.
+
+  // Incremented whenever a kernel (re)starts, since comms do not survive that.
+  let kernelGeneration = 0;
+
+  function _escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+  }
+
+  // Adds paging, sorting and filtering controls to a DataFrame displayed by
+  // the dataframe_display kernel extension. Pages are fetched from the
+  // kernel over a comm, so only the current page is ever sent to the page.
+  function _enhance(container) {
+    container.classList.add('datalab-dataframe-live');
+    const schema = JSON.parse(container.getAttribute('data-schema'));
+    const pageSize = parseInt(container.getAttribute('data-page-size'), 10);
+    const summary = container.querySelector('.datalab-dataframe-summary');
+    const pageArea = container.querySelector('.datalab-dataframe-page');
+    let state = {page: 0, pages: parseInt(container.getAttribute('data-pages'), 10),
+                 sort: null, filter: null};
+
+    const columnOptions = schema.map((column, i) =>
+        '<option value="' + i + '">' + _escapeHtml(column.name) + '</option>').join('');
+    const controls = document.createElement('div');
+    controls.className = 'datalab-dataframe-controls';
+    controls.innerHTML = `
+      <button class="btn btn-default btn-xs" data-action="prev">&lsaquo; Prev</button>
+      <span class="datalab-dataframe-position"></span>
+      <button class="btn btn-default btn-xs" data-action="next">Next &rsaquo;</button>
+      <label>Sort by <select data-control="sort-column">
+        <option value="">(none)</option>` + columnOptions + `
+      </select></label>
+      <select data-control="sort-order">
+        <option value="asc">ascending</option>
+        <option value="desc">descending</option>
+      </select>
+      <label>Filter <select data-control="filter-column">` + columnOptions + `</select></label>
+      <input type="text" data-control="filter-text" placeholder="contains...">
+      `;
+    container.insertBefore(controls, pageArea);
+    const position = controls.querySelector('.datalab-dataframe-position');
+
+    // The comm is only opened once the user asks for another page, since
+    // most displayed DataFrames are never paged through.
+    let comm = null;
+    let commGeneration;
+
+    function _onReply(msg) {
+      const reply = msg.content.data;
+      if (reply.error) {
+        summary.textContent = reply.error;
+        controls.style.display = 'none';
+        return;
+      }
+      state.page = reply.page;
+      state.pages = reply.pages;
+      pageArea.innerHTML = reply.html;
+      summary.textContent = reply.rows + ' matching rows × ' + schema.length + ' columns';
+      _updatePosition();
+    }
+
+    function _updatePosition() {
+      position.textContent = 'Page ' + (state.page + 1) + ' of ' + state.pages;
+      controls.querySelector('[data-action="prev"]').disabled = (state.page <= 0);
+      controls.querySelector('[data-action="next"]').disabled = (state.page >= state.pages - 1);
+    }
+
+    function _request(page) {
+      const kernel = Jupyter.notebook.kernel;
+      if (!kernel || !kernel.is_connected()) {
+        summary.textContent = 'Connect to a kernel to browse this DataFrame.';
+        return;
+      }
+      if (!comm || commGeneration !== kernelGeneration) {
+        comm = kernel.comm_manager.new_comm(commTarget, {
+          id: container.getAttribute('data-datalab-dataframe'),
+        });
+        comm.on_msg(_onReply);
+        commGeneration = kernelGeneration;
+      }
+      comm.send({page: page, page_size: pageSize, sort: state.sort, filter: state.filter});
+    }
+
+    function _updateQuery() {
+      const sortColumn = controls.querySelector('[data-control="sort-column"]').value;
+      state.sort = (sortColumn === '') ? null : {
+        column: parseInt(sortColumn, 10),
+        ascending: controls.querySelector('[data-control="sort-order"]').value === 'asc',
+      };
+      const filterText = controls.querySelector('[data-control="filter-text"]').value;
+      state.filter = filterText ? {
+        column: parseInt(controls.querySelector('[data-control="filter-column"]').value, 10),
+        text: filterText,
+      } : null;
+      _request(0);
+    }
+
+    controls.querySelector('[data-action="prev"]').onclick = () => _request(state.page - 1);
+    controls.querySelector('[data-action="next"]').onclick = () => _request(state.page + 1);
+    ['sort-column', 'sort-order', 'filter-column'].forEach((name) => {
+      controls.querySelector('[data-control="' + name + '"]').onchange = _updateQuery;
+    });
+    let filterTimeout;
+    const filterInput = controls.querySelector('[data-control="filter-text"]');
+    filterInput.onkeyup = () => {
+      window.clearTimeout(filterTimeout);
+      filterTimeout = window.setTimeout(_updateQuery, filterDelay);
+    };
+    // Keep the notebook's keyboard shortcuts out of the filter box.
+    filterInput.onfocus = () => IPython.keyboard_manager.disable();
+    filterInput.onblur = () => IPython.keyboard_manager.enable();
+    _updatePosition();
+  }
+
+  function _enhanceAll() {
+    document.querySelectorAll('.datalab-dataframe:not(.datalab-dataframe-live)')
+        .forEach(_enhance);
+  }
+
+  // Watches for DataFrames being displayed, both as outputs of running cells
+  // and in outputs loaded with the notebook. Saved outputs can only be paged
+  // through while the kernel that displayed them is still running.
+  function setupDataFrameViewer() {
+    const observer = new MutationObserver(_enhanceAll);
+    observer.observe(document.getElementById('notebook-container') || document.body,
+                     {childList: true, subtree: true});
+    _enhanceAll();
+    events.on('kernel_ready.Kernel', function() {
+      kernelGeneration++;
+    });
+  }
+
+  return {
+    setupDataFrameViewer,
+  };
+});
@@ -0,0 +1,46 @@
+define(['base/js/dialog', 'base/js/events', 'util'], function(dialog, events, util) {
+
+  let alerted = false;
+
+  // Sets an event handler that tells the user when their kernel went away
+  // because it was evicted to free memory.
+  function setupEvictionHandler() {
+    events.on('kernel_connection_failed.Kernel kernel_dead.Kernel', function() {
+      const kernel = Jupyter.notebook && Jupyter.notebook.kernel;
+      if (alerted || !kernel) {
+        return;
+      }
+      const kernelId = kernel.id;
+      util.xhr(util.datalabLink('/api/datalab/evictions'), function() {
+        const evictions = JSON.parse(this.response) || [];  // 'this' is the XHR
+        const eviction = evictions.find((e) => e.kernel_id === kernelId);
+        if (eviction) {
+          _alertEviction(eviction);
+        }
+      });
+    });
+  }
+
+  // Alerts the user that their kernel was shut down to free memory.
+  function _alertEviction(eviction) {
+    util.debug.log('Kernel evicted:');
+    util.debug.log(eviction);
+    alerted = true;  // Don't show this message more than once.
+    const evictionMsg = ('This notebook\'s kernel was idle and was shut down to free ' +
+        eviction.rss_mb + ' MB of memory, because the Datalab instance was running ' +
+        'low on memory. Variables defined in the notebook have been lost.' +
+        '\nUse Kernel > Restart to start a new kernel and rerun your cells. ' +
+        'Closing notebooks you no longer use, or using a larger machine type, ' +
+        'avoids this.');
+    dialog.modal({
+      title: 'Kernel shut down to free memory',
+      body: evictionMsg,
+      buttons: { 'Close': {} },
+      keyboard_manager: IPython.keyboard_manager,
+    });
+  }
+
+  return {
+    setupEvictionHandler,
+  };
+});
@@ -1,4 +1,5 @@
-define(['appbar', 'minitoolbar', 'idle-timeout', 'util'], function(appbar, minitoolbar, idleTimeout, util) {
+define(['appbar', 'minitoolbar', 'idle-timeout', 'kernel-eviction', 'dataframe-viewer', 'util'],
+       function(appbar, minitoolbar, idleTimeout, kernelEviction, dataframeViewer, util) {
   function preLoad(ipy, notebook, promises, dialog, utils) {
     // Various RequireJS additions used for notebook functionality
     requirejs.config({
@@ -145,6 +146,8 @@ define(['appbar', 'minitoolbar', 'idle-timeout', 'util'], function(appbar, minit
     });
 
     idleTimeout.setupKernelBusyHeartbeat();
+    kernelEviction.setupEvictionHandler();
+    dataframeViewer.setupDataFrameViewer();
     $('#mainArea').scroll(idleTimeout.notebookScrolled);
 
     promises.notebook_loaded.then(function() {
@@ -0,0 +1,84 @@
+/*
+ * Copyright 2018 Google Inc. All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+ * in compliance with the License. You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software distributed under the License
+ * is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+ * or implied. See the License for the specific language governing permissions and limitations under
+ * the License.
+ */
+
+const fs = require('fs');
+const httpMocks = require('node-mocks-http');
+
+const BASE = '../../build/web/nb/';
+const info = require(BASE + 'info');
+
+describe('Unit tests', function() {
+describe('info', function() {
+
+  let response;
+  let savedStatusFile;
+  beforeEach(function() {
+    response = httpMocks.createResponse();
+    savedStatusFile = process.env['DATALAB_DOCS_STATUS_FILE'];
+    process.env['DATALAB_DOCS_STATUS_FILE'] = '/fake/docs-status.json';
+  });
+
+  afterEach(function() {
+    if (savedStatusFile === undefined) {
+      delete process.env['DATALAB_DOCS_STATUS_FILE'];
+    } else {
+      process.env['DATALAB_DOCS_STATUS_FILE'] = savedStatusFile;
+    }
+  });
+
+  it('returns a handler', function() {
+    expect(info.createHandler({})).not.toBeNull();
+  });
+
+  it('reports the container startup phases', function() {
+    process.env['DATALAB_STARTUP_REPORT'] = '/fake/startup-report.json';
+    spyOn(fs, 'readFileSync').and.returnValue(
+        '{"startTimeMs": 1000, "phases": [{"name": "vm_metadata", "offsetMs": 5, "durationMs": 20}]}');
+    const request = httpMocks.createRequest({
+      method: 'GET',
+      url: 'http://foo/_info/startup',
+    });
+    info.createHandler({})(request, response);
+    delete process.env['DATALAB_STARTUP_REPORT'];
+    expect(response.statusCode).toEqual(200);
+    const report = JSON.parse(response._getData());
+    expect(report.startTimeMs).toEqual(1000);
+    expect(report.phases[0].name).toEqual('vm_metadata');
+    expect(report.serverStartTimeMs).toBeGreaterThan(0);
+  });
+
+  it('reports the docs sync status', function() {
+    spyOn(fs, 'readFileSync').and.returnValue('{"state": "succeeded", "revision": "abc"}');
+    const request = httpMocks.createRequest({
+      method: 'GET',
+      url: 'http://foo/_info/docs',
+    });
+    info.createHandler({})(request, response);
+    expect(response.statusCode).toEqual(200);
+    expect(response._isEndCalled()).toBe(true);
+    expect(JSON.parse(response._getData())).toEqual({state: 'succeeded', revision: 'abc'});
+  });
+
+  it('reports a pending docs sync before the status is written', function() {
+    spyOn(fs, 'readFileSync').and.throwError('ENOENT');
+    expect(info.getDocsStatus()).toEqual({state: 'pending'});
+  });
+
+  it('reports an unknown docs sync status outside of the container', function() {
+    delete process.env['DATALAB_DOCS_STATUS_FILE'];
+    expect(info.getDocsStatus()).toEqual({state: 'unknown'});
+  });
+
+});
+});
@@ -0,0 +1,144 @@
+/*
+ * Copyright 2018 Google Inc. All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+ * in compliance with the License. You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software distributed under the License
+ * is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+ * or implied. See the License for the specific language governing permissions and limitations under
+ * the License.
+ */
+
+const BASE = '../../build/web/nb/';
+const outputLimiter = require(BASE + 'outputLimiter');
+
+function kernelMessage(msgType, parentId, content) {
+  return JSON.stringify({
+    channel: 'iopub',
+    msg_type: msgType,
+    header: {msg_type: msgType},
+    parent_header: {msg_id: parentId},
+    content: content,
+    metadata: {},
+  });
+}
+
+function streamMessage(parentId, text) {
+  return kernelMessage('stream', parentId, {name: 'stdout', text: text});
+}
+
+// Splits the output of a WebSocketOutputFilter back into opcodes and payloads.
+function decodeFrames(buffer) {
+  const frames = [];
+  let offset = 0;
+  while (offset < buffer.length) {
+    let length = buffer[offset + 1] & 0x7f;
+    let headerLength = 2;
+    if (length == 126) {
+      length = buffer.readUInt16BE(offset + 2);
+      headerLength = 4;
+    } else if (length == 127) {
+      length = buffer.readUInt32BE(offset + 6);
+      headerLength = 10;
+    }
+    frames.push({
+      opcode: buffer[offset] & 0x0f,
+      payload: buffer.slice(offset + headerLength, offset + headerLength + length),
+    });
+    offset += headerLength + length;
+  }
+  return frames;
+}
+
+describe('Unit tests', function() {
+describe('outputLimiter', function() {
+
+  describe('KernelOutputLimiter', () => {
+    it('passes output under the limit through unchanged', () => {
+      const limiter = new outputLimiter.KernelOutputLimiter(1000);
+      const message = streamMessage('a', 'hello');
+      expect(limiter.filter(message)).toBe(message);
+    });
+
+    it('replaces the first message over the limit with a notice and drops the rest', () => {
+      const limiter = new outputLimiter.KernelOutputLimiter(1000);
+      const message = streamMessage('a', 'x'.repeat(300));
+      expect(limiter.filter(message)).toBe(message);
+      expect(limiter.filter(message)).toBe(message);
+      const notice = JSON.parse(limiter.filter(message));
+      expect(notice.msg_type).toBe('stream');
+      expect(notice.content.name).toBe('stderr');
+      expect(notice.content.text).toContain('outputProxyCellLimitMB');
+      expect(limiter.filter(message)).toBeNull();
+    });
+
+    it('counts the output of each cell separately', () => {
+      const limiter = new outputLimiter.KernelOutputLimiter(1000);
+      const message = streamMessage('a', 'x'.repeat(800));
+      expect(limiter.filter(message)).toBe(message);
+      const other = streamMessage('b', 'x'.repeat(800));
+      expect(limiter.filter(other)).toBe(other);
+    });
+
+    it('forgets the output of a cell once it is done', () => {
+      const limiter = new outputLimiter.KernelOutputLimiter(1000);
+      const message = streamMessage('a', 'x'.repeat(800));
+      limiter.filter(message);
+      const idle = kernelMessage('status', 'a', {execution_state: 'idle'});
+      expect(limiter.filter(idle)).toBe(idle);
+      expect(limiter.filter(message)).toBe(message);
+    });
+
+    it('passes through messages that are not output', () => {
+      const limiter = new outputLimiter.KernelOutputLimiter(10);
+      const reply = kernelMessage('execute_reply', 'a', {status: 'ok'});
+      expect(limiter.filter(reply)).toBe(reply);
+      expect(limiter.filter('not json')).toBe('not json');
+    });
+  });
+
+  describe('WebSocketOutputFilter', () => {
+    it('filters text frames split across chunks and passes other frames', (done) => {
+      const filter = new outputLimiter.WebSocketOutputFilter(
+          new outputLimiter.KernelOutputLimiter(1000));
+      const chunks = [];
+      filter.on('data', (chunk) => chunks.push(chunk));
+      filter.on('end', () => {
+        const frames = decodeFrames(Buffer.concat(chunks));
+        expect(frames.length).toBe(4);
+        expect(frames[0].payload.toString()).toBe(small);
+        expect(frames[1].opcode).toBe(2);
+        expect(JSON.parse(frames[2].payload.toString()).content.name).toBe('stderr');
+        expect(frames[3].payload.toString()).toBe(idle);
+        done();
+      });
+
+      const small = streamMessage('a', 'hello');
+      const large = streamMessage('a', 'x'.repeat(70000));
+      const idle = kernelMessage('status', 'a', {execution_state: 'idle'});
+      const input = Buffer.concat([
+        outputLimiter.encodeTextFrame(small),
+        new Buffer([0x82, 0x03, 1, 2, 3]),
+        outputLimiter.encodeTextFrame(large),
+        outputLimiter.encodeTextFrame(large),
+        outputLimiter.encodeTextFrame(idle),
+      ]);
+      for (let offset = 0; offset < input.length; offset += 1000) {
+        filter.write(input.slice(offset, offset + 1000));
+      }
+      filter.end();
+    });
+  });
+
+  describe('isKernelChannelsUrl', () => {
+    it('matches kernel channels but not terminals', () => {
+      expect(outputLimiter.isKernelChannelsUrl(
+          '/api/kernels/0a1b-2c3d/channels?session_id=e4f5')).toBe(true);
+      expect(outputLimiter.isKernelChannelsUrl('/terminals/websocket/1')).toBe(false);
+    });
+  });
+});
+});
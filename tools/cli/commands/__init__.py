@@ -14,6 +14,8 @@
 
 from __future__ import absolute_import
 
-from . import create, creategpu, connect, list, stop, delete, utils
+from . import bakeimage, create, creategpu, connect, daemon, fleet, infracache
+from . import list, restore, run, stop, delete, sync, utils
 
-__all__ = [create, creategpu, connect, list, stop, delete, utils]
+__all__ = [bakeimage, create, creategpu, connect, daemon, fleet, infracache,
+           list, restore, run, stop, delete, sync, utils]
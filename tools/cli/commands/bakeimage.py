@@ -0,0 +1,329 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Methods for implementing the `datalab bake-image` command."""
+
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import create, utils
+
+
+description = ("""`{0} {1}` builds a Google Compute Engine boot image with a
+Datalab container image already downloaded.
+
+Instances normally boot a stock Container-Optimized OS image and then
+download the multi-gigabyte Datalab container image before they can
+serve notebooks. Instances created with `{0} create --boot-image-family`
+using an image built by this command skip that download.
+
+The image is built by starting a temporary VM, pulling the container
+image on it, and then creating a boot image from its disk. The new boot
+image is added to the given image family, so rerun this command to pick
+up a newer Datalab release.""")
+
+
+examples = ("""
+Build a boot image in the family `datalab-baked` using the latest
+Datalab release:
+    $ {0} {1} datalab-baked
+
+Then create an instance that uses it:
+    $ {0} create --boot-image-family datalab-baked my-instance""")
+
+
+_BUILDER_NAME_TEMPLATE = 'datalab-image-builder-{0}'
+_IMAGE_NAME_TEMPLATE = '{0}-{1}'
+_IMAGE_DESCRIPTION_TEMPLATE = 'Container-Optimized OS with {0} preloaded'
+
+_BUILD_MARKER = 'datalab-bake-image'
+_DEFAULT_TIMEOUT_SECONDS = 30 * 60
+_POLL_INTERVAL_SECONDS = 10
+
+# The startup script for the builder VM. It pulls the container image
+# and records it in the list of baked images that the startup script of
+# `datalab create` checks before pulling. The outcome is written to the
+# serial console, which we poll.
+_BUILDER_STARTUP_SCRIPT = """#!/bin/bash
+
+# /root/.docker is not writable, so keep the Docker credentials elsewhere.
+mkdir -p /tmp/datalab-bake-image
+export HOME=/tmp/datalab-bake-image
+
+if docker-credential-gcr configure-docker && docker pull {0}; then
+  image_id=$(docker image inspect --format '{{{{.Id}}}}' {0})
+  mkdir -p $(dirname {1})
+  echo "{0} ${{image_id}}" >> {1}
+  sync
+  echo "{2}: succeeded ${{image_id}}" > /dev/ttyS0
+else
+  echo "{2}: failed" > /dev/ttyS0
+fi
+"""
+
+
+class BakeImageFailedException(Exception):
+
+    _MESSAGE = (
+        'Failed to download {0} on the builder VM {1}. Rerun with '
+        '--keep-builder and check its serial port output for details.')
+
+    def __init__(self, image_name, builder):
+        super(BakeImageFailedException, self).__init__(
+            BakeImageFailedException._MESSAGE.format(image_name, builder))
+
+
+class BakeImageTimeoutException(Exception):
+
+    _MESSAGE = (
+        'Timed out after {0} seconds waiting for the builder VM {1} to '
+        'download {2}.')
+
+    def __init__(self, timeout_seconds, builder, image_name):
+        super(BakeImageTimeoutException, self).__init__(
+            BakeImageTimeoutException._MESSAGE.format(
+                timeout_seconds, builder, image_name))
+
+
+def flags(parser):
+    """Add command line flags for the `bake-image` subcommand.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
+    parser.add_argument(
+        'family',
+        metavar='FAMILY',
+        help='the image family to which to add the new boot image')
+    parser.add_argument(
+        '--image-name',
+        dest='image_name',
+        default='gcr.io/cloud-datalab/datalab:latest',
+        help=(
+            'name of the Datalab image to preload.'
+            '\n\n'
+            'If not specified, this defaults to the most recently\n'
+            'published image.'))
+    parser.add_argument(
+        '--machine-type',
+        dest='machine_type',
+        default='n1-standard-1',
+        help='the machine type of the temporary builder VM.')
+    parser.add_argument(
+        '--network-name',
+        dest='network_name',
+        default=create._DATALAB_NETWORK,
+        help='name of the network to which the builder VM is attached.')
+    parser.add_argument(
+        '--timeout-seconds',
+        type=int,
+        dest='timeout_seconds',
+        default=_DEFAULT_TIMEOUT_SECONDS,
+        help='how long to wait for the builder VM to download the image.')
+    parser.add_argument(
+        '--keep-builder',
+        dest='keep_builder',
+        action='store_true',
+        default=False,
+        help='do not delete the builder VM, e.g. for troubleshooting.')
+    return
+
+
+def create_builder(args, gcloud_compute, builder):
+    """Create the temporary VM that downloads the container image.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      builder: The name of the VM to create
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    print('Creating the builder VM {0}'.format(builder))
+    with tempfile.NamedTemporaryFile(mode='w', delete=False) \
+            as startup_script_file:
+        try:
+            startup_script_file.write(_BUILDER_STARTUP_SCRIPT.format(
+                args.image_name, create._DATALAB_BAKED_IMAGES_FILE,
+                _BUILD_MARKER))
+            startup_script_file.close()
+            cmd = ['instances', 'create']
+            if args.zone:
+                cmd.extend(['--zone', args.zone])
+            cmd.extend([
+                '--format=none',
+                '--boot-disk-size=20GB',
+                '--network', args.network_name,
+                '--image-family', 'cos-stable',
+                '--image-project', 'cos-cloud',
+                '--machine-type', args.machine_type,
+                '--metadata-from-file',
+                'startup-script={0}'.format(startup_script_file.name),
+                '--scopes', 'cloud-platform',
+                builder])
+            utils.call_gcloud_quietly(args, gcloud_compute, cmd)
+        finally:
+            os.remove(startup_script_file.name)
+    return
+
+
+def get_build_status(args, gcloud_compute, builder):
+    """Check the serial port output of the builder for the build outcome.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      builder: The name of the builder VM
+    Returns:
+      'succeeded', 'failed', or None if the build is still in progress.
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    cmd = ['instances', 'get-serial-port-output', '--quiet']
+    if args.zone:
+        cmd.extend(['--zone', args.zone])
+    cmd.append(builder)
+    with tempfile.TemporaryFile() as stdout, \
+            tempfile.TemporaryFile() as stderr:
+        try:
+            gcloud_compute(args, cmd, stdout=stdout, stderr=stderr)
+            stdout.seek(0)
+            output = stdout.read().decode('utf-8', 'replace')
+        except subprocess.CalledProcessError:
+            stderr.seek(0)
+            sys.stderr.write(stderr.read().decode('utf-8'))
+            raise
+    for line in output.splitlines():
+        if _BUILD_MARKER + ': succeeded' in line:
+            return 'succeeded'
+        if _BUILD_MARKER + ': failed' in line:
+            return 'failed'
+    return None
+
+
+def wait_for_build(args, gcloud_compute, builder):
+    """Wait for the builder VM to finish downloading the container image.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      builder: The name of the builder VM
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+      BakeImageFailedException: If the download failed
+      BakeImageTimeoutException: If the download did not finish in time
+    """
+    print('Waiting for {0} to download {1}'.format(builder, args.image_name))
+    deadline = time.time() + args.timeout_seconds
+    while time.time() < deadline:
+        status = get_build_status(args, gcloud_compute, builder)
+        if status == 'succeeded':
+            return
+        if status == 'failed':
+            raise BakeImageFailedException(args.image_name, builder)
+        time.sleep(_POLL_INTERVAL_SECONDS)
+    raise BakeImageTimeoutException(
+        args.timeout_seconds, builder, args.image_name)
+
+
+def create_image(args, gcloud_compute, builder, image):
+    """Stop the builder VM and create a boot image from its disk.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      builder: The name of the builder VM
+      image: The name of the boot image to create
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    stop_cmd = ['instances', 'stop']
+    if args.zone:
+        stop_cmd.extend(['--zone', args.zone])
+    utils.call_gcloud_quietly(args, gcloud_compute, stop_cmd + [builder])
+
+    print('Creating the boot image {0} in the family {1}'.format(
+        image, args.family))
+    image_cmd = [
+        'images', 'create', image,
+        '--family', args.family,
+        '--source-disk', builder,
+        '--description',
+        _IMAGE_DESCRIPTION_TEMPLATE.format(args.image_name)]
+    if args.zone:
+        image_cmd.extend(['--source-disk-zone', args.zone])
+    utils.call_gcloud_quietly(args, gcloud_compute, image_cmd)
+    return
+
+
+def delete_builder(args, gcloud_compute, builder):
+    """Delete the builder VM, reporting but ignoring any failure.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      builder: The name of the builder VM
+    """
+    if utils.print_info_messages(args):
+        print('Deleting the builder VM {0}'.format(builder))
+    delete_cmd = ['instances', 'delete', '--delete-disks', 'all']
+    if args.zone:
+        delete_cmd.extend(['--zone', args.zone])
+    try:
+        utils.call_gcloud_quietly(
+            args, gcloud_compute, delete_cmd + [builder])
+    except subprocess.CalledProcessError:
+        print('Failed to delete the builder VM {0}; you can delete it by '
+              'running `gcloud compute instances delete {0}`'.format(builder))
+    return
+
+
+def run(args, gcloud_compute, gcloud_zone=None, **unused_kwargs):
+    """Implementation of the `datalab bake-image` subcommand.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      gcloud_zone: The zone that gcloud is configured to use
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    if not args.zone:
+        args.zone = gcloud_zone
+    if (not args.zone) and (not args.quiet):
+        args.zone = utils.prompt_for_zone(args, gcloud_compute)
+
+    create.ensure_network_exists(args, gcloud_compute, args.network_name)
+
+    timestamp = int(time.time())
+    builder = _BUILDER_NAME_TEMPLATE.format(timestamp)
+    # Image names are limited to 63 characters.
+    image = _IMAGE_NAME_TEMPLATE.format(args.family[:52], timestamp)
+    create_builder(args, gcloud_compute, builder)
+    try:
+        wait_for_build(args, gcloud_compute, builder)
+        create_image(args, gcloud_compute, builder, image)
+    finally:
+        if not args.keep_builder:
+            delete_builder(args, gcloud_compute, builder)
+
+    print('Created the boot image {0}. To use it, run:\n'
+          '    datalab create --boot-image-family {1} NAME'.format(
+              image, args.family))
+    return
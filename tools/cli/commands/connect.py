@@ -137,6 +137,22 @@ def connection_flags(parser):
             'maximum number of times to reconnect.'
             '\n\n'
             'A negative value means no limit.'))
+    tunnel_flags(parser)
+    parser.add_argument(
+        '--no-launch-browser',
+        dest='no_launch_browser',
+        action='store_true',
+        default=False,
+        help='do not open a browser connected to Datalab')
+    return
+
+
+def tunnel_flags(parser):
+    """Add flags common to every subcommand that creates an SSH tunnel.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
     parser.add_argument(
         '--connection-health-timeout-seconds',
         dest='connection_health_timeout_seconds',
@@ -159,12 +175,6 @@ def connection_flags(parser):
             'The default log level is "error".'
             '\n\n'
             'This has no effect when run on Windows.'))
-    parser.add_argument(
-        '--no-launch-browser',
-        dest='no_launch_browser',
-        action='store_true',
-        default=False,
-        help='do not open a browser connected to Datalab')
     parser.add_argument(
         '--beta-internal-ip',
         dest='internal_ip',
@@ -177,6 +187,72 @@ def connection_flags(parser):
     return
 
 
+def create_tunnel(args, gcloud_compute, instance, port):
+    """Create an SSH tunnel to a Datalab instance.
+
+    Args:
+      args: The Namespace object constructed by argparse
+      gcloud_compute: A function that can be called to invoke `gcloud compute`
+      instance: The name of the instance
+      port: The local port on which Datalab is to be accessible
+    Returns:
+      A subprocess.Popen object for the SSH tunnel, which runs for as long
+      as the connection is open.
+    """
+    if utils.print_debug_messages(args):
+        print('Connecting to {0} via SSH'.format(instance))
+
+    cmd = ['ssh']
+    if args.zone:
+        cmd.extend(['--zone', args.zone])
+    port_mapping = 'localhost:' + str(port) + ':localhost:8080'
+    if os.name == 'posix':
+        # The '-o' flag is not supported by all SSH clients (notably,
+        # PuTTY does not support it). To avoid any potential issues
+        # with it, we only add that flag when we believe it will
+        # be supported. In particular, checking for an os name of
+        # 'posix' works for both Linux and Mac OSX, which do support
+        # that flag.
+        cmd.extend([
+            '--ssh-flag=-o',
+            '--ssh-flag=LogLevel=' + args.ssh_log_level])
+    cmd.extend([
+        '--ssh-flag=-4',
+        '--ssh-flag=-N',
+        '--ssh-flag=-L',
+        '--ssh-flag=' + port_mapping])
+    cmd.append('datalab@{0}'.format(instance))
+    if args.internal_ip:
+        cmd.extend(['--internal-ip'])
+    return gcloud_compute(args, cmd, wait=False)
+
+
+def wait_for_tunnel(tunnel_process, datalab_address, timeout_secs):
+    """Wait for a Datalab instance to be reachable via an SSH tunnel.
+
+    Args:
+      tunnel_process: A subprocess.Popen object for the SSH tunnel
+      datalab_address: The local URL of Datalab, ending in a slash
+      timeout_secs: Amount of time (in seconds) to wait for the connection
+        to become healthy before giving up.
+    Returns:
+      True iff the instance became reachable, as opposed to the tunnel
+      closing or the time running out.
+    """
+    start_time = time.time()
+    health_url = '{0}_info/'.format(datalab_address)
+    while tunnel_process.poll() is None:
+        try:
+            health_resp = urlopen(health_url)
+            if health_resp.getcode() == 200:
+                return True
+        except Exception:
+            if (time.time() - start_time) > timeout_secs:
+                return False
+            time.sleep(0.5)
+    return False
+
+
 def connect(args, gcloud_compute, email, in_cloud_shell):
     """Create a persistent connection to a Datalab instance.
 
@@ -198,41 +274,6 @@ def connect(args, gcloud_compute, email, in_cloud_shell):
     datalab_port = args.port
     datalab_address = 'http://localhost:{0}/'.format(str(datalab_port))
 
-    def create_tunnel():
-        """Create an SSH tunnel to the Datalab instance.
-
-        This method blocks for as long as the connection is open.
-
-        Raises:
-          KeyboardInterrupt: When the end user kills the connection
-        """
-        if utils.print_debug_messages(args):
-            print('Connecting to {0} via SSH').format(instance)
-
-        cmd = ['ssh']
-        if args.zone:
-            cmd.extend(['--zone', args.zone])
-        port_mapping = 'localhost:' + str(args.port) + ':localhost:8080'
-        if os.name == 'posix':
-            # The '-o' flag is not supported by all SSH clients (notably,
-            # PuTTY does not support it). To avoid any potential issues
-            # with it, we only add that flag when we believe it will
-            # be supported. In particular, checking for an os name of
-            # 'posix' works for both Linux and Mac OSX, which do support
-            # that flag.
-            cmd.extend([
-                '--ssh-flag=-o',
-                '--ssh-flag=LogLevel=' + args.ssh_log_level])
-        cmd.extend([
-            '--ssh-flag=-4',
-            '--ssh-flag=-N',
-            '--ssh-flag=-L',
-            '--ssh-flag=' + port_mapping])
-        cmd.append('datalab@{0}'.format(instance))
-        if args.internal_ip:
-            cmd.extend(['--internal-ip'])
-        return gcloud_compute(args, cmd, wait=False)
-
     def maybe_open_browser(address):
         """Try to open a browser if we reasonably can."""
         try:
@@ -268,22 +309,14 @@ def connect(args, gcloud_compute, email, in_cloud_shell):
           timeout_secs: Amount of time (in seconds) to wait for the connection
             to become healthy before giving up and killing it.
         """
-        start_time = time.clock()
-        health_url = '{0}_info/'.format(datalab_address)
         print('Waiting for Datalab to be reachable at ' + datalab_address)
-        while tunnel_process.poll() is None:
-            try:
-                health_resp = urlopen(health_url)
-                if health_resp.getcode() == 200:
-                    healthy_event.set()
-                    on_ready()
-                    return
-            except Exception:
-                if (time.clock() - start_time) > timeout_secs:
-                    print('Timeout waiting for the connection to become '
-                          'healthy. Trying again with a new connection...')
-                    tunnel_process.terminate()
-                    return
+        if wait_for_tunnel(tunnel_process, datalab_address, timeout_secs):
+            healthy_event.set()
+            on_ready()
+        elif tunnel_process.poll() is None:
+            print('Timeout waiting for the connection to become '
+                  'healthy. Trying again with a new connection...')
+            tunnel_process.terminate()
         return
 
     def connect_and_check(healthy_event, timeout_secs):
@@ -301,7 +334,8 @@ def connect(args, gcloud_compute, email, in_cloud_shell):
         Raises:
           KeyboardInterrupt: If the user kills the connection.
         """
-        tunnel_process = create_tunnel()
+        tunnel_process = create_tunnel(
+            args, gcloud_compute, instance, datalab_port)
         health_check(tunnel_process, healthy_event, timeout_secs)
         tunnel_process.wait()
         print('Connection closed')
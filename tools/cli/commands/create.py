@@ -21,8 +21,9 @@ import os
 import subprocess
 import sys
 import tempfile
+import time
 
-from . import connect, utils
+from . import connect, fleet, infracache, utils
 
 try:
     # If we are running in Python 2, builtins is available in 'future'.
@@ -40,7 +41,17 @@ This command also creates the 'datalab-network' network if necessary.
 
 By default, the command creates a persistent connection to the newly
 created instance. You can disable that behavior by passing in the
-'--no-connect' flag.""")
+'--no-connect' flag.
+
+Multiple instances with the same settings can be created at once by
+passing either the '--manifest' flag or the '--count' and '--name-prefix'
+flags instead of an instance name. The network, firewall and repository
+checks are then run once, and the instances are created concurrently.
+
+The notebooks disk of the new instance can be copied from an existing
+instance or snapshot by passing the '--from-instance' or '--from-snapshot'
+flag, so that previously cloned notebooks, downloaded datasets and
+installed packages are available immediately.""")
 
 
 _DATALAB_NETWORK = 'datalab-network'
@@ -62,11 +73,16 @@ _DATALAB_NO_FIREWALL_WARNING = (
 )
 
 _DATALAB_DEFAULT_DISK_SIZE_GB = 200
+_DATALAB_CLONE_SNAPSHOT_TEMPLATE = '{0}-clone-{1}'
 _DATALAB_DISK_DESCRIPTION = (
     'Persistent disk for a Google Cloud Datalab instance')
 
 _DATALAB_NOTEBOOKS_REPOSITORY = 'datalab-notebooks'
 
+# Boot images built by `datalab bake-image` list the container images that
+# they preloaded in this file. The startup script below reads it directly.
+_DATALAB_BAKED_IMAGES_FILE = '/var/lib/datalab/baked-images'
+
 _DATALAB_STARTUP_SCRIPT = """#!/bin/bash
 
 # First, make sure the `datalab` and `logger` users exist with their
@@ -85,6 +101,7 @@ chown -R logger /home/logger
 PERSISTENT_DISK_DEV="/dev/disk/by-id/google-datalab-pd"
 MOUNT_DIR="/mnt/disks/datalab-pd"
 MOUNT_CMD="mount -o discard,defaults ${{PERSISTENT_DISK_DEV}} ${{MOUNT_DIR}}"
+CGROUPS_ENV_FILE="/run/datalab/cgroups.env"
 
 download_docker_image() {{
   # Since /root/.docker is not writable on the default image,
@@ -94,11 +111,26 @@ download_docker_image() {{
   export HOME=/home/datalab
   echo "Getting Docker credentials"
   docker-credential-gcr configure-docker
-  echo "Pulling latest image: {0}"
-  docker pull {0}
+  if image_is_baked; then
+    echo "Using the preloaded image: {0}"
+  else
+    echo "Pulling latest image: {0}"
+    docker pull {0}
+  fi
   export HOME=$OLD_HOME
 }}
 
+image_is_baked() {{
+  # Boot images built by `datalab bake-image` record the ID of each
+  # image they preloaded. Skip the pull if that image is still present.
+  baked_id=$(awk -v image="{0}" \
+    '$1 == image {{ id = $2 }} END {{ print id }}' \
+    /var/lib/datalab/baked-images 2>/dev/null)
+  [ -n "${{baked_id}}" ] && \
+    [ "$(docker image inspect --format '{{{{.Id}}}}' {0} 2>/dev/null)" \
+      == "${{baked_id}}" ]
+}}
+
 clone_repo() {{
   echo "Creating the datalab directory"
   mkdir -p ${{MOUNT_DIR}}/content/datalab
@@ -215,6 +247,93 @@ configure_swap() {{
   swapon "${{swapfile}}"
 }}
 
+configure_cgroups_v1() {{
+  for controller in cpu memory; do
+    mkdir -p "/sys/fs/cgroup/${{controller}}/datalab"
+  done
+  # Limits on the kernels must also cover the cgroups of each kernel.
+  echo 1 > /sys/fs/cgroup/memory/datalab/memory.use_hierarchy
+  for controller in cpu memory; do
+    mkdir -p "/sys/fs/cgroup/${{controller}}/datalab/server" \
+      "/sys/fs/cgroup/${{controller}}/datalab/kernels"
+  done
+  echo 1024 > /sys/fs/cgroup/cpu/datalab/server/cpu.shares
+  echo `expr 1024 "*" ${{kernel_cores}}` \
+    > /sys/fs/cgroup/cpu/datalab/kernels/cpu.shares
+  echo ${{kernel_memory}} \
+    > /sys/fs/cgroup/memory/datalab/kernels/memory.limit_in_bytes
+}}
+
+configure_cgroups_v2() {{
+  # There is a single hierarchy, in which a cgroup only has the controllers
+  # that its parent enables for its children.
+  echo "+cpu +memory" > /sys/fs/cgroup/cgroup.subtree_control
+  mkdir -p /sys/fs/cgroup/datalab/server /sys/fs/cgroup/datalab/kernels
+  for group in datalab datalab/server datalab/kernels; do
+    echo "+cpu +memory" > "/sys/fs/cgroup/${{group}}/cgroup.subtree_control"
+  done
+  # Weights range from 1 to 10000, and default to 100.
+  kernel_weight=`expr 100 "*" ${{kernel_cores}}`
+  if [ "${{kernel_weight}}" -gt 10000 ]; then
+    kernel_weight=10000
+  fi
+  echo 100 > /sys/fs/cgroup/datalab/server/cpu.weight
+  echo ${{kernel_weight}} > /sys/fs/cgroup/datalab/kernels/cpu.weight
+  echo ${{kernel_memory}} > /sys/fs/cgroup/datalab/kernels/memory.max
+}}
+
+configure_cgroups() {{
+  # Run the Datalab container and the kernels in separate cgroups, so that
+  # a busy kernel cannot starve the web server or the other kernels. The
+  # server keeps a tenth of the memory, between 512 MB and 2 GB, and half
+  # a core under contention on machines with one core, or a core
+  # otherwise. The kernels share the rest: Jupyter puts each one in a
+  # cgroup of its own under `kernels`, which the container gets as volumes.
+  #
+  # The Docker flags for this are passed to datalab.service in
+  # ${{CGROUPS_ENV_FILE}}, and only once the cgroups are set up, so that
+  # otherwise the container and the kernels run as they would without.
+  mkdir -p `dirname "${{CGROUPS_ENV_FILE}}"`
+  rm -f "${{CGROUPS_ENV_FILE}}"
+  memory_kb=`awk '/^MemTotal:/ {{ print $2 }}' /proc/meminfo`
+  reserved_kb=`expr ${{memory_kb}} / 10`
+  if [ "${{reserved_kb}}" -lt 524288 ]; then
+    reserved_kb=524288
+  elif [ "${{reserved_kb}}" -gt 2097152 ]; then
+    reserved_kb=2097152
+  fi
+  cores=`nproc`
+  kernel_cores=`expr ${{cores}} - 1`
+  if [ "${{kernel_cores}}" -lt 1 ]; then
+    kernel_cores=1
+  fi
+  kernel_memory=`expr "(" ${{memory_kb}} - ${{reserved_kb}} ")" "*" 1024`
+
+  # The kernel manager moves each kernel out of the container's cgroup,
+  # which with cgroup v2 it may only do in the host's cgroup namespace.
+  if [ -f /sys/fs/cgroup/cgroup.controllers ]; then
+    ( set -e; configure_cgroups_v2 )
+    status=$?
+    cgroup_args="--cgroupns=host --cgroup-parent=/datalab/server"
+    volume="/sys/fs/cgroup/datalab/kernels:/datalab/cgroups/unified"
+    cgroup_args="${{cgroup_args}} -v ${{volume}}"
+  else
+    ( set -e; configure_cgroups_v1 )
+    status=$?
+    cgroup_args="--cgroup-parent=/datalab/server"
+    for controller in cpu memory; do
+      volume="/sys/fs/cgroup/${{controller}}/datalab/kernels"
+      volume="${{volume}}:/datalab/cgroups/${{controller}}"
+      cgroup_args="${{cgroup_args}} -v ${{volume}}"
+    done
+  fi
+  if [ "${{status}}" -eq 0 ]; then
+    echo "DATALAB_CGROUP_ARGS=${{cgroup_args}}" > "${{CGROUPS_ENV_FILE}}"
+  else
+    echo "Failed to set up the cgroups of the kernels"
+  fi
+}}
+
 cleanup_tmp() {{
   tmpdir="${{MOUNT_DIR}}/tmp"
 
@@ -231,6 +350,7 @@ cleanup_tmp() {{
   find "${{tmpdir}}/" -mindepth 1 -delete
 }}
 
+configure_cgroups
 download_docker_image
 mount_and_prepare_disk
 configure_swap
@@ -281,9 +401,11 @@ write_files:
 
     [Service]
     Environment="HOME=/home/datalab"
+    EnvironmentFile=-/run/datalab/cgroups.env
     ExecStartPre=/usr/bin/docker-credential-gcr configure-docker
     ExecStart=/usr/bin/docker run --rm -u 0 \
        --name=datalab \
+       $DATALAB_CGROUP_ARGS \
        -p 127.0.0.1:8080:8080 \
        -v /mnt/disks/datalab-pd/content:/content \
        -v /mnt/disks/datalab-pd/tmp:/tmp \
@@ -432,6 +554,28 @@ class PrivateIpGoogleAccessException(Exception):
                 subnet_name, region))
 
 
+class NoNotebooksDiskException(Exception):
+
+    _MESSAGE = (
+        'The instance {0} does not have a notebooks disk attached, '
+        'so there is nothing to copy.')
+
+    def __init__(self, instance_name):
+        super(NoNotebooksDiskException, self).__init__(
+            NoNotebooksDiskException._MESSAGE.format(instance_name))
+
+
+class DiskExistsException(Exception):
+
+    _MESSAGE = (
+        'The disk {0} already exists, so it cannot be created as a copy. '
+        'Delete it, or choose another disk with --disk-name.')
+
+    def __init__(self, disk_name):
+        super(DiskExistsException, self).__init__(
+            DiskExistsException._MESSAGE.format(disk_name))
+
+
 class CancelledException(Exception):
 
     _MESSAGE = 'Operation cancelled.'
@@ -449,7 +593,13 @@ def flags(parser):
     parser.add_argument(
         'instance',
         metavar='NAME',
-        help='a name for the newly created instance')
+        nargs='?',
+        default=None,
+        help=(
+            'a name for the newly created instance.'
+            '\n\n'
+            'This is required unless either --manifest or --count\n'
+            'is specified.'))
     parser.add_argument(
         '--image-name',
         dest='image_name',
@@ -472,8 +622,34 @@ def flags(parser):
         '--disk-size-gb',
         type=int,
         dest='disk_size_gb',
-        default=_DATALAB_DEFAULT_DISK_SIZE_GB,
-        help='size of the persistent disk in GB.')
+        default=None,
+        help=(
+            'size of the persistent disk in GB.'
+            '\n\n'
+            'If not specified, this defaults to {0}GB, or to the size of\n'
+            'the source disk when using --from-instance or\n'
+            '--from-snapshot.'.format(_DATALAB_DEFAULT_DISK_SIZE_GB)))
+
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument(
+        '--from-instance',
+        dest='from_instance',
+        default=None,
+        help=(
+            'name of an existing Datalab instance whose notebooks disk\n'
+            'is copied to the new instance.'
+            '\n\n'
+            'The copy includes the notebooks, datasets and installed\n'
+            'packages stored on the source disk. The source instance\n'
+            'must be in the same zone as the new instance, and may keep\n'
+            'running while the copy is made.'))
+    source_group.add_argument(
+        '--from-snapshot',
+        dest='from_snapshot',
+        default=None,
+        help=(
+            'name of a snapshot of a notebooks disk from which to create\n'
+            'the disk of the new instance.'))
     parser.add_argument(
         '--network-name',
         dest='network_name',
@@ -496,6 +672,26 @@ def flags(parser):
             'using those names or d, h, m and s, for example "1h 30m".\n'
             'Specify 0s to disable.'))
 
+    parser.add_argument(
+        '--boot-image-family',
+        dest='boot_image_family',
+        default=None,
+        help=(
+            'image family of the boot image for the instance.'
+            '\n\n'
+            'Boot images built by `datalab bake-image` have the Datalab\n'
+            'image preloaded, which shortens the instance startup. If not\n'
+            'specified, the latest Container-Optimized OS image is used.'))
+    parser.add_argument(
+        '--boot-image-project',
+        dest='boot_image_project',
+        default=None,
+        help=(
+            'project containing the --boot-image-family.'
+            '\n\n'
+            'If not specified, this defaults to the project of the\n'
+            'instance.'))
+
     parser.add_argument(
         '--machine-type',
         dest='machine_type',
@@ -593,6 +789,8 @@ def flags(parser):
               'If not provided, the instance will get project\'s default '
               'service account.'))
 
+    fleet.fleet_flags(parser)
+    infracache.cache_flags(parser)
     connect.connection_flags(parser)
     return
 
@@ -856,38 +1054,52 @@ def get_firewall_args(args, network_name):
     return args
 
 
-def create_disk(args, gcloud_compute, disk_name):
+def create_disk(args, gcloud_compute, disk_name, report_errors=True,
+                source_snapshot=None):
     """Create the user's persistent disk.
 
     Args:
       args: The Namespace returned by argparse
       gcloud_compute: Function that can be used for invoking `gcloud compute`
       disk_name: The name of the persistent disk to create
+      report_errors: Whether or not to report errors to the user
+      source_snapshot: The name of a snapshot from which to create the disk
     Raises:
       subprocess.CalledProcessError: If the `gcloud` command fails
     """
     if utils.print_info_messages(args):
-        print('Creating the disk {0}'.format(disk_name))
+        if source_snapshot:
+            print('Creating the disk {0} from the snapshot {1}'.format(
+                disk_name, source_snapshot))
+        else:
+            print('Creating the disk {0}'.format(disk_name))
     create_cmd = ['disks', 'create']
     if args.zone:
         create_cmd.extend(['--zone', args.zone])
+    disk_size_gb = args.disk_size_gb
+    if source_snapshot:
+        create_cmd.extend(['--source-snapshot', source_snapshot])
+    elif not disk_size_gb:
+        disk_size_gb = _DATALAB_DEFAULT_DISK_SIZE_GB
+    if disk_size_gb:
+        create_cmd.extend(['--size', str(disk_size_gb) + 'GB'])
     create_cmd.extend([
-        '--size', str(args.disk_size_gb) + 'GB',
         '--description', _DATALAB_DISK_DESCRIPTION,
         disk_name])
-    utils.call_gcloud_quietly(args, gcloud_compute, create_cmd)
+    utils.call_gcloud_quietly(
+        args, gcloud_compute, create_cmd, report_errors=report_errors)
     return
 
 
-def ensure_disk_exists(args, gcloud_compute, disk_name):
-    """Create the given persistent disk if it does not already exist.
+def disk_exists(args, gcloud_compute, disk_name):
+    """Check whether the given persistent disk exists.
 
     Args:
       args: The Namespace returned by argparse
       gcloud_compute: Function that can be used for invoking `gcloud compute`
       disk_name: The name of the persistent disk
-    Raises:
-      subprocess.CalledProcessError: If the `gcloud` command fails
+    Returns:
+      True if the disk exists, and False otherwise
     """
     get_cmd = [
         'disks', 'describe', disk_name, '--format', 'value(name)']
@@ -897,10 +1109,126 @@ def ensure_disk_exists(args, gcloud_compute, disk_name):
         utils.call_gcloud_quietly(
             args, gcloud_compute, get_cmd, report_errors=False)
     except subprocess.CalledProcessError:
-        create_disk(args, gcloud_compute, disk_name)
+        return False
+    return True
+
+
+def ensure_disk_exists(args, gcloud_compute, disk_name, report_errors=True,
+                       source_snapshot=None):
+    """Create the given persistent disk if it does not already exist.
+
+    Args:
+      args: The Namespace returned by argparse
+      gcloud_compute: Function that can be used for invoking `gcloud compute`
+      disk_name: The name of the persistent disk
+      report_errors: Whether or not to report errors to the user
+      source_snapshot: The name of a snapshot from which to create the disk
+    Raises:
+      subprocess.CalledProcessError: If the `gcloud` command fails
+      DiskExistsException: If the disk was to be created from a snapshot
+        but already exists
+    """
+    if not disk_exists(args, gcloud_compute, disk_name):
+        create_disk(args, gcloud_compute, disk_name,
+                    report_errors=report_errors,
+                    source_snapshot=source_snapshot)
+    elif source_snapshot:
+        raise DiskExistsException(disk_name)
     return
 
 
+def snapshot_instance_disk(args, gcloud_compute, instance):
+    """Snapshot the notebooks disk of an existing instance.
+
+    Args:
+      args: The Namespace returned by argparse
+      gcloud_compute: Function that can be used for invoking `gcloud compute`
+      instance: The name of the instance whose disk to snapshot
+    Returns:
+      The name of the newly created snapshot
+    Raises:
+      subprocess.CalledProcessError: If a `gcloud` command fails
+      NoNotebooksDiskException: If the instance has no notebooks disk
+    """
+    disk_cfg = utils.instance_notebook_disk(args, gcloud_compute, instance)
+    if not disk_cfg:
+        raise NoNotebooksDiskException(instance)
+    disk_name = disk_cfg['source'].split('/')[-1]
+    # Snapshot names are limited to 63 characters.
+    snapshot_name = _DATALAB_CLONE_SNAPSHOT_TEMPLATE.format(
+        disk_name[:48], int(time.time()))
+    if utils.print_info_messages(args):
+        print('Creating the snapshot {0} of the disk {1}'.format(
+            snapshot_name, disk_name))
+    snapshot_cmd = ['disks', 'snapshot', disk_name,
+                    '--snapshot-names', snapshot_name]
+    if args.zone:
+        snapshot_cmd.extend(['--zone', args.zone])
+    utils.call_gcloud_quietly(args, gcloud_compute, snapshot_cmd)
+    return snapshot_name
+
+
+def delete_snapshot(args, gcloud_compute, snapshot_name):
+    """Delete the given snapshot, reporting but ignoring any failure.
+
+    Args:
+      args: The Namespace returned by argparse
+      gcloud_compute: Function that can be used for invoking `gcloud compute`
+      snapshot_name: The name of the snapshot to delete
+    """
+    if utils.print_debug_messages(args):
+        print('Deleting the snapshot {0}'.format(snapshot_name))
+    try:
+        utils.call_gcloud_quietly(
+            args, gcloud_compute, ['snapshots', 'delete', snapshot_name])
+    except subprocess.CalledProcessError:
+        print('Failed to delete the temporary snapshot {0}; you can delete '
+              'it by running `gcloud compute snapshots delete {0}`'.format(
+                  snapshot_name))
+    return
+
+
+def prepare_source_snapshot(args, gcloud_compute):
+    """Determine the snapshot (if any) from which to create new disks.
+
+    Args:
+      args: The Namespace returned by argparse
+      gcloud_compute: Function that can be used for invoking `gcloud compute`
+    Returns:
+      A tuple of the snapshot name (or None) and whether the snapshot was
+      created for this invocation and should be deleted afterwards.
+    Raises:
+      subprocess.CalledProcessError: If a `gcloud` command fails
+      NoNotebooksDiskException: If the source instance has no notebooks disk
+    """
+    if getattr(args, 'from_instance', None):
+        return (snapshot_instance_disk(
+            args, gcloud_compute, args.from_instance), True)
+    return (getattr(args, 'from_snapshot', None), False)
+
+
+def check_clone_disks(args, gcloud_compute, instances_args):
+    """Check that the disks to be created as copies do not exist yet.
+
+    This runs before the source disk is snapshotted, so that nothing is
+    snapshotted for disks that would then not be created.
+
+    Args:
+      args: The Namespace returned by argparse
+      gcloud_compute: Function that can be used for invoking `gcloud compute`
+      instances_args: The Namespaces of the instances to create
+    Raises:
+      DiskExistsException: If one of the disks already exists
+    """
+    if not (getattr(args, 'from_instance', None) or
+            getattr(args, 'from_snapshot', None)):
+        return
+    for instance_args in instances_args:
+        disk_name = instance_disk_name(instance_args)
+        if disk_exists(args, gcloud_compute, disk_name):
+            raise DiskExistsException(disk_name)
+
+
 def create_repo(args, gcloud_repos, repo_name):
     """Create the given repository.
 
@@ -944,74 +1272,166 @@ def ensure_repo_exists(args, gcloud_repos, repo_name):
                 raise RepositoryException(repo_name)
 
 
-def prepare(args, gcloud_compute, gcloud_repos):
-    """Run preparation steps for VM creation.
+def prepare_project(args, gcloud_compute, gcloud_repos, cache=None):
+    """Run the preparation steps shared by every VM in a project and zone.
+
+    This checks (and if necessary creates) the network, firewall rule,
+    subnet and notebooks repository used by the new instances.
 
     Args:
       args: The Namespace instance returned by argparse
       gcloud_compute: Function that can be used to invoke `gcloud compute`
       gcloud_repos: Function that can be used to invoke
         `gcloud source repos`
-    Returns:
-      The disk config
+      cache: The InfraCache holding previously verified facts, if any
     Raises:
       subprocess.CalledProcessError: If a nested `gcloud` calls fails
     """
+    cache = cache or infracache.InfraCache(None)
     network_name = args.network_name
-    ensure_network_exists(args, gcloud_compute, network_name)
+    if not cache.get(infracache.network_key(network_name)):
+        ensure_network_exists(args, gcloud_compute, network_name)
+        cache.put(infracache.network_key(network_name))
     if args.no_firewall_rule:
         print(_DATALAB_NO_FIREWALL_WARNING)
     else:
         prompt_on_unexpected_firewall_rules(args, gcloud_compute, network_name)
-        ensure_firewall_rule_exists(args, gcloud_compute, network_name)
+        if not cache.get(infracache.firewall_rule_key(network_name)):
+            ensure_firewall_rule_exists(args, gcloud_compute, network_name)
+            cache.put(infracache.firewall_rule_key(network_name))
 
-    disk_name = args.disk_name or '{0}-pd'.format(args.instance)
-    ensure_disk_exists(args, gcloud_compute, disk_name)
-    disk_cfg = (
-        'auto-delete=no,boot=no,device-name=datalab-pd,mode=rw,name=' +
-        disk_name)
-    region = get_region_name(args, gcloud_compute)
+    region = cache.get(infracache.region_key(args.zone))
+    if not region:
+        region = get_region_name(args, gcloud_compute)
+        if args.zone and region:
+            cache.put(infracache.region_key(args.zone), region)
 
     if args.subnet_name:
-        ensure_subnet_exists(args, gcloud_compute, region, args.subnet_name)
+        subnet_key = infracache.subnet_key(region, args.subnet_name)
+        if not cache.get(subnet_key):
+            ensure_subnet_exists(
+                args, gcloud_compute, region, args.subnet_name)
+            cache.put(subnet_key)
 
     if args.no_external_ip:
-        subnet_name = args.subnet_name or get_subnet_name(
-            args, gcloud_compute, network_name, region)
-        ensure_private_ip_google_access(
-            args, gcloud_compute, subnet_name, region)
+        subnet_name_key = infracache.subnet_name_key(network_name, region)
+        subnet_name = args.subnet_name or cache.get(subnet_name_key)
+        if not subnet_name:
+            subnet_name = get_subnet_name(
+                args, gcloud_compute, network_name, region)
+            cache.put(subnet_name_key, subnet_name)
+        access_key = infracache.private_ip_google_access_key(
+            region, subnet_name)
+        if not cache.get(access_key):
+            ensure_private_ip_google_access(
+                args, gcloud_compute, subnet_name, region)
+            cache.put(access_key)
 
     if not args.no_create_repository:
-        ensure_repo_exists(args, gcloud_repos, _DATALAB_NOTEBOOKS_REPOSITORY)
+        repo_key = infracache.repo_key(_DATALAB_NOTEBOOKS_REPOSITORY)
+        if not cache.get(repo_key):
+            ensure_repo_exists(
+                args, gcloud_repos, _DATALAB_NOTEBOOKS_REPOSITORY)
+            cache.put(repo_key)
+    return
 
-    return disk_cfg
 
+def instance_disk_name(args):
+    """Get the name of the notebooks disk of the instance being created.
+
+    Args:
+      args: The Namespace instance returned by argparse
+    Returns:
+      The name of the disk
+    """
+    return args.disk_name or '{0}-pd'.format(args.instance)
 
-def run(args, gcloud_compute, gcloud_repos,
-        email='', in_cloud_shell=False, gcloud_zone=None,
-        sdk_version='UNKNOWN', datalab_version='UNKNOWN', **kwargs):
-    """Implementation of the `datalab create` subcommand.
+
+def prepare_disk(args, gcloud_compute, report_errors=True,
+                 source_snapshot=None):
+    """Ensure that the notebooks disk for a single VM exists.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      report_errors: Whether or not to report errors to the user
+      source_snapshot: The name of a snapshot from which to create the
+        disk if it does not already exist
+    Returns:
+      The disk config
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+      DiskExistsException: If the disk was to be created from a snapshot
+        but already exists
+    """
+    disk_name = instance_disk_name(args)
+    ensure_disk_exists(args, gcloud_compute, disk_name,
+                       report_errors=report_errors,
+                       source_snapshot=source_snapshot)
+    return (
+        'auto-delete=no,boot=no,device-name=datalab-pd,mode=rw,name=' +
+        disk_name)
+
+
+def prepare(args, gcloud_compute, gcloud_repos, cache=None):
+    """Run preparation steps for VM creation.
 
     Args:
       args: The Namespace instance returned by argparse
       gcloud_compute: Function that can be used to invoke `gcloud compute`
       gcloud_repos: Function that can be used to invoke
         `gcloud source repos`
+      cache: The InfraCache holding previously verified facts, if any
+    Returns:
+      The disk config
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    prepare_project(args, gcloud_compute, gcloud_repos, cache=cache)
+    check_clone_disks(args, gcloud_compute, [args])
+    source_snapshot, temporary = prepare_source_snapshot(args, gcloud_compute)
+    try:
+        return prepare_disk(
+            args, gcloud_compute, source_snapshot=source_snapshot)
+    finally:
+        if temporary:
+            delete_snapshot(args, gcloud_compute, source_snapshot)
+
+
+def boot_image_args(args):
+    """Get the `gcloud compute instances create` flags for the boot image.
+
+    Args:
+      args: The Namespace instance returned by argparse
+    Returns:
+      A list of command line flags
+    """
+    if not args.boot_image_family:
+        return ['--image-family', 'cos-stable', '--image-project', 'cos-cloud']
+    image_args = ['--image-family', args.boot_image_family]
+    if args.boot_image_project:
+        image_args.extend(['--image-project', args.boot_image_project])
+    return image_args
+
+
+def create_instance(args, gcloud_compute, disk_cfg, email='',
+                    sdk_version='UNKNOWN', datalab_version='UNKNOWN',
+                    quietly=False):
+    """Create the Datalab VM.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      disk_cfg: The config of the notebooks disk to attach
       email: The user's email address
-      in_cloud_shell: Whether or not the command is being run in the
-        Google Cloud Shell
-      gcloud_zone: The zone that gcloud is configured to use
       sdk_version: The version of the Cloud SDK being used
       datalab_version: The version of the datalab CLI being used
+      quietly: Whether to capture the output of `gcloud` rather than
+        passing it through to the user. Errors are then not reported;
+        the captured output is attached to the raised exception instead.
     Raises:
       subprocess.CalledProcessError: If a nested `gcloud` calls fails
     """
-    if (not args.zone) and (not args.disk_name):
-        args.zone = gcloud_zone
-    if (not args.zone) and (not args.quiet):
-        args.zone = utils.prompt_for_zone(args, gcloud_compute)
-    disk_cfg = prepare(args, gcloud_compute, gcloud_repos)
-
     print('Creating the instance {0}'.format(args.instance))
     cmd = ['instances', 'create']
     if args.zone:
@@ -1076,9 +1496,8 @@ def run(args, gcloud_compute, gcloud_repos,
             cmd.extend([
                 '--format=none',
                 '--boot-disk-size=20GB',
-                '--network', args.network_name,
-                '--image-family', 'cos-stable',
-                '--image-project', 'cos-cloud',
+                '--network', args.network_name] +
+                boot_image_args(args) + [
                 '--machine-type', args.machine_type,
                 '--metadata-from-file', metadata_from_file,
                 '--tags', 'datalab',
@@ -1088,7 +1507,11 @@ def run(args, gcloud_compute, gcloud_repos,
                 args.instance])
             if args.no_external_ip:
                 cmd.extend(['--no-address'])
-            gcloud_compute(args, cmd)
+            if quietly:
+                utils.call_gcloud_quietly(
+                    args, gcloud_compute, cmd, report_errors=False)
+            else:
+                gcloud_compute(args, cmd)
         finally:
             os.remove(startup_script_file.name)
             os.remove(user_data_file.name)
@@ -1096,6 +1519,123 @@ def run(args, gcloud_compute, gcloud_repos,
             os.remove(os_login_file.name)
             os.remove(sdk_version_file.name)
             os.remove(datalab_version_file.name)
+    return
+
+
+def create_fleet(args, gcloud_compute, gcloud_repos, email='',
+                 sdk_version='UNKNOWN', datalab_version='UNKNOWN',
+                 cache=None):
+    """Create multiple Datalab VMs that share the same settings.
+
+    The project-level preparation is run once, after which the disk
+    and VM of each instance are created concurrently. Requests that are
+    rejected because of rate limits are retried with exponential backoff.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      gcloud_repos: Function that can be used to invoke
+        `gcloud source repos`
+      email: The user's email address
+      sdk_version: The version of the Cloud SDK being used
+      datalab_version: The version of the datalab CLI being used
+      cache: The InfraCache holding previously verified facts, if any
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+        during the shared preparation
+      fleet.FleetCreationException: If any of the instances could not
+        be created
+    """
+    instance_args = [fleet.args_for_instance(args, overrides)
+                     for overrides in fleet.instance_overrides(args)]
+    start = time.time()
+    prepare_project(args, gcloud_compute, gcloud_repos, cache=cache)
+    check_clone_disks(args, gcloud_compute, instance_args)
+    source_snapshot, temporary = prepare_source_snapshot(args, gcloud_compute)
+
+    def create_one(instance_args):
+        disk_cfg = fleet.call_with_backoff(
+            lambda: prepare_disk(
+                instance_args, gcloud_compute, report_errors=False,
+                source_snapshot=source_snapshot),
+            args.max_retries)
+        fleet.call_with_backoff(
+            lambda: create_instance(
+                instance_args, gcloud_compute, disk_cfg, email=email,
+                sdk_version=sdk_version, datalab_version=datalab_version,
+                quietly=True),
+            args.max_retries)
+
+    print('Creating {0} instances'.format(len(instance_args)))
+    try:
+        results = fleet.create_all(
+            instance_args, create_one, args.parallelism)
+    finally:
+        if temporary:
+            delete_snapshot(args, gcloud_compute, source_snapshot)
+    fleet.print_report(results, time.time() - start)
+
+    failed = len([r for r in results if not r.succeeded])
+    if failed:
+        if cache:
+            cache.invalidate()
+        raise fleet.FleetCreationException(failed, len(results))
+    return
+
+
+def run(args, gcloud_compute, gcloud_repos,
+        email='', in_cloud_shell=False, gcloud_zone=None,
+        gcloud_project=None, sdk_version='UNKNOWN',
+        datalab_version='UNKNOWN', **kwargs):
+    """Implementation of the `datalab create` subcommand.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      gcloud_repos: Function that can be used to invoke
+        `gcloud source repos`
+      email: The user's email address
+      in_cloud_shell: Whether or not the command is being run in the
+        Google Cloud Shell
+      gcloud_zone: The zone that gcloud is configured to use
+      gcloud_project: The project that gcloud is configured to use
+      sdk_version: The version of the Cloud SDK being used
+      datalab_version: The version of the datalab CLI being used
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    if fleet.is_fleet(args):
+        # Validate the flags before prompting for anything.
+        fleet.instance_overrides(args)
+    elif not args.instance:
+        raise fleet.InvalidFleetFlagsException(
+            'specify an instance NAME, --manifest, or --count')
+
+    if (not args.zone) and (not args.disk_name):
+        args.zone = gcloud_zone
+    if (not args.zone) and (not args.quiet):
+        args.zone = utils.prompt_for_zone(args, gcloud_compute)
+
+    cache = infracache.for_args(args, gcloud_project)
+    if fleet.is_fleet(args):
+        create_fleet(args, gcloud_compute, gcloud_repos, email=email,
+                     sdk_version=sdk_version, datalab_version=datalab_version,
+                     cache=cache)
+        if not args.no_connect:
+            print('To connect to one of the new instances, run '
+                  '`datalab connect NAME`')
+        return
+
+    disk_cfg = prepare(args, gcloud_compute, gcloud_repos, cache=cache)
+    try:
+        create_instance(
+            args, gcloud_compute, disk_cfg, email=email,
+            sdk_version=sdk_version, datalab_version=datalab_version)
+    except subprocess.CalledProcessError:
+        # The failure may have been caused by a stale cache entry, so
+        # verify everything again next time.
+        cache.invalidate()
+        raise
 
     if (not args.no_connect) and (not args.for_user):
         if args.no_external_ip:
@@ -18,9 +18,10 @@ from __future__ import absolute_import
 
 import json
 import os
+import subprocess
 import tempfile
 
-from . import create, connect, utils
+from . import create, connect, fleet, infracache, utils
 
 
 description = ("""`{0} {1}` creates a new Datalab instance running in a Google
@@ -124,8 +125,10 @@ write_files:
 
     [Service]
     Environment="HOME=/home/datalab"
+    EnvironmentFile=-/run/datalab/cgroups.env
     ExecStartPre=docker-credential-gcr configure-docker
     ExecStart=/usr/bin/docker run --restart always \
+       $DATALAB_CGROUP_ARGS \
        -p '127.0.0.1:8080:8080' \
        -v /mnt/disks/datalab-pd/content:/content \
        -v /mnt/disks/datalab-pd/tmp:/tmp \
@@ -261,7 +264,8 @@ def flags(parser):
 
 def run(args, gcloud_beta_compute, gcloud_repos,
         email='', in_cloud_shell=False, gcloud_zone=None,
-        sdk_version='UNKNOWN', datalab_version='UNKNOWN', **kwargs):
+        gcloud_project=None, sdk_version='UNKNOWN',
+        datalab_version='UNKNOWN', **kwargs):
     """Implementation of the `datalab create` subcommand.
 
     Args:
@@ -273,11 +277,18 @@ def run(args, gcloud_beta_compute, gcloud_repos,
       in_cloud_shell: Whether or not the command is being run in the
         Google Cloud Shell
       gcloud_zone: The zone that gcloud is configured to use
+      gcloud_project: The project that gcloud is configured to use
       sdk_version: The version of the Cloud SDK being used
       datalab_version: The version of the datalab CLI being used
     Raises:
       subprocess.CalledProcessError: If a nested `gcloud` calls fails
     """
+    if fleet.is_fleet(args):
+        raise fleet.InvalidFleetFlagsException(
+            '--manifest and --count are not supported for GPU instances')
+    if not args.instance:
+        raise fleet.InvalidFleetFlagsException('specify an instance NAME')
+
     if not utils.prompt_for_confirmation(
             args=args,
             message=_THIRD_PARTY_SOFTWARE_DIALOG,
@@ -290,7 +301,9 @@ def run(args, gcloud_beta_compute, gcloud_repos,
         args.zone = gcloud_zone
     if (not args.zone) and (not args.quiet):
         args.zone = utils.prompt_for_zone(args, gcloud_beta_compute)
-    disk_cfg = create.prepare(args, gcloud_beta_compute, gcloud_repos)
+    cache = infracache.for_args(args, gcloud_project)
+    disk_cfg = create.prepare(
+        args, gcloud_beta_compute, gcloud_repos, cache=cache)
 
     print('Creating the instance {0}'.format(args.instance))
     print('\n\nDue to GPU Driver installation, please note that '
@@ -366,9 +379,8 @@ def run(args, gcloud_beta_compute, gcloud_repos,
             cmd.extend([
                 '--format=none',
                 '--boot-disk-size=20GB',
-                '--network', args.network_name,
-                '--image-family', 'cos-stable',
-                '--image-project', 'cos-cloud',
+                '--network', args.network_name] +
+                create.boot_image_args(args) + [
                 '--machine-type', args.machine_type,
                 '--accelerator',
                 'type=' + args.accelerator_type + ',count='
@@ -382,7 +394,11 @@ def run(args, gcloud_beta_compute, gcloud_repos,
                 args.instance])
             if args.no_external_ip:
                 cmd.extend(['--no-address'])
-            gcloud_beta_compute(args, cmd)
+            try:
+                gcloud_beta_compute(args, cmd)
+            except subprocess.CalledProcessError:
+                cache.invalidate()
+                raise
         finally:
             os.remove(startup_script_file.name)
             os.remove(user_data_file.name)
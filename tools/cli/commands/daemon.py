@@ -0,0 +1,582 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Methods for implementing the `datalab daemon` command."""
+
+from __future__ import absolute_import
+
+import array
+import errno
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+from . import utils
+
+
+description = ("""`{0} {1}` runs a long-lived server that executes other
+`{0}` commands on behalf of the command line tool.
+
+Every invocation of `{0}` normally has to look up the installed
+Cloud SDK version, the active account, and the default zone before
+it can do any real work. While the daemon is running, it resolves
+that information once (refreshing it periodically, and whenever the
+gcloud configuration changes) and the regular
+`{0}` command transparently forwards its arguments to the daemon over
+a Unix domain socket.
+
+Forwarded commands read from and write to the caller's terminal, so
+interactive prompts and `{0} connect` behave exactly as they do
+without the daemon.
+
+The daemon runs in the foreground until it is killed or until
+`{0} {1} --stop` is run. To bypass a running daemon for a single
+command, set the DATALAB_NO_DAEMON environment variable.
+
+This command is only supported on Linux and Mac OS X.""")
+
+
+examples = ("""
+To start the daemon in the background:
+
+    $ nohup {0} {1} > ~/datalab-daemon.log 2>&1 &
+
+To check whether the daemon is running:
+
+    $ {0} {1} --status
+
+To stop the daemon:
+
+    $ {0} {1} --stop
+""")
+
+
+_SOCKET_HELP = ("""path of the Unix domain socket used by the daemon.
+
+If not specified, this defaults to the DATALAB_DAEMON_SOCKET
+environment variable, or to 'daemon.sock' in the datalab
+configuration directory.""")
+
+
+_CONTEXT_TTL_HELP = ("""number of seconds for which the resolved gcloud context
+(Cloud SDK version, active account, and default zone) is reused
+before it is looked up again.""")
+
+
+_DEFAULT_CONTEXT_TTL_SECONDS = 300
+
+# Environment variables that influence how gcloud resolves its
+# configuration. Forwarded requests that differ in any of these get
+# their own cached context.
+_CONTEXT_ENV_PREFIXES = ('CLOUDSDK_',)
+_CONTEXT_ENV_NAMES = ('HOME', 'DEVSHELL_CLIENT_PORT')
+
+_GCLOUD_DEFAULT_CONFIG_NAME = 'default'
+
+_ACTION_PING = 'ping'
+_ACTION_RUN = 'run'
+_ACTION_STOP = 'stop'
+
+# The standard input, output, and error of the forwarding client are
+# passed along with every `run` request.
+_FORWARDED_FDS = (0, 1, 2)
+_MAX_HEADER_BYTES = 1024 * 1024
+
+
+class DaemonNotSupportedException(Exception):
+
+    _MESSAGE = (
+        'The `datalab daemon` command requires Python 3 running on '
+        'Linux or Mac OS X.')
+
+    def __init__(self):
+        super(DaemonNotSupportedException, self).__init__(
+            DaemonNotSupportedException._MESSAGE)
+
+
+class DaemonAlreadyRunningException(Exception):
+
+    _MESSAGE = 'A datalab daemon is already listening on {}.'
+
+    def __init__(self, socket_path):
+        super(DaemonAlreadyRunningException, self).__init__(
+            DaemonAlreadyRunningException._MESSAGE.format(socket_path))
+
+
+def flags(parser):
+    """Add command line flags for the `daemon` subcommand.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
+    parser.add_argument(
+        '--socket',
+        dest='socket_path',
+        default=None,
+        help=_SOCKET_HELP)
+    parser.add_argument(
+        '--context-ttl-seconds',
+        dest='context_ttl_seconds',
+        type=int,
+        default=_DEFAULT_CONTEXT_TTL_SECONDS,
+        help=_CONTEXT_TTL_HELP)
+
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument(
+        '--stop',
+        dest='stop',
+        action='store_true',
+        default=False,
+        help='stop a running daemon')
+    action.add_argument(
+        '--status',
+        dest='status',
+        action='store_true',
+        default=False,
+        help='report whether or not a daemon is running')
+    return
+
+
+def is_supported():
+    """Return whether or not the daemon can be used on this platform."""
+    return (os.name == 'posix' and hasattr(socket, 'AF_UNIX') and
+            hasattr(socket.socket, 'sendmsg'))
+
+
+def socket_path(path=None):
+    """Get the path of the daemon's Unix domain socket.
+
+    Args:
+      path: An explicitly requested path, if any.
+    Returns:
+      The path of the socket.
+    """
+    return (path or os.environ.get('DATALAB_DAEMON_SOCKET') or
+            os.path.join(utils.config_dir(), 'daemon.sock'))
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _gcloud_config_state(env):
+    """Identify the gcloud configuration that the given environment uses.
+
+    `gcloud config set`, `gcloud config configurations activate` and
+    `gcloud auth login` all rewrite files in the configuration directory,
+    so the modification times of those files tell when the project, zone
+    or account may have changed.
+
+    Returns:
+      A tuple of the name of the active configuration and the modification
+      times of the configuration directory and of its files.
+    """
+    config_dir = env.get('CLOUDSDK_CONFIG') or os.path.join(
+        env.get('HOME') or os.path.expanduser('~'), '.config', 'gcloud')
+    active_config_path = os.path.join(config_dir, 'active_config')
+    name = env.get('CLOUDSDK_ACTIVE_CONFIG_NAME')
+    if not name:
+        try:
+            with open(active_config_path) as f:
+                name = f.read().strip()
+        except (IOError, OSError):
+            pass
+    name = name or _GCLOUD_DEFAULT_CONFIG_NAME
+    config_path = os.path.join(
+        config_dir, 'configurations', 'config_{}'.format(name))
+    return (name, _mtime(config_dir), _mtime(active_config_path),
+            _mtime(config_path))
+
+
+def _context_key(env):
+    """Reduce the given environment to the parts that affect gcloud."""
+    return tuple(sorted(
+        (name, value) for name, value in env.items()
+        if name.startswith(_CONTEXT_ENV_PREFIXES) or
+        name in _CONTEXT_ENV_NAMES)) + _gcloud_config_state(env)
+
+
+def _connect(path):
+    """Connect to the daemon listening on the given path.
+
+    Returns:
+      A connected socket, or None if no daemon is listening.
+    """
+    if not os.path.exists(path):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except socket.error:
+        conn.close()
+        return None
+    return conn
+
+
+def _read_line(conn, initial=b''):
+    """Read a single newline-terminated JSON message from the socket."""
+    data = initial
+    while b'\n' not in data:
+        chunk = conn.recv(4096)
+        if not chunk:
+            return None
+        data += chunk
+        if len(data) > _MAX_HEADER_BYTES:
+            return None
+    return json.loads(data.split(b'\n', 1)[0].decode('utf-8'))
+
+
+def _send_line(conn, message):
+    conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _terminal_fd():
+    """Return the first of the standard fds that is a terminal, if any."""
+    for fd in _FORWARDED_FDS:
+        if os.isatty(fd):
+            return fd
+    return None
+
+
+def _is_foreground(fd):
+    """Return whether this process is in the foreground of a terminal."""
+    try:
+        return os.tcgetpgrp(fd) == os.getpgrp()
+    except OSError:
+        return False
+
+
+def _set_foreground(fd, pgid):
+    """Make a process group the foreground process group of a terminal.
+
+    Only processes in the foreground group can read from a terminal
+    without being stopped, which matters when the daemon was started from
+    the same terminal as the client (e.g. with `nohup ... &`). This does
+    nothing if the terminal is not our controlling terminal.
+    """
+    old_handler = signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+    try:
+        os.tcsetpgrp(fd, pgid)
+    except OSError:
+        pass
+    finally:
+        signal.signal(signal.SIGTTOU, old_handler)
+
+
+def _request(path, message):
+    """Send a control message to the daemon and return its reply."""
+    conn = _connect(path)
+    if conn is None:
+        return None
+    try:
+        _send_line(conn, message)
+        return _read_line(conn)
+    finally:
+        conn.close()
+
+
+def forward(argv, path=None):
+    """Forward a command line to the running daemon, if there is one.
+
+    This blocks until the forwarded command completes. The daemon runs
+    the command with this process's standard input, output, and error.
+
+    Args:
+      argv: The command line arguments, excluding the program name
+      path: The path of the daemon's socket
+    Returns:
+      The exit code of the forwarded command, or None if the command
+      could not be forwarded.
+    """
+    if (not is_supported()) or os.environ.get('DATALAB_NO_DAEMON'):
+        return None
+    try:
+        conn = _connect(socket_path(path))
+    except OSError:
+        return None
+    if conn is None:
+        return None
+    terminal = _terminal_fd()
+    foreground = terminal is not None and _is_foreground(terminal)
+    try:
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        header = json.dumps({
+            'action': _ACTION_RUN,
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+            'foreground': foreground,
+        }).encode('utf-8') + b'\n'
+        fds = array.array('i', _FORWARDED_FDS)
+        try:
+            conn.sendmsg([header], [
+                (socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())])
+        except socket.error:
+            return None
+
+        # From here on the daemon owns the command, so we must not
+        # fall back to running it locally.
+        reply = None
+        interrupted = False
+        while reply is None:
+            try:
+                reply = _read_line(conn) or {'returncode': 1}
+            except KeyboardInterrupt:
+                if interrupted:
+                    raise
+                # Closing our side of the connection tells the daemon to
+                # interrupt the command; we then wait for it to finish.
+                interrupted = True
+                conn.shutdown(socket.SHUT_WR)
+            except socket.error:
+                reply = {'returncode': 1}
+        if reply.get('error'):
+            sys.stderr.write(
+                'The datalab daemon failed to run the command: {}\n'.format(
+                    reply['error']))
+        return reply.get('returncode', 1)
+    finally:
+        conn.close()
+        if foreground:
+            # The command may have taken over the terminal.
+            _set_foreground(terminal, os.getpgrp())
+
+
+def _receive_request(conn):
+    """Read a request and any file descriptors passed along with it."""
+    fd_size = array.array('i').itemsize
+    data, ancdata, unused_flags, unused_addr = conn.recvmsg(
+        4096, socket.CMSG_LEN(len(_FORWARDED_FDS) * fd_size))
+    fds = array.array('i')
+    for level, kind, payload in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            usable = len(payload) - (len(payload) % fd_size)
+            fds.frombytes(payload[:usable])
+    if not data:
+        return None, list(fds)
+    return _read_line(conn, initial=data), list(fds)
+
+
+def _supervise(conn, request, fds, context, run_command):
+    """Run a forwarded command and report its exit code to the client.
+
+    This is called in a process forked from the daemon. The command
+    itself runs in a further child process (and its own process group)
+    so that it can be interrupted when the client goes away, and be the
+    foreground process group of the client's terminal.
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        os.setpgid(0, 0)
+        for target, fd in zip(_FORWARDED_FDS, fds):
+            os.dup2(fd, target)
+        for fd in fds:
+            if fd not in _FORWARDED_FDS:
+                os.close(fd)
+        # Take over the client's terminal, as a shell does for the jobs it
+        # runs in the foreground, so that the command can prompt and be
+        # interrupted with Ctrl-C. The client takes it back afterwards.
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        terminal = _terminal_fd()
+        if request.get('foreground') and terminal is not None:
+            _set_foreground(terminal, os.getpgrp())
+        os.chdir(request.get('cwd') or '/')
+        os.environ.clear()
+        os.environ.update(request.get('env', {}))
+        sys.stdin = os.fdopen(0, 'r')
+        sys.stdout = os.fdopen(1, 'w')
+        sys.stderr = os.fdopen(2, 'w')
+        returncode = 1
+        try:
+            returncode = run_command(request.get('argv', []), context)
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except Exception:
+                    pass
+            os._exit(returncode or 0)
+
+    for fd in fds:
+        os.close(fd)
+    interrupted = False
+    while True:
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            break
+        readable, unused_w, unused_x = select.select([conn], [], [], 0.1)
+        if readable and not interrupted and not conn.recv(4096):
+            interrupted = True
+            try:
+                os.killpg(pid, signal.SIGINT)
+            except OSError:
+                pass
+    if os.WIFEXITED(status):
+        returncode = os.WEXITSTATUS(status)
+    else:
+        returncode = 128 + os.WTERMSIG(status)
+    try:
+        _send_line(conn, {'returncode': returncode})
+    except socket.error:
+        pass
+
+
+def _reap_children():
+    while True:
+        try:
+            pid, unused_status = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                return
+            raise
+        if not pid:
+            return
+
+
+def serve(path, resolve_context, run_command,
+          context_ttl_seconds=_DEFAULT_CONTEXT_TTL_SECONDS):
+    """Serve forwarded commands until asked to stop.
+
+    The daemon is single-threaded: requests are accepted one at a time,
+    the (cached) context is resolved in the daemon process itself, and
+    each command is then run in a forked child so that the warm state is
+    shared without being mutated by individual commands.
+
+    Args:
+      path: The path of the Unix domain socket on which to listen
+      resolve_context: Function that takes an environment dictionary and
+        returns the context with which to run commands
+      run_command: Function that takes a list of command line arguments
+        and a context, runs the command, and returns its exit code
+      context_ttl_seconds: How long to reuse a resolved context
+    Raises:
+      DaemonAlreadyRunningException: If another daemon is listening
+    """
+    if _request(path, {'action': _ACTION_PING}) is not None:
+        raise DaemonAlreadyRunningException(path)
+    if os.path.exists(path):
+        os.remove(path)
+
+    contexts = {}
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(32)
+    server.settimeout(1.0)
+    print('Listening for datalab commands on {}'.format(path))
+    sys.stdout.flush()
+    try:
+        while True:
+            _reap_children()
+            try:
+                conn, unused_addr = server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            fds = []
+            try:
+                request, fds = _receive_request(conn)
+                action = (request or {}).get('action')
+                if action == _ACTION_PING:
+                    _send_line(conn, {'pid': os.getpid()})
+                elif action == _ACTION_STOP:
+                    _send_line(conn, {'pid': os.getpid()})
+                    return
+                elif action == _ACTION_RUN and \
+                        len(fds) == len(_FORWARDED_FDS):
+                    env = request.get('env', {})
+                    key = _context_key(env)
+                    cached = contexts.get(key)
+                    if (not cached) or (
+                            time.time() - cached[0] > context_ttl_seconds):
+                        cached = (time.time(), resolve_context(env))
+                        # Contexts of configurations that have since
+                        # changed are never looked up again.
+                        contexts = dict(
+                            (k, v) for k, v in contexts.items()
+                            if cached[0] - v[0] <= context_ttl_seconds)
+                        contexts[key] = cached
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    if os.fork() == 0:
+                        server.close()
+                        try:
+                            _supervise(
+                                conn, request, fds, cached[1], run_command)
+                        finally:
+                            os._exit(0)
+                    fds = []
+                else:
+                    _send_line(conn, {'returncode': 1})
+            except Exception as e:
+                print('Failed to handle a request: {}'.format(e))
+                try:
+                    _send_line(conn, {'returncode': 1, 'error': str(e)})
+                except socket.error:
+                    pass
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+        print('Stopped listening on {}'.format(path))
+
+
+def run(args, resolve_context=None, run_command=None, **unused_kwargs):
+    """Implementation of the `datalab daemon` subcommand.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      resolve_context: Function that takes an environment dictionary and
+        returns the context with which to run commands
+      run_command: Function that takes a list of command line arguments
+        and a context, runs the command, and returns its exit code
+    Raises:
+      DaemonNotSupportedException: If the platform lacks the needed
+        support for passing file descriptors over Unix domain sockets
+    """
+    if not is_supported():
+        raise DaemonNotSupportedException()
+    path = socket_path(args.socket_path)
+    if args.status or args.stop:
+        action = _ACTION_STOP if args.stop else _ACTION_PING
+        reply = _request(path, {'action': action})
+        if reply is None:
+            print('No datalab daemon is listening on {}'.format(path))
+        elif args.stop:
+            print('Stopped the datalab daemon (pid {})'.format(reply['pid']))
+        else:
+            print('The datalab daemon (pid {}) is listening on {}'.format(
+                reply['pid'], path))
+        return
+    serve(path, resolve_context, run_command,
+          context_ttl_seconds=args.context_ttl_seconds)
@@ -0,0 +1,439 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for creating a fleet of Datalab instances in one invocation.
+
+A fleet is described either by a manifest file or by the `--count` and
+`--name-prefix` flags. The project-level preparation (network, firewall
+rule, subnet and repository checks) is shared by every instance in the
+fleet, while the disks and instances are created concurrently.
+
+A manifest is a YAML (if PyYAML is installed) or JSON file of the form:
+
+    defaults:
+      machine-type: n1-standard-2
+    instances:
+    - name: workshop-alice
+      for-user: alice@example.com
+    - name: workshop-bob
+      for-user: bob@example.com
+      disk-size-gb: 50
+"""
+
+from __future__ import absolute_import
+
+import copy
+import json
+import random
+import subprocess
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# Manifest keys that may be set per instance, mapped to the argparse
+# destination that they override. Settings that affect the shared
+# preparation (such as the zone or network) can only be set on the
+# command line.
+_MANIFEST_KEYS = {
+    'name': 'instance',
+    'disk-name': 'disk_name',
+    'disk-size-gb': 'disk_size_gb',
+    'for-user': 'for_user',
+    'idle-timeout': 'idle_timeout',
+    'image-name': 'image_name',
+    'log-level': 'log_level',
+    'machine-type': 'machine_type',
+    'no-backups': 'no_backups',
+    'no-swap': 'no_swap',
+    'service-account': 'service_account',
+}
+
+_DEFAULT_PARALLELISM = 8
+_DEFAULT_MAX_RETRIES = 5
+_INITIAL_BACKOFF_SECONDS = 2
+_MAX_BACKOFF_SECONDS = 60
+
+# Substrings of gcloud error output that indicate that a request was
+# rejected because of API rate limits or operation quotas, rather than
+# because the request itself was invalid.
+_RATE_LIMIT_MARKERS = [
+    'rateLimitExceeded',
+    'RATE_LIMIT_EXCEEDED',
+    'userRateLimitExceeded',
+    'Rate Limit Exceeded',
+    'Too Many Requests',
+    'operationRateExceeded',
+    'Quota exceeded for quota metric',
+]
+
+
+class InvalidFleetFlagsException(Exception):
+
+    _MESSAGE = 'Cannot determine which instances to create: {0}'
+
+    def __init__(self, reason):
+        super(InvalidFleetFlagsException, self).__init__(
+            InvalidFleetFlagsException._MESSAGE.format(reason))
+
+
+class InvalidManifestException(Exception):
+
+    _MESSAGE = 'The fleet manifest {0} is not valid: {1}'
+
+    def __init__(self, path, reason):
+        super(InvalidManifestException, self).__init__(
+            InvalidManifestException._MESSAGE.format(path, reason))
+
+
+class FleetCreationException(Exception):
+
+    _MESSAGE = '{0} of {1} instances could not be created.'
+
+    def __init__(self, failed, total):
+        super(FleetCreationException, self).__init__(
+            FleetCreationException._MESSAGE.format(failed, total))
+
+
+def fleet_flags(parser):
+    """Add command line flags for creating a fleet of instances.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        default=None,
+        help=(
+            'path of a YAML or JSON file listing the instances to create.'
+            '\n\n'
+            'The file contains an `instances` list whose entries have a\n'
+            '`name` and optionally any of `disk-name`, `disk-size-gb`,\n'
+            '`for-user`, `idle-timeout`, `image-name`, `log-level`,\n'
+            '`machine-type`, `no-backups`, `no-swap` and\n'
+            '`service-account`. Values under an optional `defaults` key\n'
+            'apply to every instance.'))
+    parser.add_argument(
+        '--count',
+        type=int,
+        dest='count',
+        default=None,
+        help=(
+            'number of instances to create, named using --name-prefix.'
+            '\n\n'
+            'For example, `--count 3 --name-prefix workshop` creates\n'
+            'workshop-1, workshop-2 and workshop-3.'))
+    parser.add_argument(
+        '--name-prefix',
+        dest='name_prefix',
+        default=None,
+        help='prefix for the names of the instances created by --count')
+    parser.add_argument(
+        '--parallelism',
+        type=int,
+        dest='parallelism',
+        default=_DEFAULT_PARALLELISM,
+        help=(
+            'maximum number of instances to create concurrently when\n'
+            'using --manifest or --count.'))
+    parser.add_argument(
+        '--max-retries',
+        type=int,
+        dest='max_retries',
+        default=_DEFAULT_MAX_RETRIES,
+        help=(
+            'number of times to retry a rate-limited request when using\n'
+            '--manifest or --count.'))
+    return
+
+
+def is_fleet(args):
+    """Check whether the given flags request more than a single instance.
+
+    Args:
+      args: The Namespace instance returned by argparse
+    Returns:
+      True iff either --manifest or --count was specified.
+    """
+    return bool(getattr(args, 'manifest', None) or
+                getattr(args, 'count', None))
+
+
+def _load_manifest_file(path):
+    """Read and parse the given manifest file."""
+    try:
+        with open(path, 'r') as f:
+            contents = f.read()
+    except IOError as e:
+        raise InvalidManifestException(path, e)
+    if not path.endswith('.json'):
+        try:
+            import yaml
+        except ImportError:
+            yaml = None
+        if yaml:
+            try:
+                return yaml.safe_load(contents)
+            except yaml.YAMLError as e:
+                raise InvalidManifestException(path, e)
+    try:
+        return json.loads(contents)
+    except ValueError:
+        raise InvalidManifestException(
+            path, 'it is not valid JSON, and YAML manifests require PyYAML')
+
+
+def _manifest_overrides(path, entry):
+    """Convert a manifest entry into a mapping of argparse overrides."""
+    if not isinstance(entry, dict):
+        raise InvalidManifestException(
+            path, 'expected a mapping but found {0!r}'.format(entry))
+    overrides = {}
+    for key, value in entry.items():
+        if key not in _MANIFEST_KEYS:
+            raise InvalidManifestException(
+                path, 'unsupported setting `{0}`'.format(key))
+        overrides[_MANIFEST_KEYS[key]] = value
+    return overrides
+
+
+def load_manifest(path):
+    """Load the instances described by a fleet manifest.
+
+    Args:
+      path: The path of the manifest file
+    Returns:
+      A list of dictionaries mapping argparse destinations to the
+      values to use for each instance.
+    Raises:
+      InvalidManifestException: If the manifest cannot be parsed.
+    """
+    manifest = _load_manifest_file(path)
+    if isinstance(manifest, list):
+        manifest = {'instances': manifest}
+    if not isinstance(manifest, dict) or not manifest.get('instances'):
+        raise InvalidManifestException(path, 'no instances are listed')
+    defaults = _manifest_overrides(path, manifest.get('defaults') or {})
+    if 'instance' in defaults:
+        raise InvalidManifestException(
+            path, 'instance names cannot be set in `defaults`')
+
+    instances = []
+    for entry in manifest['instances']:
+        if not isinstance(entry, dict):
+            entry = {'name': entry}
+        overrides = dict(defaults)
+        overrides.update(_manifest_overrides(path, entry))
+        if not overrides.get('instance'):
+            raise InvalidManifestException(
+                path, 'every instance must have a `name`')
+        overrides['instance'] = str(overrides['instance'])
+        instances.append(overrides)
+    return instances
+
+
+def generate_names(name_prefix, count):
+    """Generate `count` instance names starting with `name_prefix`."""
+    return ['{0}-{1}'.format(name_prefix, i) for i in range(1, count + 1)]
+
+
+def instance_overrides(args):
+    """Determine the instances requested by the given flags.
+
+    Args:
+      args: The Namespace instance returned by argparse
+    Returns:
+      A list of dictionaries mapping argparse destinations to the
+      values to use for each instance.
+    Raises:
+      InvalidFleetFlagsException: If the flags are inconsistent.
+      InvalidManifestException: If the manifest cannot be parsed.
+    """
+    if args.manifest and args.count:
+        raise InvalidFleetFlagsException(
+            '--manifest and --count cannot be used together')
+    if args.instance:
+        raise InvalidFleetFlagsException(
+            'an instance NAME cannot be combined with --manifest or --count')
+    if args.disk_name:
+        raise InvalidFleetFlagsException(
+            '--disk-name cannot be shared by multiple instances; set '
+            '`disk-name` for each instance in a manifest instead')
+    if args.parallelism < 1:
+        raise InvalidFleetFlagsException('--parallelism must be positive')
+
+    if args.manifest:
+        instances = load_manifest(args.manifest)
+    else:
+        if args.count < 1 or not args.name_prefix:
+            raise InvalidFleetFlagsException(
+                '--count requires a positive count and --name-prefix')
+        instances = [{'instance': name} for name in
+                     generate_names(args.name_prefix, args.count)]
+
+    names = [overrides['instance'] for overrides in instances]
+    duplicates = sorted(set(n for n in names if names.count(n) > 1))
+    if duplicates:
+        raise InvalidFleetFlagsException(
+            'duplicate instance names: {0}'.format(', '.join(duplicates)))
+    return instances
+
+
+def args_for_instance(args, overrides):
+    """Build a copy of the parsed flags for one instance of the fleet.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      overrides: A mapping of argparse destinations to values
+    Returns:
+      A new Namespace instance with the overrides applied.
+    """
+    instance_args = copy.copy(args)
+    for dest, value in overrides.items():
+        setattr(instance_args, dest, value)
+    return instance_args
+
+
+def is_rate_limited(error):
+    """Check whether a failed gcloud call was rejected by a rate limit.
+
+    Args:
+      error: The subprocess.CalledProcessError raised by the call. Its
+        `output` attribute holds the captured error messages, if any.
+    Returns:
+      True iff the call should be retried after backing off.
+    """
+    output = error.output or ''
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+    return any(marker in output for marker in _RATE_LIMIT_MARKERS)
+
+
+def call_with_backoff(fn, max_retries, sleep=time.sleep):
+    """Call `fn`, retrying with exponential backoff if it is rate limited.
+
+    Args:
+      fn: The function to call. It takes no arguments.
+      max_retries: The maximum number of times to retry
+      sleep: Function used to wait between attempts
+    Returns:
+      The result of `fn`
+    Raises:
+      subprocess.CalledProcessError: If `fn` fails for any reason other
+        than a rate limit, or is still rate limited after all retries.
+    """
+    delay = _INITIAL_BACKOFF_SECONDS
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except subprocess.CalledProcessError as e:
+            if attempt >= max_retries or not is_rate_limited(e):
+                raise
+        attempt += 1
+        # Add jitter so that concurrent workers do not retry in lockstep.
+        sleep(delay + random.uniform(0, delay))
+        delay = min(delay * 2, _MAX_BACKOFF_SECONDS)
+
+
+class InstanceResult(object):
+    """The outcome of creating a single instance of a fleet."""
+
+    def __init__(self, name, succeeded, elapsed_seconds, error=None):
+        self.name = name
+        self.succeeded = succeeded
+        self.elapsed_seconds = elapsed_seconds
+        self.error = error
+
+
+def _describe_error(error):
+    """Summarize an exception raised while creating an instance."""
+    output = getattr(error, 'output', None) or ''
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    if lines:
+        return lines[-1]
+    return str(error) or error.__class__.__name__
+
+
+def create_all(instance_args, create_instance, parallelism):
+    """Create every instance of a fleet using a pool of worker threads.
+
+    Args:
+      instance_args: A list of Namespace instances, one per instance
+      create_instance: Function taking one of the Namespace instances
+        and creating the corresponding disk and VM.
+      parallelism: The maximum number of concurrent creations
+    Returns:
+      A list of InstanceResult objects in the same order as the input.
+    """
+    pending = queue.Queue()
+    for index, args in enumerate(instance_args):
+        pending.put((index, args))
+    results = [None] * len(instance_args)
+
+    def worker():
+        while True:
+            try:
+                index, args = pending.get_nowait()
+            except queue.Empty:
+                return
+            start = time.time()
+            try:
+                create_instance(args)
+                results[index] = InstanceResult(
+                    args.instance, True, time.time() - start)
+            except Exception as e:
+                results[index] = InstanceResult(
+                    args.instance, False, time.time() - start,
+                    error=_describe_error(e))
+
+    workers = [threading.Thread(target=worker)
+               for _ in range(min(parallelism, len(instance_args)))]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    # Join with a timeout so that Ctrl-C is still delivered to the
+    # main thread in Python 2.
+    for t in workers:
+        while t.is_alive():
+            t.join(1)
+    return results
+
+
+def print_report(results, elapsed_seconds):
+    """Print the outcome and timing of each instance of a fleet.
+
+    Args:
+      results: The list of InstanceResult objects
+      elapsed_seconds: The total time taken to create the fleet
+    """
+    created = len([r for r in results if r.succeeded])
+    print('Created {0} of {1} instances in {2:.1f}s'.format(
+        created, len(results), elapsed_seconds))
+    width = max([len('NAME')] + [len(r.name) for r in results])
+    row = '  {0:<' + str(width) + '}  {1:<7}  {2:>7}  {3}'
+    print(row.format('NAME', 'STATUS', 'SECONDS', '').rstrip())
+    for r in results:
+        status = 'created' if r.succeeded else 'failed'
+        print(row.format(
+            r.name, status, '{0:.1f}'.format(r.elapsed_seconds),
+            r.error or '').rstrip())
+    return
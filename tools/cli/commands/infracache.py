@@ -0,0 +1,183 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local cache of verified facts about a project's infrastructure.
+
+Creating an instance checks several long-lived resources (the network,
+its firewall rules, the region of the zone, the subnet and the notebooks
+repository) that almost never change between invocations. Once one of
+these has been verified, the fact is recorded here for a limited time so
+that subsequent invocations can skip the corresponding API calls.
+
+Only the existence of resources is cached. The check for firewall rules
+that were not created by datalab, which may prompt, always runs against
+the API, as does anything that would create a resource.
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import tempfile
+import time
+
+from . import utils
+
+
+# How long a verified fact is trusted before it is checked again.
+_DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+_CACHE_FILE_NAME = 'infrastructure-cache.json'
+
+
+def cache_flags(parser):
+    """Add command line flags that control the infrastructure cache.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
+    parser.add_argument(
+        '--refresh-infra',
+        dest='refresh_infra',
+        action='store_true',
+        default=False,
+        help=(
+            're-verify the network, firewall rules, subnet and repository\n'
+            'rather than trusting the results cached by previous runs.'))
+    return
+
+
+def network_key(network_name):
+    return 'network:{0}'.format(network_name)
+
+
+def firewall_rule_key(network_name):
+    return 'firewall-rule:{0}'.format(network_name)
+
+
+def region_key(zone):
+    return 'region:{0}'.format(zone)
+
+
+def subnet_key(region, subnet_name):
+    return 'subnet:{0}/{1}'.format(region, subnet_name)
+
+
+def subnet_name_key(network_name, region):
+    return 'subnet-name:{0}/{1}'.format(network_name, region)
+
+
+def private_ip_google_access_key(region, subnet_name):
+    return 'private-ip-google-access:{0}/{1}'.format(region, subnet_name)
+
+
+def repo_key(repo_name):
+    return 'repo:{0}'.format(repo_name)
+
+
+class InfraCache(object):
+    """Facts about a single project's infrastructure, each with a TTL.
+
+    If the project is not known, nothing is cached.
+    """
+
+    def __init__(self, project, path=None, ttl_seconds=_DEFAULT_TTL_SECONDS,
+                 refresh=False):
+        """Initialize the cache.
+
+        Args:
+          project: The name of the project, or None if unknown
+          path: The path of the cache file, if not the default one
+          ttl_seconds: How long cached facts remain valid
+          refresh: If True, ignore (but still update) the cached facts
+        """
+        self._project = project
+        self._path = path or os.path.join(
+            utils.config_dir(), _CACHE_FILE_NAME)
+        self._ttl_seconds = ttl_seconds
+        self._refresh = refresh
+
+    def _load(self):
+        try:
+            with open(self._path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        # Write to a temporary file and rename it so that concurrent
+        # invocations never observe a partially written cache.
+        cache_dir = os.path.dirname(self._path)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+            os.rename(temp_path, self._path)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get(self, key):
+        """Get the value of a previously verified fact.
+
+        Args:
+          key: The key of the fact
+        Returns:
+          The cached value, or None if it is missing or has expired.
+        """
+        if not self._project or self._refresh:
+            return None
+        entry = self._load().get(self._project, {}).get(key)
+        if not entry:
+            return None
+        if time.time() - entry.get('verified', 0) > self._ttl_seconds:
+            return None
+        return entry.get('value')
+
+    def put(self, key, value=True):
+        """Record that a fact has just been verified.
+
+        Args:
+          key: The key of the fact
+          value: The verified value
+        """
+        if not self._project:
+            return
+        entries = self._load()
+        entries.setdefault(self._project, {})[key] = {
+            'value': value,
+            'verified': time.time(),
+        }
+        self._save(entries)
+
+    def invalidate(self):
+        """Forget every fact cached for the project."""
+        if not self._project:
+            return
+        entries = self._load()
+        if entries.pop(self._project, None) is not None:
+            self._save(entries)
+
+
+def for_args(args, gcloud_project=None):
+    """Get the infrastructure cache for the project targeted by a command.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_project: The project that gcloud is configured to use
+    Returns:
+      An InfraCache instance.
+    """
+    return InfraCache(args.project or gcloud_project,
+                      refresh=getattr(args, 'refresh_infra', False))
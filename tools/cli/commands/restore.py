@@ -0,0 +1,212 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Methods for implementing the `datalab restore` command."""
+
+from __future__ import absolute_import
+
+import json
+import subprocess
+import tempfile
+
+from . import connect, utils
+
+
+description = ("""`{0} {1}` restores files from the backups that Datalab
+makes to Google Cloud Storage onto the disk of an instance.
+
+Backups are found through the index that each instance keeps of its
+backups, so listing them does not list the bucket. Only the data of the
+files being restored is downloaded, in parallel, so restoring a single
+notebook does not download the whole backup.
+
+By default, the files of the latest backup of the instance itself are
+restored into the directory that was backed up, and files that already
+exist are left alone. To restore the backups of another instance, for
+example one that has been deleted, onto a new instance, pass the name of
+the old one with --source-instance.
+
+The files are restored by running a helper in the Datalab container of
+the instance over SSH, so the instance is started if it is not running.""")
+
+
+examples = ("""
+List the backups of 'example-instance':
+    $ {0} {1} example-instance --list
+
+Restore a single notebook from its latest backup:
+    $ {0} {1} example-instance --path 'datalab/notebooks/analysis.ipynb'
+
+Restore everything from a backup of a deleted instance onto a new one:
+    $ {0} {1} new-instance --source-instance old-instance \\
+        --backup /content/daily-20180102030405""")
+
+
+_HELPER_PATH = '/datalab/gcs_restore.py'
+
+
+def flags(parser):
+    """Add command line flags for the `restore` subcommand.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
+    parser.add_argument(
+        'instance',
+        metavar='NAME',
+        help='name of the instance onto which to restore files')
+    parser.add_argument(
+        '--list',
+        dest='list',
+        action='store_true',
+        default=False,
+        help='list the backups instead of restoring one')
+    parser.add_argument(
+        '--backup',
+        dest='backup',
+        default=None,
+        metavar='ID',
+        help=(
+            'ID of the backup to restore, as shown by --list. The\n'
+            'tag and timestamp alone are enough if they are unique.\n'
+            'Defaults to the latest backup.'))
+    parser.add_argument(
+        '--path',
+        dest='paths',
+        action='append',
+        default=[],
+        metavar='GLOB',
+        help=(
+            'glob of the paths to restore, relative to the directory\n'
+            'that was backed up, or a directory to restore.\n'
+            'May be given more than once. Defaults to every file.'))
+    parser.add_argument(
+        '--destination',
+        dest='destination',
+        default=None,
+        help=(
+            'directory in the Datalab container into which to\n'
+            'restore files. Defaults to the directory that was\n'
+            'backed up.'))
+    parser.add_argument(
+        '--overwrite',
+        dest='overwrite',
+        action='store_true',
+        default=False,
+        help='overwrite files that already exist')
+    parser.add_argument(
+        '--source-instance',
+        dest='source_instance',
+        default=None,
+        help='name of the instance whose backups to restore')
+    parser.add_argument(
+        '--source-zone',
+        dest='source_zone',
+        default=None,
+        help='zone of the source instance, if not that of NAME')
+    parser.add_argument(
+        '--bucket',
+        dest='bucket',
+        default=None,
+        help=(
+            'bucket of the backups. Defaults to the bucket that\n'
+            'Datalab backs up to by default.'))
+    parser.add_argument(
+        '--parallel',
+        dest='parallel',
+        type=int,
+        default=8,
+        help='number of files to download at once')
+    return
+
+
+def helper_args(args, project, zone):
+    """Build the arguments of the restore helper.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      project: The project of the instances
+      zone: The zone of the instance onto which to restore files
+    Returns:
+      The list of arguments.
+    """
+    cmd = ['list' if args.list else 'restore',
+           '--machine', args.source_instance or args.instance]
+    # Without a zone, the helper uses the zone of the instance it runs on.
+    if args.source_zone or zone:
+        cmd.extend(['--zone', args.source_zone or zone])
+    if project:
+        cmd.extend(['--project', project])
+    if args.bucket:
+        cmd.extend(['--bucket', args.bucket])
+    if args.list:
+        return cmd
+    if args.backup:
+        cmd.extend(['--backup', args.backup])
+    for path in args.paths:
+        cmd.extend(['--path', path])
+    if args.destination:
+        cmd.extend(['--destination', args.destination])
+    if args.overwrite:
+        cmd.append('--overwrite')
+    cmd.extend(['--parallel', str(args.parallel)])
+    return cmd
+
+
+def print_backups(backups):
+    """Print the backups listed by the restore helper."""
+    if not backups:
+        print('There are no backups.')
+        return
+    print('{0:<60} {1}'.format('ID', 'TYPE'))
+    for backup in backups:
+        print('{0:<60} {1}'.format(
+            backup['id'], 'incremental' if backup['incremental'] else 'zip'))
+
+
+def run(args, gcloud_compute, gcloud_zone='', gcloud_project='',
+        **unused_kwargs):
+    """Implementation of the `datalab restore` subcommand.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      gcloud_zone: The zone that gcloud is configured to use
+      gcloud_project: The project that gcloud is configured to use
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    instance = args.instance
+    status, unused_metadata_items = utils.describe_instance(
+        args, gcloud_compute, instance)
+    connect.maybe_start(args, gcloud_compute, instance, status)
+
+    cmd = [utils.CONTAINER_PYTHON, _HELPER_PATH] + helper_args(
+        args, args.project or gcloud_project, args.zone or gcloud_zone)
+    if not args.list:
+        print('Restoring files onto {0}'.format(instance))
+        utils.run_in_container(args, gcloud_compute, instance, cmd)
+        return
+
+    with tempfile.TemporaryFile() as stdout:
+        utils.run_in_container(
+            args, gcloud_compute, instance, cmd, stdout=stdout)
+        stdout.seek(0)
+        output = stdout.read().decode('utf-8').strip().splitlines()
+    try:
+        backups = json.loads(output[-1])
+    except (IndexError, ValueError):
+        raise subprocess.CalledProcessError(1, cmd, '\n'.join(output))
+    print_backups(backups)
+    return
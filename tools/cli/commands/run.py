@@ -0,0 +1,188 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Methods for implementing the `datalab run` command."""
+
+from __future__ import absolute_import
+
+import posixpath
+import time
+
+from . import connect, utils
+
+
+description = ("""`{0} {1}` executes a notebook on a Datalab instance,
+without a browser, and saves the executed notebook to the disk of the
+instance.
+
+NOTEBOOK is the path of the notebook relative to the notebooks root
+(`/content`). Parameters given with --param are assigned in a cell that is
+inserted after the cell tagged `parameters`, or at the top of the notebook.
+Giving a parameter more than once sweeps over its values: the notebook is
+executed once for every combination of the values of all parameters, in
+separate kernels that run in parallel, by default one per core of the
+instance.
+
+The executed notebooks, with the time taken by each cell in their
+metadata, are written to a directory of the run, along with status.json,
+which records the parameters, outcome and timings of every execution, and
+run.log. The run happens in the background in the Datalab container, so
+it carries on if the connection drops or this command is interrupted;
+`{0} {1}` only prints the log of the run until it is over.""")
+
+
+examples = ("""
+Run a notebook on 'example-instance':
+    $ {0} {1} example-instance datalab/notebooks/nightly.ipynb
+
+Run it for two regions and three learning rates, four at a time:
+    $ {0} {1} example-instance datalab/notebooks/train.ipynb \\
+        --param region=us --param region=eu \\
+        --param rate=0.1 --param rate=0.01 --param rate=0.001 \\
+        --parallel 4""")
+
+
+_RUNNER_PATH = '/datalab/notebook_runner.py'
+
+
+def flags(parser):
+    """Add command line flags for the `run` subcommand.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
+    parser.add_argument(
+        'instance',
+        metavar='NAME',
+        help='name of the instance on which to run the notebook')
+    parser.add_argument(
+        'notebook',
+        metavar='NOTEBOOK',
+        help='path of the notebook, relative to the notebooks root')
+    parser.add_argument(
+        '--param',
+        dest='params',
+        action='append',
+        default=[],
+        metavar='KEY=VALUE',
+        help=(
+            'parameter of the notebook. VALUE is parsed as JSON if\n'
+            'it can be, and is a string otherwise. Repeat a KEY\n'
+            'to sweep over several values.'))
+    parser.add_argument(
+        '--parallel',
+        dest='parallel',
+        type=int,
+        default=0,
+        help=(
+            'number of kernels to run at once. Defaults to the\n'
+            'number of cores of the instance.'))
+    parser.add_argument(
+        '--output-dir',
+        dest='output_dir',
+        default=None,
+        help=(
+            'directory for the executed notebooks, relative to\n'
+            'the notebooks root. Defaults to a new directory under\n'
+            '`runs` next to the notebook.'))
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        type=int,
+        default=None,
+        help='time limit of each cell, in seconds')
+    parser.add_argument(
+        '--kernel',
+        dest='kernel',
+        default=None,
+        help='name of the kernel to use, if not that of the notebook')
+    parser.add_argument(
+        '--no-wait',
+        dest='wait',
+        action='store_false',
+        default=True,
+        help='do not wait for the run to finish')
+    return
+
+
+def output_dir(args):
+    """Choose the directory of a run.
+
+    Args:
+      args: The Namespace instance returned by argparse
+    Returns:
+      The directory, relative to the notebooks root.
+    """
+    if args.output_dir:
+        return args.output_dir
+    notebook = args.notebook.lstrip('/')
+    stem = posixpath.splitext(posixpath.basename(notebook))[0]
+    return posixpath.join(
+        posixpath.dirname(notebook), 'runs',
+        '{0}-{1}'.format(stem, time.strftime('%Y%m%d-%H%M%S')))
+
+
+def runner_args(args, run_dir):
+    """Build the arguments that start the notebook runner.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      run_dir: The directory of the run
+    Returns:
+      The list of arguments.
+    """
+    cmd = [utils.CONTAINER_PYTHON, _RUNNER_PATH, 'run',
+           args.notebook.lstrip('/'), run_dir]
+    for param in args.params:
+        cmd.extend(['--param', param])
+    if args.parallel:
+        cmd.extend(['--parallel', str(args.parallel)])
+    if args.timeout:
+        cmd.extend(['--timeout', str(args.timeout)])
+    if args.kernel:
+        cmd.extend(['--kernel', args.kernel])
+    return cmd
+
+
+def run(args, gcloud_compute, **unused_kwargs):
+    """Implementation of the `datalab run` subcommand.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+    """
+    instance = args.instance
+    status, unused_metadata_items = utils.describe_instance(
+        args, gcloud_compute, instance)
+    connect.maybe_start(args, gcloud_compute, instance, status)
+
+    run_dir = output_dir(args)
+    utils.run_in_container(
+        args, gcloud_compute, instance, runner_args(args, run_dir),
+        detach=True)
+    print('Started running {0} on {1}; the results will be in {2}'.format(
+        args.notebook, instance, run_dir))
+    if not args.wait:
+        return
+
+    try:
+        utils.run_in_container(
+            args, gcloud_compute, instance,
+            [utils.CONTAINER_PYTHON, _RUNNER_PATH, 'follow', run_dir])
+    except KeyboardInterrupt:
+        print('Stopped following the run, which carries on in the '
+              'background.')
+    return
@@ -0,0 +1,412 @@
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Methods for implementing the `datalab sync` command."""
+
+from __future__ import absolute_import
+
+import fnmatch
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+try:
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import quote
+    from urllib.request import Request, urlopen
+    import queue
+except ImportError:
+    from urllib import quote
+    from urllib2 import HTTPError, Request, URLError, urlopen
+    import Queue as queue
+
+from . import connect, utils
+
+
+description = ("""`{0} {1}` copies the files that differ between a local
+directory and a directory on a Datalab instance, in one direction.
+
+Whichever of SOURCE and DESTINATION has the form NAME:DIRECTORY is the
+directory of that name on the instance NAME, relative to the notebooks
+root (`/content`). Files are compared by the SHA-256 hashes of their
+contents, which the instance keeps cached, and only the files that are
+missing or different in the destination are copied. Files are never
+deleted, and hidden files and directories are skipped.
+
+Files are copied through an SSH tunnel to Datalab, like the one that
+`{0} connect` opens, in chunks and several at a time. Partially copied
+files are kept in hidden files next to their destination, so rerunning an
+interrupted sync resumes where it stopped.""")
+
+
+examples = ("""
+Upload the notebooks in ./analysis to datalab/notebooks/analysis on
+'example-instance':
+    $ {0} {1} ./analysis example-instance:datalab/notebooks/analysis
+
+See what would be downloaded from it, without downloading anything:
+    $ {0} {1} example-instance:datalab/notebooks/analysis ./analysis \\
+        --dry-run""")
+
+
+_SYNC_API_PATH = 'api/datalab/sync'
+_PARTIAL_TEMPLATE = '.{0}.{1}.sync-partial'
+_READ_SIZE = 1024 * 1024
+_MAX_ATTEMPTS = 5
+
+
+class InvalidSyncArgumentsException(Exception):
+
+    _MESSAGE = (
+        'Exactly one of the source and destination must name a directory on '
+        'an instance, as NAME:DIRECTORY; got {0} and {1}.')
+
+    def __init__(self, source, destination):
+        super(InvalidSyncArgumentsException, self).__init__(
+            InvalidSyncArgumentsException._MESSAGE.format(
+                source, destination))
+
+
+class TunnelException(Exception):
+
+    _MESSAGE = 'Could not reach Datalab on {0} through an SSH tunnel.'
+
+    def __init__(self, instance):
+        super(TunnelException, self).__init__(
+            TunnelException._MESSAGE.format(instance))
+
+
+class SyncFailedException(Exception):
+
+    _MESSAGE = (
+        'Failed to copy {0} files. Rerun the command to resume copying them.')
+
+    def __init__(self, failures):
+        super(SyncFailedException, self).__init__(
+            SyncFailedException._MESSAGE.format(failures))
+
+
+def flags(parser):
+    """Add command line flags for the `sync` subcommand.
+
+    Args:
+      parser: The argparse parser to which to add the flags.
+    """
+    parser.add_argument(
+        'source',
+        metavar='SOURCE',
+        help='local directory, or NAME:DIRECTORY on an instance')
+    parser.add_argument(
+        'destination',
+        metavar='DESTINATION',
+        help='local directory, or NAME:DIRECTORY on an instance')
+    parser.add_argument(
+        '--dry-run',
+        dest='dry_run',
+        action='store_true',
+        default=False,
+        help='list the files that would be copied, without copying them')
+    parser.add_argument(
+        '--exclude',
+        dest='excludes',
+        action='append',
+        default=[],
+        metavar='GLOB',
+        help=(
+            'glob of the relative paths of files not to copy.\n'
+            'May be given more than once.'))
+    parser.add_argument(
+        '--parallel',
+        dest='parallel',
+        type=int,
+        default=4,
+        help='number of files to copy at once')
+    parser.add_argument(
+        '--chunk-size-mb',
+        dest='chunk_size_mb',
+        type=int,
+        default=8,
+        help='size of the chunks in which files are copied')
+    parser.add_argument(
+        '--port',
+        dest='port',
+        type=int,
+        default=0,
+        help=(
+            'local port of the SSH tunnel to Datalab. Defaults to\n'
+            'any free port.'))
+    connect.tunnel_flags(parser)
+    return
+
+
+def parse_location(location):
+    """Split a location into an instance name and a directory.
+
+    Returns:
+      A tuple of the instance name, or None for a local directory, and
+      the directory.
+    """
+    instance, sep, directory = location.partition(':')
+    # Keep Windows paths such as C:\\notebooks local.
+    if not sep or len(instance) < 2 or os.sep in instance:
+        return None, location
+    return instance, directory.strip('/')
+
+
+class _SyncClient(object):
+    """Calls the sync API of Datalab, retrying transient failures."""
+
+    def __init__(self, datalab_address):
+        self._base_url = datalab_address + _SYNC_API_PATH
+
+    def _url(self, kind, path, **params):
+        url = '{0}/{1}/{2}'.format(self._base_url, kind,
+                                   quote(path.strip('/')))
+        query = '&'.join('{0}={1}'.format(name, quote(str(value), safe=''))
+                         for name, value in sorted(params.items()))
+        return url + ('?' + query if query else '')
+
+    def request(self, method, url, body=None, headers=None,
+                expected_codes=()):
+        """Send a request, and return its status and response body."""
+        for attempt in range(_MAX_ATTEMPTS):
+            request = Request(url, data=body, headers=headers or {})
+            request.get_method = lambda: method
+            try:
+                response = urlopen(request)
+                return response.getcode(), response.read()
+            except HTTPError as e:
+                if e.code in expected_codes:
+                    return e.code, e.read()
+                if e.code < 500 or attempt + 1 == _MAX_ATTEMPTS:
+                    raise
+            except (URLError, IOError, socket.error):
+                if attempt + 1 == _MAX_ATTEMPTS:
+                    raise
+            time.sleep(2 ** attempt)
+
+    def list_files(self, directory):
+        try:
+            _, body = self.request('GET', self._url('hashes', directory))
+        except HTTPError as e:
+            if e.code == 404:
+                return {}
+            raise
+        files = json.loads(body.decode('utf-8'))['files']
+        return dict((f['path'], f) for f in files)
+
+    def upload(self, local_path, remote_path, entry, chunk_size):
+        _, body = self.request('GET', self._url(
+            'partial', remote_path, sha256=entry['sha256']))
+        offset = json.loads(body.decode('utf-8'))['offset']
+        with open(local_path, 'rb') as f:
+            while True:
+                f.seek(offset)
+                data = f.read(chunk_size)
+                url = self._url('files', remote_path, sha256=entry['sha256'],
+                                offset=offset, size=entry['size'],
+                                mtime=entry['mtime'])
+                status, body = self.request(
+                    'PUT', url, body=data,
+                    headers={'Content-Type': 'application/octet-stream'},
+                    expected_codes=(409,))
+                offset = json.loads(body.decode('utf-8'))['offset']
+                if status == 201:
+                    return
+
+    def download(self, remote_path, local_path, entry, chunk_size):
+        directory, name = os.path.split(local_path)
+        partial_path = os.path.join(directory, _PARTIAL_TEMPLATE.format(
+            name, entry['sha256'][:16]))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        with open(partial_path, 'ab') as f:
+            offset = f.tell()
+            while offset < entry['size']:
+                end = min(entry['size'], offset + chunk_size)
+                _, data = self.request(
+                    'GET', self._url('files', remote_path),
+                    headers={'Range': 'bytes={0}-{1}'.format(offset, end - 1)})
+                if not data:
+                    break
+                f.write(data)
+                offset += len(data)
+        if _hash_file(partial_path) != entry['sha256']:
+            os.remove(partial_path)
+            raise ValueError('{0} changed while it was copied'.format(
+                remote_path))
+        os.utime(partial_path, (entry['mtime'], entry['mtime']))
+        if os.name == 'nt' and os.path.exists(local_path):
+            os.remove(local_path)
+        os.rename(partial_path, local_path)
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(_READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def list_local_files(directory):
+    """List the files under a local directory, with their hashes."""
+    files = {}
+    if not os.path.isdir(directory):
+        return files
+    for parent, subdirectories, names in os.walk(directory):
+        subdirectories[:] = [
+            d for d in subdirectories if not d.startswith('.')]
+        for name in names:
+            path = os.path.join(parent, name)
+            if name.startswith('.') or not os.path.isfile(path):
+                continue
+            relative_path = os.path.relpath(path, directory).replace(
+                os.sep, '/')
+            stat = os.stat(path)
+            files[relative_path] = {
+                'path': relative_path, 'size': stat.st_size,
+                'mtime': stat.st_mtime, 'sha256': _hash_file(path)}
+    return files
+
+
+def _free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def sync(args, client, local_dir, remote_dir, upload):
+    """Copy the files that differ from one directory to the other.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      client: The _SyncClient of the instance
+      local_dir: The local directory
+      remote_dir: The directory on the instance
+      upload: Whether to copy from the local directory to the instance
+    Raises:
+      SyncFailedException: If some files could not be copied
+    """
+    print('Comparing the files in {0} and {1}'.format(local_dir, remote_dir))
+    local_files = list_local_files(local_dir)
+    remote_files = client.list_files(remote_dir)
+    sources, destinations = (local_files, remote_files) if upload else \
+        (remote_files, local_files)
+    sources = dict(
+        (path, entry) for path, entry in sources.items()
+        if not any(fnmatch.fnmatch(path, exclude)
+                   for exclude in args.excludes))
+    changed = [entry for path, entry in sorted(sources.items())
+               if destinations.get(path, {}).get('sha256') != entry['sha256']]
+    total_bytes = sum(entry['size'] for entry in changed)
+    print('{0} of {1} files differ ({2} bytes to copy)'.format(
+        len(changed), len(sources), total_bytes))
+    if args.dry_run:
+        for entry in changed:
+            print('Would copy {0} ({1} bytes)'.format(
+                entry['path'], entry['size']))
+        return
+
+    tasks = queue.Queue()
+    for entry in changed:
+        tasks.put(entry)
+    failures = []
+    lock = threading.Lock()
+    chunk_size = max(1, args.chunk_size_mb) * 1024 * 1024
+
+    def copy_files():
+        while True:
+            try:
+                entry = tasks.get_nowait()
+            except queue.Empty:
+                return
+            local_path = os.path.join(local_dir, *entry['path'].split('/'))
+            remote_path = '/'.join([remote_dir, entry['path']]).lstrip('/')
+            try:
+                if upload:
+                    client.upload(local_path, remote_path, entry, chunk_size)
+                else:
+                    client.download(remote_path, local_path, entry, chunk_size)
+                with lock:
+                    print('Copied {0}'.format(entry['path']))
+            except Exception as e:
+                with lock:
+                    failures.append(entry)
+                    print('Failed to copy {0}: {1}'.format(entry['path'], e))
+
+    workers = [threading.Thread(target=copy_files)
+               for _ in range(max(1, args.parallel))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        # Join with a timeout, so that Ctrl-C interrupts the sync.
+        while worker.is_alive():
+            worker.join(1)
+    if failures:
+        raise SyncFailedException(len(failures))
+    return
+
+
+def run(args, gcloud_compute, **unused_kwargs):
+    """Implementation of the `datalab sync` subcommand.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+    Raises:
+      subprocess.CalledProcessError: If a nested `gcloud` calls fails
+      InvalidSyncArgumentsException: If not exactly one of the source
+        and destination is on an instance
+      TunnelException: If Datalab cannot be reached through the tunnel
+      SyncFailedException: If some files could not be copied
+    """
+    source_instance, source_dir = parse_location(args.source)
+    destination_instance, destination_dir = parse_location(args.destination)
+    if bool(source_instance) == bool(destination_instance):
+        raise InvalidSyncArgumentsException(args.source, args.destination)
+    upload = bool(destination_instance)
+    instance = destination_instance or source_instance
+    local_dir = os.path.abspath(source_dir if upload else destination_dir)
+    remote_dir = destination_dir if upload else source_dir
+
+    status, unused_metadata_items = utils.describe_instance(
+        args, gcloud_compute, instance)
+    connect.maybe_start(args, gcloud_compute, instance, status)
+
+    port = args.port or _free_port()
+    datalab_address = 'http://localhost:{0}/'.format(port)
+    tunnel_process = connect.create_tunnel(
+        args, gcloud_compute, instance, port)
+    try:
+        if not connect.wait_for_tunnel(
+                tunnel_process, datalab_address,
+                args.connection_health_timeout_seconds):
+            raise TunnelException(instance)
+        sync(args, _SyncClient(datalab_address), local_dir, remote_dir, upload)
+    finally:
+        if tunnel_process.poll() is None:
+            tunnel_process.terminate()
+    return
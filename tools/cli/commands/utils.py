@@ -15,10 +15,15 @@
 """Utility methods common to multiple commands."""
 
 import json
+import os
 import subprocess
 import sys
 import tempfile
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 
 try:
     # If we are running in Python 2, builtins is available in 'future'.
@@ -29,6 +34,23 @@ except Exception:
     read_input = raw_input  # noqa: F821
 
 
+def config_dir():
+    """Get the directory in which the `datalab` tool keeps local state.
+
+    The directory is created (readable only by the current user) if it
+    does not already exist. Its location can be overridden using the
+    DATALAB_CONFIG_DIR environment variable.
+
+    Returns:
+      The absolute path of the directory.
+    """
+    path = os.environ.get('DATALAB_CONFIG_DIR') or os.path.join(
+        os.path.expanduser('~'), '.config', 'datalab')
+    if not os.path.isdir(path):
+        os.makedirs(path, 0o700)
+    return path
+
+
 def prompt_for_confirmation(
         args,
         message,
@@ -133,19 +155,22 @@ def call_gcloud_quietly(args, gcloud_surface, cmd, report_errors=True):
       cmd: The subcommand to run
       report_errors: Whether or not to report errors to the user
     Raises:
-      subprocess.CalledProcessError: If the `gcloud` command fails
+      subprocess.CalledProcessError: If the `gcloud` command fails. The
+        messages written to stderr by `gcloud` are attached as the
+        `output` of the exception.
     """
     with tempfile.TemporaryFile() as stdout, \
             tempfile.TemporaryFile() as stderr:
         try:
             cmd = ['--quiet'] + cmd
             gcloud_surface(args, cmd, stdout=stdout, stderr=stderr)
-        except subprocess.CalledProcessError:
+        except subprocess.CalledProcessError as e:
+            stderr.seek(0)
+            e.output = stderr.read().decode('utf-8')
             if report_errors:
                 stdout.seek(0)
-                stderr.seek(0)
                 print(stdout.read().decode('utf-8'))
-                sys.stderr.write(stderr.read())
+                sys.stderr.write(e.output)
             raise
         stderr.seek(0)
         gcloud_stderr = stderr.read().decode('utf-8')
@@ -382,6 +407,44 @@ def maybe_prompt_for_zone(args, gcloud_compute, instance):
     return
 
 
+# The Python of the Jupyter server in the Datalab container; the root
+# Python there has neither nbformat nor nbconvert, nor the kernelspecs.
+CONTAINER_PYTHON = '/usr/local/envs/py3env/bin/python'
+
+# The shell command that runs a command in the Datalab container of an
+# instance, once the container is up.
+_CONTAINER_COMMAND_TEMPLATE = (
+    'for i in $(seq 60); do '
+    'docker inspect -f "{{{{.State.Running}}}}" datalab 2>/dev/null '
+    '| grep -q true && break; sleep 5; done; '
+    'docker exec {0}datalab {1}')
+
+
+def run_in_container(args, gcloud_compute, instance, cmd, detach=False,
+                     stdout=None):
+    """Run a command in the Datalab container of an instance, over SSH.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      gcloud_compute: Function that can be used to invoke `gcloud compute`
+      instance: The name of the instance, which must be running
+      cmd: The command to run, as a list of arguments
+      detach: Whether to leave the command running in the background,
+        where it survives the SSH connection
+      stdout: The 'stdout' argument for the subprocess call
+    Raises:
+      subprocess.CalledProcessError: If the command fails
+    """
+    remote_cmd = _CONTAINER_COMMAND_TEMPLATE.format(
+        '-d ' if detach else '', ' '.join(quote(arg) for arg in cmd))
+    ssh_cmd = ['ssh']
+    if args.zone:
+        ssh_cmd.extend(['--zone', args.zone])
+    ssh_cmd.extend(['datalab@{0}'.format(instance), '--command', remote_cmd])
+    gcloud_compute(args, ssh_cmd, stdout=stdout)
+    return
+
+
 def print_warning_messages(args):
     """Return whether or not warning messages should be printed.
 
@@ -21,18 +21,22 @@ This tool is specific to the use case of running in the Google Cloud Platform.
 
 from __future__ import absolute_import
 
-from commands import create, creategpu, connect, list, stop, delete, utils
+from commands import bakeimage, create, creategpu, connect, daemon, list
+from commands import stop, delete, restore, sync
+from commands import run as run_notebook
+from commands import utils
 
 import argparse
 import json
 import os
 import subprocess
+import sys
 import traceback
 try:
     from urllib.request import urlopen
-    from urllib.error import HTTPError
+    from urllib.error import URLError
 except ImportError:
-    from urllib2 import urlopen, HTTPError
+    from urllib2 import urlopen, URLError
 
 
 _SUBCOMMANDS = {
@@ -72,6 +76,48 @@ _SUBCOMMANDS = {
         'run': delete.run,
         'require-zone': True,
     },
+    'restore': {
+        'help': 'Restore files from the backups of a Datalab instance',
+        'description': restore.description,
+        'examples': restore.examples,
+        'flags': restore.flags,
+        'run': restore.run,
+        'require-zone': True,
+    },
+    'run': {
+        'help': 'Execute a notebook on a Datalab instance without a browser',
+        'description': run_notebook.description,
+        'examples': run_notebook.examples,
+        'flags': run_notebook.flags,
+        'run': run_notebook.run,
+        'require-zone': True,
+    },
+    'sync': {
+        'help': 'Copy the files that differ between a local directory and '
+                'a Datalab instance',
+        'description': sync.description,
+        'examples': sync.examples,
+        'flags': sync.flags,
+        'run': sync.run,
+        'require-zone': True,
+    },
+    'bake-image': {
+        'help': 'Build a boot image with the Datalab image preloaded',
+        'description': bakeimage.description,
+        'examples': bakeimage.examples,
+        'flags': bakeimage.flags,
+        'run': bakeimage.run,
+        'require-zone': True,
+    },
+    'daemon': {
+        'help': 'Serve datalab commands from a long-running process',
+        'description': daemon.description,
+        'examples': daemon.examples,
+        'flags': daemon.flags,
+        'run': daemon.run,
+        'require-zone': False,
+        'serves-commands': True,
+    },
 }
 
 _BETA_SUBCOMMANDS = {
@@ -125,20 +171,34 @@ version_issues_url = (
     'https://storage.googleapis.com/cloud-datalab/version-issues.js')
 
 
-try:
-    with open(os.devnull, 'w') as dn:
-        subprocess.call(['gcloud', '--version'], stderr=dn, stdout=dn)
-    gcloud_cmd = 'gcloud'
-except Exception:
-    gcloud_cmd = 'gcloud.cmd'
+# Only Windows needs the `gcloud.cmd` wrapper, so we avoid paying for a
+# probing `gcloud --version` call (which takes about a second) elsewhere.
+gcloud_cmd = 'gcloud'
+if os.name == 'nt':
+    try:
+        with open(os.devnull, 'w') as dn:
+            subprocess.call(['gcloud', '--version'], stderr=dn, stdout=dn)
+    except Exception:
+        gcloud_cmd = 'gcloud.cmd'
+
 
+def fetch_known_issues():
+    """Download the list of known issues for each Cloud SDK version.
 
-def report_known_issues(sdk_version, datalab_version):
+    Returns:
+      A dictionary of known issues keyed by component name and version,
+      or None if the list could not be downloaded.
+    """
     try:
         version_issues_resp = urlopen(version_issues_url)
-        version_issues = json.loads(version_issues_resp.read().decode('utf-8'))
-    except HTTPError as e:
+        return json.loads(version_issues_resp.read().decode('utf-8'))
+    except URLError as e:
         print('Error downloading the version information: {}'.format(e))
+        return None
+
+
+def report_known_issues(sdk_version, datalab_version, version_issues):
+    if version_issues is None:
         return
 
     sdk_issues = version_issues.get(sdk_core_component, {})
@@ -259,9 +319,11 @@ def gcloud_repos(
         cmd, stdin=stdin, stdout=stdout, stderr=stderr)
 
 
-def get_email_address():
+def get_email_address(env=None):
     """Get the email address of the user's active gcloud account.
 
+    Args:
+      env: The environment in which to run gcloud, if not our own
     Returns:
       The email address of the "active" gcloud authenticated account.
 
@@ -270,19 +332,79 @@ def get_email_address():
     """
     return subprocess.check_output([
         gcloud_cmd, 'auth', 'list', '--quiet', '--format',
-        'value(account)', '--filter', 'status:ACTIVE']).decode('utf-8').strip()
+        'value(account)', '--filter', 'status:ACTIVE'],
+        env=env).decode('utf-8').strip()
 
 
-def get_gcloud_zone():
-    """Get the zone (if any) that gcloud is configured to use.
+def get_gcloud_zone_and_project(env=None):
+    """Get the zone and project (if any) that gcloud is configured to use.
 
+    Args:
+      env: The environment in which to run gcloud, if not our own
     Returns:
-      The name of the zone gcloud is configured to use.
+      A tuple of the names of the zone and project gcloud is configured
+      to use. Either may be empty.
     """
-    return subprocess.check_output([
+    properties_json = subprocess.check_output([
         gcloud_cmd, 'config', 'config-helper', '--format',
-        'value(configuration.properties.compute.zone)']).decode(
-            'utf-8').strip()
+        'json(configuration.properties.compute.zone,'
+        'configuration.properties.core.project)'],
+        env=env).decode('utf-8').strip()
+    properties = json.loads(properties_json or '{}').get(
+        'configuration', {}).get('properties', {})
+    return (properties.get('compute', {}).get('zone', ''),
+            properties.get('core', {}).get('project', ''))
+
+
+def get_component_versions(env=None):
+    """Get the installed versions of the Cloud SDK and datalab component.
+
+    Args:
+      env: The environment in which to run gcloud, if not our own
+    Returns:
+      A tuple of the Cloud SDK version and the datalab component version.
+    """
+    gcloud_version_json = subprocess.check_output([
+        gcloud_cmd, 'version', '--format=json'],
+        env=env).decode('utf-8').strip()
+    component_versions = json.loads(gcloud_version_json)
+    sdk_version = component_versions.get(sdk_core_component, 'UNKNOWN')
+    datalab_version = component_versions.get(datalab_component, 'UNKNOWN')
+    return sdk_version, datalab_version
+
+
+def resolve_context(args, subcommand, context=None, env=None):
+    """Look up the gcloud state needed to run a subcommand.
+
+    Any values already present in the given context are reused rather
+    than being looked up again.
+
+    Args:
+      args: The Namespace instance returned by argparse, or None to
+        resolve everything that any subcommand might need.
+      subcommand: The config of the subcommand to run, or None
+      context: A dictionary of previously resolved values
+      env: The environment in which to run gcloud, if not our own
+    Returns:
+      The context dictionary, including the Cloud SDK and datalab versions,
+      the known version issues, the user's email address, and the
+      default gcloud zone and project.
+    """
+    context = dict(context or {})
+    if 'sdk_version' not in context:
+        context['sdk_version'], context['datalab_version'] = (
+            get_component_versions(env=env))
+    if 'version_issues' not in context and (
+            args is None or utils.print_warning_messages(args)):
+        context['version_issues'] = fetch_known_issues()
+    if 'gcloud_zone' not in context and (
+            subcommand is None or subcommand['require-zone']):
+        context['gcloud_zone'], context['gcloud_project'] = (
+            get_gcloud_zone_and_project(env=env))
+    if 'email' not in context and (
+            subcommand is None or not subcommand.get('serves-commands')):
+        context['email'] = get_email_address(env=env)
+    return context
 
 
 def add_sub_parser(subcommand, command_config, subparsers, prog):
@@ -337,9 +459,14 @@ def add_sub_parser(subcommand, command_config, subparsers, prog):
         help='Print additional information for diagnosing issues.')
 
 
-def run():
-    """Run the command line tool."""
-    prog = 'datalab'
+def build_parser(prog):
+    """Build the argument parser for the command line tool.
+
+    Args:
+      prog: The program name.
+    Returns:
+      An argparse.ArgumentParser for all of the subcommands.
+    """
     parser = argparse.ArgumentParser(
         prog=prog, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument(
@@ -385,9 +512,20 @@ def run():
     for subcommand in _BETA_SUBCOMMANDS:
         add_sub_parser(subcommand, _BETA_SUBCOMMANDS[subcommand],
                        beta_subparsers, prog)
+    return parser
 
-    args = parser.parse_args()
-    compute = gcloud_compute
+
+def parse_args(parser, argv=None):
+    """Parse the command line, applying any top-level flags.
+
+    Args:
+      parser: The parser returned by `build_parser`
+      argv: The command line arguments, or None to use sys.argv
+    Returns:
+      A tuple of the Namespace returned by argparse and the config of
+      the selected subcommand.
+    """
+    args = parser.parse_args(argv)
     if args.project is None:
         args.project = args.top_level_project
     if args.quiet is None:
@@ -399,11 +537,28 @@ def run():
     if args.diagnose_me is None:
         args.diagnose_me = args.top_level_diagnose_me
 
-    gcloud_version_json = subprocess.check_output([
-        gcloud_cmd, 'version', '--format=json']).decode('utf-8').strip()
-    component_versions = json.loads(gcloud_version_json)
-    sdk_version = component_versions.get(sdk_core_component, 'UNKNOWN')
-    datalab_version = component_versions.get(datalab_component, 'UNKNOWN')
+    if args.subcommand == 'beta':
+        subcommand = _BETA_SUBCOMMANDS[args.beta_subcommand]
+    else:
+        subcommand = _SUBCOMMANDS[args.subcommand]
+    return args, subcommand
+
+
+def run_subcommand(args, subcommand, context):
+    """Run the given subcommand.
+
+    Args:
+      args: The Namespace instance returned by argparse
+      subcommand: The config of the subcommand to run
+      context: The context returned by `resolve_context`
+    Returns:
+      The exit code of the command.
+    """
+    compute = gcloud_compute
+    if args.subcommand == 'beta':
+        compute = gcloud_beta_compute
+    sdk_version = context['sdk_version']
+    datalab_version = context['datalab_version']
 
     if args.diagnose_me:
         if args.verbosity == 'default':
@@ -415,23 +570,23 @@ def run():
                   sdk_version, datalab_version))
 
     if utils.print_warning_messages(args):
-        report_known_issues(sdk_version, datalab_version)
+        report_known_issues(sdk_version, datalab_version,
+                            context.get('version_issues'))
 
-    gcloud_zone = ""
-    if args.subcommand == 'beta':
-        subcommand = _BETA_SUBCOMMANDS[args.beta_subcommand]
-        compute = gcloud_beta_compute
-    else:
-        subcommand = _SUBCOMMANDS[args.subcommand]
     try:
-        if subcommand['require-zone']:
-            gcloud_zone = get_gcloud_zone()
+        if subcommand.get('serves-commands'):
+            subcommand['run'](
+                args, resolve_context=_resolve_daemon_context,
+                run_command=_run_forwarded_command)
+            return 0
         subcommand['run'](
             args, compute, gcloud_repos=gcloud_repos,
-            email=get_email_address(),
+            email=context['email'],
             in_cloud_shell=('DEVSHELL_CLIENT_PORT' in os.environ),
-            gcloud_zone=gcloud_zone,
+            gcloud_zone=context.get('gcloud_zone', ''),
+            gcloud_project=context.get('gcloud_project', ''),
             sdk_version=sdk_version, datalab_version=datalab_version)
+        return 0
     except subprocess.CalledProcessError as e:
         if utils.print_debug_messages(args):
             print('A nested call to gcloud failed.')
@@ -442,10 +597,41 @@ def run():
         else:
             print('A nested call to gcloud failed, '
                   'use --verbosity=debug for more info.')
+        return 1
     except Exception as e:
         if utils.print_debug_messages(args):
             traceback.print_exc()
         print(e)
+        return 1
+
+
+def _resolve_daemon_context(env):
+    """Resolve everything any forwarded command might need."""
+    return resolve_context(None, None, env=env)
+
+
+def _run_forwarded_command(argv, context):
+    """Run a command line forwarded to the daemon.
+
+    Returns:
+      The exit code of the command.
+    """
+    args, subcommand = parse_args(build_parser('datalab'), argv)
+    if subcommand.get('serves-commands'):
+        print('The datalab daemon cannot run itself.')
+        return 1
+    return run_subcommand(args, subcommand, context)
+
+
+def run():
+    """Run the command line tool."""
+    args, subcommand = parse_args(build_parser('datalab'))
+    if not subcommand.get('serves-commands'):
+        returncode = daemon.forward(sys.argv[1:])
+        if returncode is not None:
+            sys.exit(returncode)
+    context = resolve_context(args, subcommand)
+    sys.exit(run_subcommand(args, subcommand, context))
 
 
 if __name__ == '__main__':
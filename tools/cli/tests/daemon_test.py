@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file tests that commands forwarded to the `datalab daemon` can
+# prompt on the terminal of the client, as they can without the daemon.
+# The daemon is started from the same terminal as the client, in the
+# background, as with `nohup datalab daemon &`.
+
+import errno
+import os
+import pty
+import select
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from commands import daemon  # noqa: E402
+
+
+timeout_seconds = 10
+greeting_returncode = 3
+
+
+def greet(unused_argv, context):
+    with open(context['pid_path'], 'w') as f:
+        f.write(str(os.getpid()))
+    name = input('Name: ')
+    print('Hello, {}'.format(name))
+    return greeting_returncode
+
+
+def run_client(socket_path, pid_path):
+    """Start a daemon in the background and forward a command to it.
+
+    This runs in the session of a new terminal, as the foreground process
+    group, and exits with the exit code of the forwarded command.
+    """
+    returncode = 100
+    try:
+        os.environ.pop('DATALAB_NO_DAEMON', None)
+        daemon_pid = os.fork()
+        if daemon_pid == 0:
+            os.setpgid(0, 0)
+            try:
+                daemon.serve(
+                    socket_path, lambda env: {'pid_path': pid_path}, greet)
+            finally:
+                os._exit(0)
+        deadline = time.time() + timeout_seconds
+        while daemon._request(socket_path, {'action': 'ping'}) is None:
+            if time.time() > deadline:
+                raise Exception('The daemon did not start')
+            time.sleep(0.1)
+        try:
+            returncode = daemon.forward(['greet'], socket_path)
+        finally:
+            daemon._request(socket_path, {'action': 'stop'})
+            os.waitpid(daemon_pid, 0)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        os._exit(returncode)
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'daemon.sock')
+        self.pid_path = os.path.join(self.tmp_dir, 'command.pid')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def kill_command(self):
+        """Kill the forwarded command, which may be stopped."""
+        try:
+            with open(self.pid_path) as f:
+                os.kill(int(f.read()), signal.SIGKILL)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def run_in_terminal(self, answer):
+        """Run the client in a new terminal, answering its prompt.
+
+        Returns:
+          A tuple of the output of the terminal and the exit code of the
+          client.
+        """
+        pid, master = pty.fork()
+        if pid == 0:
+            run_client(self.socket_path, self.pid_path)
+        output = b''
+        answered = False
+        deadline = time.time() + timeout_seconds
+        try:
+            while time.time() < deadline:
+                readable, unused_w, unused_x = select.select(
+                    [master], [], [], 0.1)
+                if not readable:
+                    continue
+                try:
+                    data = os.read(master, 4096)
+                except OSError as e:
+                    if e.errno != errno.EIO:
+                        raise
+                    data = b''
+                if not data:
+                    break
+                output += data
+                if not answered and b'Name: ' in output:
+                    # Give the command time to start reading; Python only
+                    # notices a Ctrl-C typed before that once the read
+                    # returns.
+                    time.sleep(0.5)
+                    os.write(master, answer)
+                    answered = True
+            else:
+                self.kill_command()
+                daemon._request(self.socket_path, {'action': 'stop'})
+                os.kill(pid, signal.SIGKILL)
+                self.fail('Timed out; the terminal showed: {!r}'.format(
+                    output))
+        finally:
+            unused_pid, status = os.waitpid(pid, 0)
+            os.close(master)
+        return output.decode('utf-8'), os.WEXITSTATUS(status)
+
+    def test_prompt(self):
+        output, returncode = self.run_in_terminal(b'world\n')
+        self.assertIn('Hello, world', output)
+        self.assertEqual(returncode, greeting_returncode)
+
+    def test_interrupt_prompt(self):
+        output, returncode = self.run_in_terminal(b'\x03')
+        self.assertNotIn('Hello', output)
+        self.assertEqual(returncode, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()